@@ -10,6 +10,7 @@ CREATE TABLE stage.game_data
 , result text
 , create_timestamp timestamp DEFAULT NOW()
 , passed_data_quality_check bool DEFAULT False
+, rejection_reason text
 );
 
 CREATE TABLE stage.player_blobs
@@ -24,12 +25,33 @@ CREATE TABLE stage.player_info
  , details jsonb
  , create_timestamp timestamp
  , passed_data_quality_check bool DEFAULT False
+ , rejection_reason text
+);
+
+-- Progress of chunked loads, committed with each chunk staged so an
+-- interrupted load resumes where it stopped
+CREATE TABLE stage.load_checkpoint
+(
+ source text PRIMARY KEY -- The pipeline and URL being loaded
+ , position bigint -- Bytes of the game CSV, or pages of player data, staged
+ , source_version text -- sha256 of the game CSV being staged
+ , complete bool DEFAULT False
+ , update_timestamp timestamp DEFAULT NOW()
 );
 
 -- The `prepared` schema holds data that has passed quality checks
 -- and has been prepared for consumption
 CREATE SCHEMA prepared;
 
+-- The game tables keyed by game_id are created as single tables. The game
+-- pipeline splits them into hash partitions of the game_id when
+-- `game_partitions` is set in configuration.yml. The pipelines and the
+-- read API plan partition-wise joins and aggregates in their own
+-- transactions. For other readers of the reporting views, a DBA can turn
+-- them on for the reading role:
+-- ALTER ROLE <reporting role> SET enable_partitionwise_join = on;
+-- ALTER ROLE <reporting role> SET enable_partitionwise_aggregate = on;
+
 CREATE TABLE prepared.game_data
 (
  game_id text
@@ -41,17 +63,99 @@ CREATE TABLE prepared.game_data
 );
 
 CREATE INDEX ix_game_data_game_id ON prepared.game_data (game_id);
+CREATE INDEX ix_game_data_player_id ON prepared.game_data (player_id);
 CREATE INDEX ix_game_data_move_number ON prepared.game_data (move_number);
 CREATE INDEX ix_game_dataresult ON prepared.game_data (result);
 
+-- One row per game summarizing its first and concluding moves.
+-- Maintained by the game pipeline after each load
+CREATE TABLE prepared.game_summary
+(
+ game_id text PRIMARY KEY
+, total_moves int
+, initial_player text
+, concluding_player text
+, initial_column int
+, concluding_column int
+, result text
+, winner text
+, loser text
+);
+
+CREATE INDEX ix_game_summary_initial_column ON prepared.game_summary (initial_column);
+CREATE INDEX ix_game_summary_result ON prepared.game_summary (result);
+CREATE INDEX ix_game_summary_winner ON prepared.game_summary (winner);
+CREATE INDEX ix_game_summary_loser ON prepared.game_summary (loser);
+
+-- One row per player with their record in the games of prepared.game_data.
+-- Maintained by the game pipeline after each load, for only the players of
+-- the changed games when loading incrementally
+CREATE TABLE prepared.player_game_stats
+(
+ player_id text PRIMARY KEY
+, games_played int
+, wins int
+, losses int
+, draws int
+, first_game_id text -- The lowest and highest game_id, as games are not dated
+, last_game_id text
+, single_game_id text -- The game of a player who played only one, else NULL
+, single_game_outcome text -- 'won', 'lost', or 'drew' in that game
+);
+
+CREATE INDEX ix_player_game_stats_games_played ON prepared.player_game_stats (games_played);
+
+-- Integer keys for the game and player ids of prepared.packed_game. Keys
+-- are added by the game pipeline and kept across loads
+CREATE TABLE prepared.game_key
+(
+ game_key integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY
+, game_id text NOT NULL UNIQUE
+);
+
+CREATE TABLE prepared.player_key
+(
+ player_key integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY
+, player_id text NOT NULL UNIQUE
+);
+
+-- One row per game of prepared.game_data with its moves packed into one
+-- byte each, for game-level queries that would otherwise read every move.
+-- Maintained by the game pipeline after each load, leaving out games whose
+-- moves can not be packed without loss
+CREATE TABLE prepared.packed_game
+(
+ game_key integer PRIMARY KEY -- Of prepared.game_key
+, first_player integer -- The player_key of the player of move 1
+, second_player integer
+, moves bytea -- The column of each move in order, plus 128 if made by second_player
+, result smallint -- Of the last move: 0 for none, 1 for a win, 2 for a draw
+);
+
+-- Fingerprint of the moves of each game in prepared.game_data, used
+-- by incremental loads to find the games that changed
+CREATE TABLE prepared.game_fingerprint
+(
+ game_id text PRIMARY KEY
+, fingerprint text
+, create_timestamp timestamp DEFAULT NOW()
+);
+
 CREATE TABLE prepared.player_info
 (
  player_id text
  , details jsonb
+ , details_hash text -- md5 of details, used by incremental loads to skip unchanged players
  , create_timestamp timestamp
+ -- Fields of details projected by the player pipeline. The pipeline adds
+ -- the other columns set by `player_detail_columns` in configuration.yml
+ , nationality text
+ , email_address text
 );
 
-CREATE INDEX idx_btree_hobbies ON prepared.player_info USING GIN (details jsonb_ops);
+CREATE INDEX ix_player_info_player_id ON prepared.player_info (player_id);
+CREATE INDEX ix_player_info_nationality ON prepared.player_info (nationality);
+CREATE INDEX ix_player_info_email_address ON prepared.player_info (email_address);
 
 -- The `error` schema holds data that failed quality checks
 CREATE SCHEMA error;
@@ -64,6 +168,7 @@ CREATE TABLE error.game_data
 , "column" text
 , result text
 , create_timestamp timestamp
+, rejection_reason text -- The data quality rule the game failed, or why it is not a legal game
 );
 
 CREATE TABLE error.player_info
@@ -71,8 +176,38 @@ CREATE TABLE error.player_info
  player_id text
  , details jsonb
  , create_timestamp timestamp
+ , rejection_reason text -- The data quality rule the player failed
+);
+
+-- The `shadow` schema holds the new prepared tables built by a shadow
+-- publish until they are swapped into the `prepared` schema
+CREATE SCHEMA shadow;
+
+-- The `generation` schema keeps the prepared tables replaced by recent
+-- shadow publishes so a publish can be rolled back
+CREATE SCHEMA generation;
+
+CREATE SEQUENCE generation.generation_seq;
+
+CREATE TABLE generation.retired_table
+(
+ generation bigint
+ , table_name text -- The prepared table that was replaced
+ , retired_table_name text -- The table in this schema holding the replaced data
+ , retired_timestamp timestamp DEFAULT NOW()
+ , PRIMARY KEY (generation, table_name)
+);
+
+-- The number of loads published, advanced in the transaction of every
+-- publish so readers that cache reporting data know when it changed
+CREATE TABLE generation.load_generation
+(
+ generation bigint NOT NULL
+ , published_timestamp timestamp DEFAULT NOW()
 );
 
+INSERT INTO generation.load_generation (generation) VALUES (0);
+
 -- The `reporting` schema exposes objects that can be consumed for reporting
 CREATE SCHEMA reporting;
 
@@ -86,28 +221,49 @@ FROM prepared.game_data
 CREATE VIEW reporting.game_summary AS
 (
 SELECT game_id
-, concluding_moves.move_number AS total_moves
-, initial_moves.player_id AS initial_player
-, concluding_moves.player_id AS concluding_player
-, initial_moves.column AS initial_column
-, concluding_moves.column AS concluding_column
-, concluding_moves.result AS result
-, CASE WHEN concluding_moves.result = 'win' THEN concluding_moves.player_id ELSE null END AS winner
-, CASE WHEN concluding_moves.result = 'win' THEN 
-(SELECT player_id FROM reporting.player_game WHERE game_id = concluding_moves.game_id 
- 	AND player_id <> concluding_moves.player_id)
-ELSE null END AS loser
-FROM prepared.game_data initial_moves
-JOIN prepared.game_data concluding_moves USING (game_id)
-WHERE initial_moves.move_number = 1
-AND concluding_moves.result <> ''
+, total_moves
+, initial_player
+, concluding_player
+, initial_column
+, concluding_column
+, result
+, winner
+, loser
+FROM prepared.game_summary
+);
+
+CREATE VIEW reporting.player_game_stats AS
+(
+SELECT player_id
+, games_played
+, wins
+, losses
+, draws
+, first_game_id
+, last_game_id
+, single_game_id
+, single_game_outcome
+FROM prepared.player_game_stats
+);
+
+CREATE VIEW reporting.packed_game AS
+(
+SELECT game.game_id
+, first_player.player_id AS first_player
+, second_player.player_id AS second_player
+, packed.moves
+, packed.result
+FROM prepared.packed_game packed
+JOIN prepared.game_key game ON packed.game_key = game.game_key
+JOIN prepared.player_key first_player ON packed.first_player = first_player.player_key
+LEFT JOIN prepared.player_key second_player ON packed.second_player = second_player.player_key
 );
 
 CREATE VIEW reporting.player_details AS
 (
 SELECT player_id
-, details ->> 'nat' as nationality
-, details ->> 'email' as email_address
+, nationality
+, email_address
 , details
 FROM prepared.player_info
 );
@@ -161,22 +317,14 @@ ORDER BY nationality
 -- won, lost, or there was a draw.
 CREATE VIEW reporting.single_game_player AS
 (
-SELECT pg.player_id
-, pg.game_id
+SELECT ps.player_id
+, ps.single_game_id AS game_id
 , pd.email_address
 , pd.nationality
-, CASE WHEN pg.player_id = gs.winner THEN 'won'
-WHEN pg.player_id = gs.loser THEN 'lost'
-ELSE 'drew' END AS player_outcome
-FROM reporting.player_game pg
-JOIN reporting.game_summary gs ON pg.game_id = gs.game_id
-JOIN reporting.player_details pd ON pg.player_id = pd.player_id
-WHERE pg.player_id IN
-(
-SELECT player_id
-FROM reporting.player_game
-GROUP BY player_id
-HAVING COUNT(DISTINCT(game_id)) = 1
-)
+, ps.single_game_outcome AS player_outcome
+FROM reporting.player_game_stats ps
+JOIN reporting.player_details pd ON ps.player_id = pd.player_id
+WHERE ps.games_played = 1
+AND ps.single_game_outcome IS NOT NULL
 AND pd.email_address IS NOT NULL
-);
\ No newline at end of file
+);
@@ -0,0 +1,170 @@
+#! /usr/bin/env python3
+#
+# This script compares the time to answer the three reporting analyses
+# by querying the `reporting` views against computing them offline
+# with `offline_analytics.py`. Synthetic games and players from
+# `benchmarks/synthetic_data.py` are loaded by the pipelines into the
+# database configured in `configuration.yml`, so running this script
+# empties all the tables in the database. The offline analyses are
+# checked to match the views.
+# The results are printed as one JSON object.
+# Run from the project root, for example:
+# python -m benchmarks.analytics_benchmark --moves 1000000 --players 100000
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks import load_benchmark, synthetic_data
+from loaders import load_game_data as games, load_player_data as players
+import offline_analytics
+import utils
+
+# The order of the rows of the views without an ORDER BY, or with ties
+view_queries = {
+    'winning_initial_column': 'SELECT * FROM reporting.winning_initial_column '
+        'ORDER BY initial_column_game_count DESC, initial_column;',
+    'nationality_participation': 'SELECT * FROM reporting.nationality_participation;',
+    'single_game_player': 'SELECT * FROM reporting.single_game_player '
+        'ORDER BY player_id, game_id;',
+}
+
+
+def time_views(config: Dict[Any, Any], repeat: int) -> Dict[str, Any]:
+    """
+    Query each analysis view `repeat` times. Return the median seconds of
+    each view and the rows of the last query.
+    """
+    connection = utils.make_db_connection_from_config(config)
+    results: Dict[str, Any] = {'seconds': {}, 'rows': {}}
+
+    try:
+        cursor = connection.cursor()
+        for name, sql in view_queries.items():
+            seconds: List[float] = []
+            for _ in range(repeat):
+                time1 = time.perf_counter()
+                cursor.execute(sql)
+                results['rows'][name] = cursor.fetchall()
+                seconds.append(time.perf_counter() - time1)
+            results['seconds'][name] = statistics.median(seconds)
+        cursor.close()
+        connection.rollback()
+
+    finally:
+        connection.close()
+
+    return results
+
+
+def time_offline(games_csv_path: str, player_url: str, repeat: int,
+    validate_game_rules: bool) -> Dict[str, Any]:
+    """
+    Read the sources once and compute each analysis `repeat` times. Return
+    the seconds taken to read the sources, the median seconds of each
+    analysis, and the rows of the last run.
+    """
+    results: Dict[str, Any] = {'seconds': {}, 'rows': {}}
+
+    time1 = time.perf_counter()
+    game_data = offline_analytics.read_game_data(games_csv_path, validate_game_rules)
+    time2 = time.perf_counter()
+    player_data = offline_analytics.read_player_data(player_url, 4)
+    time3 = time.perf_counter()
+    offline_analytics.match_players(game_data, player_data)
+    time4 = time.perf_counter()
+    results['read_games_seconds'] = time2 - time1
+    results['read_players_seconds'] = time3 - time2
+    results['match_players_seconds'] = time4 - time3
+
+    analyses = {
+        'winning_initial_column': lambda: offline_analytics.winning_initial_column(game_data),
+        'nationality_participation':
+            lambda: offline_analytics.nationality_participation(game_data, player_data),
+        'single_game_player':
+            lambda: offline_analytics.single_game_player(game_data, player_data),
+    }
+    for name, analysis in analyses.items():
+        seconds: List[float] = []
+        for _ in range(repeat):
+            time1 = time.perf_counter()
+            results['rows'][name] = analysis()
+            seconds.append(time.perf_counter() - time1)
+        results['seconds'][name] = statistics.median(seconds)
+
+    return results
+
+
+def main(arguments: argparse.Namespace) -> Dict[str, Any]:
+    config = utils.load_configuration('./configuration.yml')
+    results: Dict[str, Any] = {'parameters': vars(arguments)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        games_csv_path = os.path.join(directory, 'game_data.csv')
+        results['generated'] = synthetic_data.write_game_csv(games_csv_path, arguments.moves,
+            arguments.player_pool, arguments.invalid_rate, arguments.seed)
+
+        server = load_benchmark.start_source_server(directory, arguments.page_size,
+            arguments.players, arguments.invalid_rate)
+        url = f'http://localhost:{server.server_port}'
+
+        try:
+            connection = utils.make_db_connection_from_config(config)
+            try:
+                cursor = connection.cursor()
+                utils.empty_all_tables(cursor)
+                cursor.close()
+                connection.commit()
+            finally:
+                connection.close()
+
+            time1 = time.perf_counter()
+            games.load_data(f'{url}/game_data.csv', os.path.join(directory, 'downloaded.csv'),
+                False, config['database_server'], config['database_server_port'],
+                config['database'], config['database_user'], config['database_password'], True,
+                games.GameLoadOptions(stream_data=True,
+                validate_game_rules=arguments.validate_game_rules))
+            players.load_data(f'{url}/users', config['database_server'],
+                config['database_server_port'], config['database'], config['database_user'],
+                config['database_password'], True, players.PlayerLoadOptions(download_workers=4))
+            results['database_load_seconds'] = time.perf_counter() - time1
+
+            views = time_views(config, arguments.repeat)
+            offline = time_offline(games_csv_path, f'{url}/users', arguments.repeat,
+                arguments.validate_game_rules)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    results['view_seconds'] = views['seconds']
+    results['offline'] = {name: value for name, value in offline.items() if name != 'rows'}
+    results['matches'] = {name: views['rows'][name] == offline['rows'][name]
+        for name in view_queries}
+    results['row_counts'] = {name: len(rows) for name, rows in views['rows'].items()}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the reporting views with the '
+        'offline analytics engine on synthetic data.')
+    parser.add_argument('--moves', type=int, default=100000,
+        help='the number of game rows to generate')
+    parser.add_argument('--players', type=int, default=10000,
+        help='the number of players served by the player API stand-in')
+    parser.add_argument('--player-pool', type=int, default=10000,
+        help='the number of players that play the generated games')
+    parser.add_argument('--invalid-rate', type=float, default=0.01,
+        help='the fraction of game rows and players made invalid')
+    parser.add_argument('--page-size', type=int, default=1000,
+        help='the number of players in each player page')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--validate-game-rules', action='store_true')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='the number of times each analysis is timed')
+    arguments = parser.parse_args()
+
+    print(json.dumps(main(arguments), indent=2))
@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+#
+# This script compares full reloads of the game data with and without
+# `bulk_load`, which drops the secondary indexes of the prepared game
+# tables before the load and rebuilds them after it. Synthetic games
+# from `benchmarks/synthetic_data.py` are served by a local HTTP
+# stand-in and loaded by `load_game_data.load_data` into the database
+# configured in `configuration.yml`, so running this script empties all
+# the tables in the database. The data is loaded once before timing, so
+# every timed load replaces a full set of games, and the two modes
+# alternate to even out caching.
+# The results are printed as one JSON object with the median seconds of
+# each mode and of the stages that differ between them.
+# Run from the project root, for example:
+# python -m benchmarks.bulk_load_benchmark --moves 2000000
+import argparse
+import json
+import os
+import statistics
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks import load_benchmark, synthetic_data
+from loaders import load_game_data as games
+import utils
+
+compared_stages = ['game_drop_indexes', 'game_move_checked_data', 'game_save_fingerprints',
+    'game_refresh_summary', 'game_rebuild_indexes', 'game_analyze', 'game_commit']
+
+
+def main(arguments: argparse.Namespace) -> Dict[str, Any]:
+    config = utils.load_configuration('./configuration.yml')
+    results: Dict[str, Any] = {'parameters': vars(arguments)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        results['generated'] = synthetic_data.write_game_csv(
+            os.path.join(directory, 'game_data.csv'), arguments.moves,
+            arguments.player_pool, arguments.invalid_rate, arguments.seed)
+
+        server = load_benchmark.start_source_server(directory, 1000, 0, 0.0)
+        url = f'http://localhost:{server.server_port}/game_data.csv'
+
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            utils.empty_all_tables(cursor)
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+
+        def load(bulk_load: bool) -> Any:
+            return load_benchmark.run_stage(games.load_data, url,
+                os.path.join(directory, 'downloaded_game_data.csv'), False,
+                config['database_server'], config['database_server_port'], config['database'],
+                config['database_user'], config['database_password'], True,
+                games.GameLoadOptions(worker_count=arguments.game_workers, bulk_load=bulk_load,
+                index_build_workers=arguments.index_workers))
+
+        try:
+            load(False)
+
+            runs: Dict[str, List[Any]] = {'indexed': [], 'bulk_load': []}
+            for _ in range(arguments.repeat):
+                for mode, bulk_load in (('indexed', False), ('bulk_load', True)):
+                    loaded, seconds, metrics = load(bulk_load)
+                    if not loaded:
+                        raise RuntimeError(f'The {mode} load failed.')
+                    runs[mode].append((seconds, metrics))
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    for mode, mode_runs in runs.items():
+        results[mode] = {'seconds': statistics.median(seconds for seconds, _ in mode_runs),
+            'rows_per_second': results['generated']['rows'] /
+                statistics.median(seconds for seconds, _ in mode_runs),
+            'stage_seconds': {stage: statistics.median(metrics.get(f'{stage}_seconds', 0.0)
+                for _, metrics in mode_runs) for stage in compared_stages}}
+    results['speedup'] = results['indexed']['seconds'] / results['bulk_load']['seconds']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare full reloads of the game data '
+        'with and without deferring index maintenance.')
+    parser.add_argument('--moves', type=int, default=1000000,
+        help='the number of game rows to generate')
+    parser.add_argument('--player-pool', type=int, default=10000,
+        help='the number of players that play the generated games')
+    parser.add_argument('--invalid-rate', type=float, default=0.01,
+        help='the fraction of game rows made invalid')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--game-workers', type=int, default=1)
+    parser.add_argument('--index-workers', type=int, default=4,
+        help='the parallel workers allowed to build each index')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='the number of timed loads in each mode')
+    arguments = parser.parse_args()
+
+    print(json.dumps(main(arguments), indent=2))
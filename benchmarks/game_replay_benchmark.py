@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+#
+# This script measures how many games per second the bitboard
+# replay engine in `loaders/game_replay.py` validates. Random legal
+# games are generated by `benchmarks/synthetic_data.py`, then timed
+# through `replay_games`, which works on arrays, and `check_games`,
+# which also encodes the game rows into arrays as the loaders do.
+# Run from the project root, optionally passing the number of games:
+# python -m benchmarks.game_replay_benchmark 1000000
+import sys
+import time
+
+from benchmarks.synthetic_data import random_games
+from loaders import game_replay
+
+
+def game_rows(grid_columns, move_counts, game_results) -> list:
+    results = {game_replay.no_result: b'', game_replay.win_result: b'win',
+        game_replay.draw_result: b'draw'}
+    games = []
+    for game, (columns, move_count, result) in enumerate(
+        zip(grid_columns.tolist(), move_counts.tolist(), game_results.tolist())):
+        game_id = str(game).encode()
+        players = (b'1' + game_id, b'2' + game_id)
+        games.append([[game_id, players[move % 2], str(move + 1).encode(),
+            str(columns[move]).encode(), results[result] if move == move_count - 1 else b'']
+            for move in range(move_count)])
+    return games
+
+
+def main(game_count: int) -> None:
+    grid_columns, move_counts, game_results = random_games(game_count)
+
+    time1 = time.perf_counter()
+    reasons = game_replay.replay_games(grid_columns, move_counts, game_results)
+    time2 = time.perf_counter()
+    assert not reasons.any(), 'Generated games should all be legal'
+    replay_rate = game_count / (time2 - time1)
+
+    # Encoding rows is done in Python, so time a sample of at most 200000 games
+    sample_count = min(game_count, 200000)
+    rows = game_rows(grid_columns[:sample_count], move_counts[:sample_count],
+        game_results[:sample_count])
+    time1 = time.perf_counter()
+    check_reasons = game_replay.check_games(rows)
+    time2 = time.perf_counter()
+    assert not any(check_reasons), 'Generated games should all be legal'
+    check_rate = sample_count / (time2 - time1)
+
+    print(f'{"function":20} {"games":>10} {"games_per_second":>18} {"games_per_minute":>18}')
+    print(f'{"replay_games":20} {game_count:10} {replay_rate:18.0f} {replay_rate * 60:18.0f}')
+    print(f'{"check_games":20} {sample_count:10} {check_rate:18.0f} {check_rate * 60:18.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
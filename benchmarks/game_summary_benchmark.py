@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+#
+# This script compares the latency of the three analysis views
+# when `reporting.game_summary` and `reporting.single_game_player` are
+# derived from `prepared.game_data` on every query (the original view
+# definitions) and when they read the `prepared.game_summary` and
+# `prepared.player_game_stats` tables maintained by the game pipeline.
+# The `prepared` game tables are filled with synthetic games, so
+# running this script empties all the tables in the database.
+# Run from the project root, optionally passing the number of games:
+# python -m benchmarks.game_summary_benchmark 100000
+import statistics
+import sys
+import time
+
+from loaders import load_game_data as games
+import utils
+
+analysis_views = ['reporting.winning_initial_column',
+    'reporting.nationality_participation', 'reporting.single_game_player']
+
+# The original reporting.game_summary view, which derives the summary on every query
+derived_game_summary_sql = '''
+CREATE OR REPLACE VIEW reporting.game_summary AS
+(
+SELECT game_id
+, concluding_moves.move_number AS total_moves
+, initial_moves.player_id AS initial_player
+, concluding_moves.player_id AS concluding_player
+, initial_moves.column AS initial_column
+, concluding_moves.column AS concluding_column
+, concluding_moves.result AS result
+, CASE WHEN concluding_moves.result = 'win' THEN concluding_moves.player_id ELSE null END AS winner
+, CASE WHEN concluding_moves.result = 'win' THEN 
+(SELECT player_id FROM reporting.player_game WHERE game_id = concluding_moves.game_id 
+ 	AND player_id <> concluding_moves.player_id)
+ELSE null END AS loser
+FROM prepared.game_data initial_moves
+JOIN prepared.game_data concluding_moves USING (game_id)
+WHERE initial_moves.move_number = 1
+AND concluding_moves.result <> ''
+);
+'''
+
+# The original reporting.single_game_player view, which counts the games
+# of every player on every query
+aggregated_single_game_player_sql = '''
+CREATE OR REPLACE VIEW reporting.single_game_player AS
+(
+SELECT pg.player_id
+, pg.game_id
+, pd.email_address
+, pd.nationality
+, CASE WHEN pg.player_id = gs.winner THEN 'won'
+WHEN pg.player_id = gs.loser THEN 'lost'
+ELSE 'drew' END AS player_outcome
+FROM reporting.player_game pg
+JOIN reporting.game_summary gs ON pg.game_id = gs.game_id
+JOIN reporting.player_details pd ON pg.player_id = pd.player_id
+WHERE pg.player_id IN
+(
+SELECT player_id
+FROM reporting.player_game
+GROUP BY player_id
+HAVING COUNT(DISTINCT(game_id)) = 1
+)
+AND pd.email_address IS NOT NULL
+);
+'''
+
+# Nine-move games between two players, where one in five games is a draw
+synthetic_games_sql = '''
+INSERT INTO prepared.game_data (game_id, player_id, move_number, "column", result)
+SELECT game::text
+, CASE WHEN move %% 2 = 1 THEN (game %% 5000)::text ELSE (5000 + game %% 4999)::text END
+, move
+, 1 + (hashtext(game::text || ',' || move::text) & 3)
+, CASE WHEN move < 9 THEN '' WHEN game %% 5 = 0 THEN 'draw' ELSE 'win' END
+FROM generate_series(1, %s) AS game, generate_series(1, 9) AS move;
+'''
+
+synthetic_players_sql = '''
+INSERT INTO prepared.player_info (player_id, details, nationality, email_address)
+SELECT player_id, details, details ->> 'nat', details ->> 'email'
+FROM
+(
+SELECT player::text AS player_id
+, jsonb_build_object('nat', (ARRAY['AU', 'CH', 'ES', 'GB', 'IE', 'NZ', 'TR'])[1 + player % 7],
+    'email', 'player' || player || '@example.com') AS details
+FROM generate_series(0, 9999) AS player
+) AS a;
+'''
+
+
+def time_views(cursor, repeat: int) -> dict:
+    timings = {}
+    for view in analysis_views:
+        seconds = []
+        for _ in range(repeat):
+            time1 = time.perf_counter()
+            cursor.execute(f'SELECT * FROM {view};')
+            cursor.fetchall()
+            seconds.append(time.perf_counter() - time1)
+        timings[view] = statistics.median(seconds)
+    return timings
+
+
+def main(game_count: int, repeat: int = 5) -> None:
+    config = utils.load_configuration('./configuration.yml')
+    connection = utils.make_db_connection_from_config(config)
+
+    try:
+        cursor = connection.cursor()
+        utils.empty_all_tables(cursor)
+        cursor.execute(synthetic_games_sql, (game_count,))
+        cursor.execute(synthetic_players_sql)
+        games.refresh_game_summary(cursor, False)
+        games.refresh_player_stats(cursor, False)
+        cursor.execute('ANALYZE prepared.game_data; ANALYZE prepared.game_summary; '
+            'ANALYZE prepared.player_game_stats; ANALYZE prepared.player_info;')
+        connection.commit()
+
+        after = time_views(cursor, repeat)
+
+        # Time the original views, then put the table-backed views back
+        cursor.execute(derived_game_summary_sql)
+        cursor.execute(aggregated_single_game_player_sql)
+        before = time_views(cursor, repeat)
+        connection.rollback()
+
+        print(f'{game_count} games, median of {repeat} runs')
+        print(f'{"view":40} {"before_ms":>10} {"after_ms":>10} {"speedup":>8}')
+        for view in analysis_views:
+            print(f'{view:40} {before[view] * 1000:10.1f} {after[view] * 1000:10.1f} '
+                f'{before[view] / after[view]:8.1f}')
+
+        utils.empty_all_tables(cursor)
+        cursor.close()
+        connection.commit()
+
+    finally:
+        if connection:
+            connection.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,251 @@
+#! /usr/bin/env python3
+#
+# This script measures the end to end throughput of the game and
+# player pipelines. Synthetic data from `benchmarks/synthetic_data.py`
+# is served by a local HTTP stand-in for the real sources, and
+# `load_game_data.load_data` and `load_player_data.load_data` load it
+# into the database configured in `configuration.yml`, so running
+# this script empties all the tables in the database.
+# The game CSV can be served split into shards and compressed, to measure
+# loads of sharded, compressed exports.
+# The results are printed as one JSON object with the rows per second,
+# peak memory, and the per-stage metrics the pipelines logged, so
+# runs of different versions can be compared.
+# Run from the project root, for example:
+# python -m benchmarks.load_benchmark --moves 1000000 --players 100000
+import argparse
+import functools
+import gzip
+import http.server
+import json
+import os
+import re
+import resource
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List, Tuple
+
+from benchmarks import synthetic_data
+from loaders import load_game_data as games, load_player_data as players
+import logger
+import utils
+
+metric_pattern = re.compile(r'^METRIC: \S+ \S+ (\w+): (\S+)$')
+
+
+class SyntheticSourceHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves the files in the directory given to the handler, and synthetic
+    player pages for `/users?page=N`, generated on demand.
+    """
+    page_size = 1000
+    player_count = 0
+    invalid_rate = 0.0
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/users':
+            super().do_GET()
+            return
+
+        page = int(urllib.parse.parse_qs(url.query)['page'][0])
+        body = json.dumps(synthetic_data.player_page(page, self.page_size, self.player_count,
+            self.invalid_rate)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_source_server(directory: str, page_size: int, player_count: int,
+    invalid_rate: float) -> http.server.ThreadingHTTPServer:
+    handler = type('Handler', (SyntheticSourceHandler,), {'page_size': page_size,
+        'player_count': player_count, 'invalid_rate': invalid_rate})
+    server = http.server.ThreadingHTTPServer(('localhost', 0),
+        functools.partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_game_shards(csv_path: str, shard_count: int, compress: bool) -> List[str]:
+    """
+    Split the game CSV at `csv_path` into `shard_count` shards of about the
+    same number of rows next to it, each with the header line and ending
+    between two games, compressed with gzip if `compress` is True. Return
+    the file names of the shards.
+    """
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        lines = f.readlines()
+
+    names = []
+    start = 0
+    for shard in range(shard_count):
+        end = len(lines) * (shard + 1) // shard_count
+        while 0 < end < len(lines) and \
+            lines[end].split(b',', 1)[0] == lines[end - 1].split(b',', 1)[0]:
+            end += 1
+        name = f'game_data_{shard}.csv' + ('.gz' if compress else '')
+        content = header + b''.join(lines[start:end])
+        with open(os.path.join(os.path.dirname(csv_path), name), 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=6) if compress else content)
+        names.append(name)
+        start = end
+    return names
+
+
+def peak_memory_kb() -> Dict[str, int]:
+    """
+    Return the peak resident memory in kilobytes of this process and of
+    its largest finished worker process, as reported by Linux.
+    """
+    return {'process': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def run_stage(pipeline: Any, *args: Any, **kwargs: Any) -> Tuple[bool, float, Dict[str, float]]:
+    """
+    Call `pipeline` with `args` and `kwargs`. Return whether it succeeded,
+    the seconds it took, and the metrics it wrote to the log.
+    """
+    log_size = os.path.getsize(logger.default_log_file) \
+        if os.path.exists(logger.default_log_file) else 0
+
+    time1 = time.perf_counter()
+    loaded = pipeline(*args, **kwargs)
+    time2 = time.perf_counter()
+
+    metrics = {}
+    with open(logger.default_log_file, 'r') as f:
+        f.seek(log_size)
+        for line in f:
+            match = metric_pattern.match(line.rstrip('\n'))
+            if match:
+                metrics[match.group(1)] = float(match.group(2))
+
+    return loaded, time2 - time1, metrics
+
+
+def count_rows(config: Dict[Any, Any]) -> Dict[str, int]:
+    connection = utils.make_db_connection_from_config(config)
+
+    try:
+        cursor = connection.cursor()
+        counts = {}
+        for table in ['prepared.game_data', 'error.game_data', 'prepared.player_info',
+            'error.player_info']:
+            cursor.execute(f'SELECT COUNT(*) FROM {table};')
+            counts[table] = cursor.fetchone()[0]
+        cursor.close()
+
+    finally:
+        connection.close()
+
+    return counts
+
+
+def main(arguments: argparse.Namespace) -> Dict[str, Any]:
+    config = utils.load_configuration('./configuration.yml')
+    results: Dict[str, Any] = {'parameters': vars(arguments)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        time1 = time.perf_counter()
+        results['generated'] = synthetic_data.write_game_csv(
+            os.path.join(directory, 'game_data.csv'), arguments.moves,
+            arguments.player_pool, arguments.invalid_rate, arguments.seed)
+        time2 = time.perf_counter()
+        results['generate_seconds'] = time2 - time1
+
+        game_files = ['game_data.csv']
+        if arguments.game_shards > 1 or arguments.compress:
+            game_files = write_game_shards(os.path.join(directory, 'game_data.csv'),
+                arguments.game_shards, arguments.compress)
+        results['game_source_bytes'] = sum(os.path.getsize(os.path.join(directory, name))
+            for name in game_files)
+
+        server = start_source_server(directory, arguments.page_size, arguments.players,
+            arguments.invalid_rate)
+        url = f'http://localhost:{server.server_port}'
+
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            utils.empty_all_tables(cursor)
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+
+        try:
+            game_urls = [f'{url}/{name}' for name in game_files]
+            loaded, seconds, metrics = run_stage(games.load_data,
+                game_urls[0] if len(game_urls) == 1 else game_urls,
+                os.path.join(directory, 'downloaded_game_data.csv'), False,
+                config['database_server'], config['database_server_port'], config['database'],
+                config['database_user'], config['database_password'], True,
+                games.GameLoadOptions(stream_data=arguments.stream,
+                validate_in_stream=arguments.validate_in_stream,
+                validate_game_rules=arguments.validate_game_rules,
+                worker_count=arguments.game_workers, source_workers=arguments.source_workers))
+            results['game'] = {'loaded': loaded, 'seconds': seconds,
+                'rows_per_second': results['generated']['rows'] / seconds,
+                'peak_memory_kb': peak_memory_kb(), 'metrics': metrics}
+
+            loaded, seconds, metrics = run_stage(players.load_data, f'{url}/users',
+                config['database_server'], config['database_server_port'], config['database'],
+                config['database_user'], config['database_password'], True,
+                players.PlayerLoadOptions(download_workers=arguments.player_workers))
+            results['player'] = {'loaded': loaded, 'seconds': seconds,
+                'rows_per_second': arguments.players / seconds,
+                'peak_memory_kb': peak_memory_kb(), 'metrics': metrics}
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    results['row_counts'] = count_rows(config)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the throughput of the '
+        'game and player pipelines with synthetic data.')
+    parser.add_argument('--moves', type=int, default=100000,
+        help='the number of game rows to generate')
+    parser.add_argument('--players', type=int, default=10000,
+        help='the number of players served by the player API stand-in')
+    parser.add_argument('--player-pool', type=int, default=1000,
+        help='the number of players that play the generated games')
+    parser.add_argument('--invalid-rate', type=float, default=0.01,
+        help='the fraction of game rows and players made invalid')
+    parser.add_argument('--page-size', type=int, default=1000,
+        help='the number of players in each player page')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stream', action='store_true',
+        help='stream the game data instead of downloading it first')
+    parser.add_argument('--validate-in-stream', action='store_true')
+    parser.add_argument('--validate-game-rules', action='store_true')
+    parser.add_argument('--game-workers', type=int, default=1)
+    parser.add_argument('--game-shards', type=int, default=1,
+        help='the number of shards the game CSV is served in')
+    parser.add_argument('--compress', action='store_true',
+        help='serve the game CSV shards compressed with gzip')
+    parser.add_argument('--source-workers', type=int, default=4,
+        help='the number of game CSV shards read concurrently')
+    parser.add_argument('--player-workers', type=int, default=4)
+    parser.add_argument('--output', help='write the results to this file instead of printing')
+    arguments = parser.parse_args()
+
+    results = main(arguments)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
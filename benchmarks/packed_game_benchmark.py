@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+#
+# This script compares game-level queries answered from the per-move
+# `prepared.game_data` table with the same queries answered from the
+# per-game `prepared.packed_game` table maintained by the game pipeline,
+# printing the pages of each table and the median latency of each query.
+# It also times decoding every packed game in Python with
+# `packed_games.read_packed_games`. The `prepared` game tables are filled
+# with synthetic games, so running this script empties all the tables in
+# the database.
+# Run from the project root, optionally passing the number of games:
+# python -m benchmarks.packed_game_benchmark 100000
+import statistics
+import sys
+import time
+
+from benchmarks import game_summary_benchmark
+from loaders import load_game_data as games, packed_games
+import utils
+
+# Each query over the moves and its equivalent over the packed games
+game_queries = {
+    'winning_first_column': ('''
+        SELECT first_column, COUNT(*)
+        FROM
+        (
+        SELECT (array_agg("column" ORDER BY move_number))[1] AS first_column
+        , MAX(result) AS result
+        FROM prepared.game_data
+        GROUP BY game_id
+        ) AS game
+        WHERE result = 'win'
+        GROUP BY first_column;
+        ''', '''
+        SELECT get_byte(moves, 0) & 127, COUNT(*)
+        FROM prepared.packed_game
+        WHERE result = 1
+        GROUP BY 1;
+        '''),
+    'wins_by_player': ('''
+        SELECT player_id, COUNT(*)
+        FROM
+        (
+        SELECT (array_agg(player_id ORDER BY move_number DESC))[1] AS player_id
+        , MAX(result) AS result
+        FROM prepared.game_data
+        GROUP BY game_id
+        ) AS game
+        WHERE result = 'win'
+        GROUP BY player_id;
+        ''', '''
+        SELECT player_id, COUNT(*)
+        FROM prepared.packed_game
+        JOIN prepared.player_key ON player_key = CASE
+            WHEN get_byte(moves, length(moves) - 1) & 128 = 0 THEN first_player
+            ELSE second_player END
+        WHERE result = 1
+        GROUP BY 1;
+        '''),
+}
+
+
+def median_seconds(cursor, sql: str, repeat: int) -> float:
+    seconds = []
+    for _ in range(repeat):
+        time1 = time.perf_counter()
+        cursor.execute(sql)
+        cursor.fetchall()
+        seconds.append(time.perf_counter() - time1)
+    return statistics.median(seconds)
+
+
+def main(game_count: int, repeat: int = 5) -> None:
+    config = utils.load_configuration('./configuration.yml')
+    connection = utils.make_db_connection_from_config(config)
+
+    try:
+        cursor = connection.cursor()
+        utils.empty_all_tables(cursor)
+        cursor.execute(game_summary_benchmark.synthetic_games_sql, (game_count,))
+        games.refresh_packed_games(cursor, False)
+        cursor.execute('ANALYZE prepared.game_data; ANALYZE prepared.packed_game;')
+        connection.commit()
+
+        cursor.execute("SELECT pg_relation_size('prepared.game_data') / 8192, "
+            "pg_relation_size('prepared.packed_game') / 8192;")
+        move_pages, packed_pages = cursor.fetchone()
+        print(f'{game_count} games, median of {repeat} runs')
+        print(f'pages: game_data {move_pages}, packed_game {packed_pages}, '
+            f'ratio {move_pages / max(packed_pages, 1):.1f}')
+
+        print(f'{"query":24} {"moves_ms":>10} {"packed_ms":>10} {"speedup":>8}')
+        for name, (moves_sql, packed_sql) in game_queries.items():
+            cursor.execute(moves_sql)
+            moves_rows = sorted(cursor.fetchall())
+            cursor.execute(packed_sql)
+            if sorted(cursor.fetchall()) != moves_rows:
+                raise AssertionError(f'The packed games give different results for {name}.')
+
+            moves_seconds = median_seconds(cursor, moves_sql, repeat)
+            packed_seconds = median_seconds(cursor, packed_sql, repeat)
+            print(f'{name:24} {moves_seconds * 1000:10.1f} {packed_seconds * 1000:10.1f} '
+                f'{moves_seconds / packed_seconds:8.1f}')
+        connection.commit()
+
+        time1 = time.perf_counter()
+        decoded = sum(1 for game in packed_games.read_packed_games(connection) if game.winner)
+        seconds = time.perf_counter() - time1
+        print(f'decoded {game_count} packed games ({decoded} won) in {seconds * 1000:.1f} ms')
+
+        utils.empty_all_tables(cursor)
+        cursor.close()
+        connection.commit()
+
+    finally:
+        if connection:
+            connection.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
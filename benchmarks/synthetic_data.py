@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+#
+# This script generates synthetic Drop Token data at a configurable
+# size for the benchmarks. Games are random legal games between
+# players drawn from a pool, written as a game CSV in the format of
+# the real source. Player pages are generated on demand in the format
+# of the player API, so millions of players need little memory.
+# A controlled fraction of game rows and players is made invalid so
+# the data quality checks have work to do.
+# Run from the project root, passing the CSV path and number of moves:
+# python -m benchmarks.synthetic_data ./synthetic_game_data.csv 1000000
+import json
+import numpy as np
+import random
+import sys
+from typing import Any, Dict, List
+
+from loaders import game_replay
+
+result_names = {game_replay.no_result: '', game_replay.win_result: 'win',
+    game_replay.draw_result: 'draw'}
+
+nationalities = ['AU', 'BR', 'CA', 'CH', 'DE', 'DK', 'ES', 'FI', 'FR', 'GB', 'IE', 'IR',
+    'NO', 'NL', 'NZ', 'TR', 'US']
+
+first_names = ['wayne', 'soledad', 'amelia', 'noah', 'lucas', 'emma', 'mia', 'liam', 'ella',
+    'oliver', 'ava', 'leo']
+
+last_names = ['simpson', 'caballero', 'martin', 'fontai', 'wilson', 'kaya', 'moreau',
+    'hansen', 'walker', 'murphy', 'lambert', 'brown']
+
+
+def random_games(game_count: int, seed: int = 0):
+    """
+    Generate `game_count` random legal games. Return the grid of columns
+    dropped into at each move, the number of moves in each game, and the
+    result code of each game.
+    """
+    rng = np.random.default_rng(seed)
+    games = np.arange(game_count)
+    grid_columns = np.zeros((game_count, game_replay.max_moves), dtype=np.int64)
+    heights = np.zeros((game_count, game_replay.columns), dtype=np.int64)
+    boards = np.zeros((2, game_count), dtype=np.uint16)
+    move_counts = np.full(game_count, game_replay.max_moves, dtype=np.int64)
+    game_results = np.full(game_count, game_replay.draw_result, dtype=np.int8)
+
+    for move in range(game_replay.max_moves):
+        playing = move < move_counts
+        choice = rng.random((game_count, game_replay.columns))
+        choice[heights >= game_replay.rows] = -1
+        column = choice.argmax(axis=1)
+        grid_columns[playing, move] = column[playing] + 1
+
+        bit = np.left_shift(1, column * game_replay.rows + heights[games, column])
+        board = boards[move % 2]
+        board[playing] |= bit[playing].astype(np.uint16)
+        heights[games[playing], column[playing]] += 1
+
+        won = playing & ((board[:, None] & game_replay.winning_lines)
+            == game_replay.winning_lines).any(axis=1)
+        move_counts[won] = move + 1
+        game_results[won] = game_replay.win_result
+
+    return grid_columns, move_counts, game_results
+
+
+def game_lines(first_game_id: int, grid_columns: np.ndarray, move_counts: np.ndarray,
+    game_results: np.ndarray, game_players: np.ndarray, invalid_rows: np.ndarray,
+    rng: np.random.Generator) -> List[str]:
+    """
+    Format the moves of a batch of games, numbered from `first_game_id`,
+    as game CSV lines. `game_players` holds the two player ids of each game,
+    and the rows where `invalid_rows` is True are given a value that fails
+    the data quality checks.
+    """
+    made = np.arange(game_replay.max_moves) < move_counts[:, None]
+    game_index, move_index = np.nonzero(made)
+
+    game_ids = (game_index + first_game_id).tolist()
+    players = [str(player) for player in
+        game_players[game_index, move_index % 2].tolist()]
+    move_numbers = [str(move) for move in (move_index + 1).tolist()]
+    columns = [str(column) for column in grid_columns[game_index, move_index].tolist()]
+    last_move = move_index == move_counts[game_index] - 1
+    results = [result_names[result] if last else '' for result, last in
+        zip(game_results[game_index].tolist(), last_move.tolist())]
+
+    # A non-integer move number, a column off the grid, an unknown result,
+    # or a third player
+    for row, kind in zip(np.nonzero(invalid_rows)[0].tolist(),
+        rng.integers(0, 4, size=len(game_ids)).tolist()):
+        if kind == 0:
+            move_numbers[row] = 'x'
+        elif kind == 1:
+            columns[row] = '9'
+        elif kind == 2:
+            results[row] = 'lose'
+        else:
+            players[row] = 'intruder'
+
+    return [f'{game_id},{player},{move_number},{column},{result}' for
+        game_id, player, move_number, column, result in
+        zip(game_ids, players, move_numbers, columns, results)]
+
+
+def write_game_csv(path: str, move_count: int, player_count: int = 1000,
+    invalid_rate: float = 0.0, seed: int = 0, batch_games: int = 100000) -> Dict[str, int]:
+    """
+    Write a game CSV to `path` with about `move_count` rows of random legal
+    games between players drawn from `player_count` players, generating
+    `batch_games` games at a time. A fraction `invalid_rate` of the rows is
+    made invalid. Return the number of rows and games written, and the
+    number of invalid rows, of games with an invalid row, and of rows in
+    those games, which the data quality checks should reject.
+    """
+    rng = np.random.default_rng(seed)
+    counts = {'rows': 0, 'games': 0, 'invalid_rows': 0, 'invalid_games': 0,
+        'rejected_rows': 0}
+
+    with open(path, 'w') as f:
+        f.write('game_id,player_id,move_number,column,result\n')
+
+        batch = 0
+        while counts['rows'] < move_count:
+            grid_columns, move_counts, game_results = random_games(batch_games,
+                seed * 1000003 + batch)
+            batch += 1
+
+            # Keep the games that start before the requested number of rows
+            game_ends = np.cumsum(move_counts)
+            kept = int(np.searchsorted(game_ends - move_counts, move_count - counts['rows']))
+            grid_columns, move_counts, game_results = \
+                grid_columns[:kept], move_counts[:kept], game_results[:kept]
+
+            first_players = rng.integers(0, player_count, size=kept)
+            second_players = (first_players + rng.integers(1, player_count, size=kept)) \
+                % player_count
+            game_players = np.stack([first_players, second_players], axis=1)
+
+            row_count = int(move_counts.sum())
+            invalid_rows = rng.random(row_count) < invalid_rate
+            lines = game_lines(counts['games'] + 1, grid_columns, move_counts, game_results,
+                game_players, invalid_rows, rng)
+            f.write('\n'.join(lines) + '\n')
+
+            invalid_games = np.add.reduceat(invalid_rows.astype(np.int64),
+                game_ends[:kept] - move_counts) > 0
+            counts['rows'] += row_count
+            counts['games'] += kept
+            counts['invalid_rows'] += int(invalid_rows.sum())
+            counts['invalid_games'] += int(invalid_games.sum())
+            counts['rejected_rows'] += int(move_counts[invalid_games].sum())
+
+    return counts
+
+
+def player_page(page: int, page_size: int, player_count: int, invalid_rate: float = 0.0,
+    seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generate page number `page` of `page_size` players from the
+    `player_count` players with ids 0 to `player_count` - 1, in the format
+    of the player API. Pages past the last player are empty. A fraction
+    `invalid_rate` of the players are missing their `data` key. The same
+    arguments always generate the same page.
+    """
+    rng = random.Random(f'{seed}:{page}')
+    players = []
+    for player_id in range(page * page_size, min((page + 1) * page_size, player_count)):
+        first_name = rng.choice(first_names)
+        last_name = rng.choice(last_names)
+        details = {
+            'nat': rng.choice(nationalities),
+            'dob': f'{rng.randint(1950, 2000)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02} '
+                f'{rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02}',
+            'name': {'title': rng.choice(['mr', 'ms', 'mrs']), 'first': first_name,
+                'last': last_name},
+            'email': f'{first_name}.{last_name}{player_id}@example.com',
+            'gender': rng.choice(['female', 'male']),
+            'phone': f'{rng.randint(100, 999)}-{rng.randint(100, 999)}-{rng.randint(100, 999)}',
+            'login': {'username': f'{first_name}{player_id}', 'password': 'password',
+                'salt': '%08x' % rng.getrandbits(32), 'md5': '%032x' % rng.getrandbits(128)},
+            'registered': f'{rng.randint(2002, 2020)}-{rng.randint(1, 12):02}-'
+                f'{rng.randint(1, 28):02} 00:00:00',
+        }
+        key = 'dataBLAH' if rng.random() < invalid_rate else 'data'
+        players.append({'id': player_id, key: details})
+
+    return players
+
+
+def main(path: str, move_count: int) -> None:
+    counts = write_game_csv(path, move_count, invalid_rate=0.01)
+    print(json.dumps(counts))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
@@ -9,23 +9,27 @@
 # The script assumes that both the games and players
 # data sets are complete data sets each time the script runs.
 # Data in the `prepared` schema tables is removed before
-# new data gets added.
-from loaders import load_game_data as games, load_player_data as players
+# new data gets added, unless `incremental_game_load` is
+# or `incremental_player_load` is set, in which case only
+# changed games or players are written.
+# The game and player pipelines run concurrently, and
+# the data of each pipeline that succeeds is published
+# once both have finished.
+from loaders import load_all_data
+import logger
+import query_profiler
 import utils
 
 local_games_csv_path = './game_data.csv'
 
-config = utils.load_configuration('./configuration.yml')
-
-games.load_data(config['game_data_csv_location'], local_games_csv_path, False,
-    config['database_server'], config['database_server_port'], config['database'],
-    config['database_user'], config['database_password'], True)
-
-players.load_data(config['player_data_location'], config['database_server'], 
-    config['database_server_port'], config['database'], config['database_user'], 
-    config['database_password'], True)
-
-
-
-
-
+# Game shards are loaded by worker processes, which import this module
+if __name__ == '__main__':
+    config = utils.load_configuration('./configuration.yml')
+    logger.configure_metrics(config.get('metrics_file', logger.default_metrics_file),
+        config.get('prometheus_metrics_file', logger.default_prometheus_file))
+    if config.get('profile_queries', False):
+        query_profiler.configure_profiling(
+            config.get('query_plans_file') or query_profiler.default_plans_file,
+            config.get('query_plan_size_threshold_bytes',
+                query_profiler.default_size_threshold_bytes))
+    load_all_data.load_data(config, local_games_csv_path)
@@ -0,0 +1,81 @@
+import hashlib
+import psycopg2
+from typing import List, Optional
+
+checkpoint_table = 'stage.load_checkpoint'
+
+
+class Checkpoint:
+    """
+    The progress of a chunked load of a source into the stage tables:
+    the `position`, in bytes of the game CSV or pages of player data,
+    staged, the `source_version` being staged, and whether staging is
+    `complete`.
+    """
+
+    def __init__(self, position: int, source_version: Optional[str], complete: bool):
+        self.position = position
+        self.source_version = source_version
+        self.complete = complete
+
+
+def content_version(content: bytes) -> str:
+    """
+    Return the sha256 of `content`, which tells whether a chunked load of
+    the source it was read from can be resumed.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_version(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Return the sha256 of the file at `path`, which tells whether a chunked
+    load of it can be resumed.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_checkpoint(cursor: psycopg2.extensions.cursor, source: str) -> Optional[Checkpoint]:
+    cursor.execute(f'SELECT position, source_version, complete FROM {checkpoint_table} '
+        'WHERE source = %s;', (source,))
+    row = cursor.fetchone()
+    return Checkpoint(*row) if row else None
+
+
+def save_checkpoint(cursor: psycopg2.extensions.cursor, source: str, position: int,
+    source_version: Optional[str] = None, complete: bool = False) -> None:
+    """
+    Using `cursor`, record that `position` bytes or pages of `source` are
+    staged. Commit it with the chunk it records, so the checkpoint never
+    runs ahead of the stage tables.
+    """
+    cursor.execute(f'''
+    INSERT INTO {checkpoint_table} (source, position, source_version, complete)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (source) DO UPDATE
+    SET position = EXCLUDED.position
+    , source_version = EXCLUDED.source_version
+    , complete = EXCLUDED.complete
+    , update_timestamp = NOW();
+    ''', (source, position, source_version, complete))
+
+
+def clear_checkpoint(cursor: psycopg2.extensions.cursor, source: str,
+    stage_tables: List[str]) -> bool:
+    """
+    Using `cursor`, delete the checkpoint of `source`, and if there was one,
+    empty `stage_tables` of the chunks it staged. Return whether there was
+    a checkpoint.
+    """
+    cursor.execute(f'DELETE FROM {checkpoint_table} WHERE source = %s RETURNING source;',
+        (source,))
+    if cursor.fetchone() is None:
+        return False
+
+    for table in stage_tables:
+        cursor.execute(f'TRUNCATE TABLE {table};')
+    return True
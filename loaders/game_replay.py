@@ -0,0 +1,154 @@
+import numpy as np
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Drop Token is played on a 4x4 grid. Each player's tokens are kept in a
+# 16 bit board where the token in column c (0-3) at height h (0-3) is bit
+# c * 4 + h. Moves number the columns 1-4, but the data quality rules have
+# always accepted column 0 as well, so games that use it are not replayed
+# and are left to a `range` rule with a `min` of 1 to reject.
+columns = 4
+rows = 4
+max_moves = columns * rows
+
+# The four vertical, four horizontal, and two diagonal lines of four
+winning_lines = np.array(
+    [sum(1 << (c * rows + h) for h in range(rows)) for c in range(columns)]
+    + [sum(1 << (c * rows + h) for c in range(columns)) for h in range(rows)]
+    + [sum(1 << (i * rows + i) for i in range(rows)),
+        sum(1 << (i * rows + rows - 1 - i) for i in range(rows))],
+    dtype=np.uint16)
+
+# Result codes
+no_result = 0
+win_result = 1
+draw_result = 2
+result_codes = {b'': no_result, b'win': win_result, b'draw': draw_result,
+    '': no_result, 'win': win_result, 'draw': draw_result}
+
+# Reason codes for games that are not legal, in the order they are checked
+legal = 0
+reasons = ['', 'move_sequence', 'players_not_alternating', 'result_not_on_last_move',
+    'invalid_column', 'column_overflow', 'move_after_win', 'result_mismatch']
+move_sequence, players_not_alternating, result_not_on_last_move, invalid_column, \
+    column_overflow, move_after_win, result_mismatch = range(1, len(reasons))
+
+
+def encode_moves(game_index: np.ndarray, move_number: np.ndarray, column: np.ndarray,
+    player: np.ndarray, result: np.ndarray, game_count: int) \
+    -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Arrange the moves of `game_count` games, given as flat arrays with one
+    entry per move, into a grid with one row per game and one column per
+    move number. `player` holds integer player ids and `result` result
+    codes. Return the grid of columns, the number of moves in each game,
+    the result code of each game, and the reason code of games whose move
+    numbers, players, or results are not laid out as in a legal game.
+    """
+    move_counts = np.bincount(game_index, minlength=game_count)
+    reason = np.zeros(game_count, dtype=np.int8)
+
+    # Move numbers must run from 1 to the number of moves, at most 16
+    in_range = (move_number >= 1) & (move_number <= np.minimum(move_counts[game_index], max_moves))
+    slot = np.where(in_range, move_number - 1, 0)
+    occupancy = np.zeros((game_count, max_moves), dtype=np.int32)
+    np.add.at(occupancy, (game_index, slot), 1)
+    expected_occupancy = np.arange(max_moves) < move_counts[:, None]
+    bad_sequence = np.bincount(game_index[~in_range], minlength=game_count) > 0
+    bad_sequence |= (occupancy != expected_occupancy).any(axis=1)
+    reason[bad_sequence] = move_sequence
+
+    grid_columns = np.zeros((game_count, max_moves), dtype=np.int64)
+    grid_players = np.full((game_count, max_moves), -1, dtype=np.int64)
+    grid_results = np.zeros((game_count, max_moves), dtype=np.int8)
+    grid_columns[game_index, slot] = column
+    grid_players[game_index, slot] = player
+    grid_results[game_index, slot] = result
+
+    # Odd moves are made by the first player and even moves by the second
+    moves = np.arange(max_moves)
+    made = moves < move_counts[:, None]
+    first_player = grid_players[:, :1]
+    second_player = grid_players[:, 1:2]
+    expected_player = np.where(moves % 2 == 0, first_player, second_player)
+    not_alternating = ((grid_players != expected_player) & made).any(axis=1)
+    not_alternating |= (first_player[:, 0] == second_player[:, 0]) & (move_counts > 1)
+    reason[(reason == legal) & not_alternating] = players_not_alternating
+
+    # Only the last move may have a result
+    last_move = moves == (move_counts[:, None] - 1)
+    misplaced_result = ((grid_results != no_result) & ~last_move).any(axis=1)
+    reason[(reason == legal) & misplaced_result] = result_not_on_last_move
+
+    game_results = grid_results[np.arange(game_count), np.maximum(move_counts - 1, 0)]
+    return grid_columns, move_counts, game_results, reason
+
+
+def replay_games(grid_columns: np.ndarray, move_counts: np.ndarray,
+    game_results: np.ndarray) -> np.ndarray:
+    """
+    Replay a batch of games, given as the grid of columns (1-4) dropped into
+    at each move, the number of moves in each game, and the result code of
+    each game. All games are replayed together one move number at a time,
+    except games that drop into column 0, which are not replayed. Return the
+    reason code of each game that is not legal, or 0.
+    """
+    game_count = len(move_counts)
+    games = np.arange(game_count)
+    boards = np.zeros((2, game_count), dtype=np.uint16)
+    heights = np.zeros((game_count, columns), dtype=np.int8)
+    won_at = np.full(game_count, -1, dtype=np.int8)
+    reason = np.zeros(game_count, dtype=np.int8)
+    made = np.arange(max_moves) < move_counts[:, None]
+    replayed = ~((grid_columns[:, :max_moves] == 0) & made).any(axis=1)
+
+    for move in range(max_moves):
+        playing = (move < move_counts) & (reason == legal) & replayed
+        if not playing.any():
+            break
+
+        column = grid_columns[:, move].astype(np.int64) - 1
+        reason[playing & (won_at >= 0)] = move_after_win
+        reason[playing & ((column < 0) | (column >= columns))] = invalid_column
+        column = np.clip(column, 0, columns - 1)
+        height = heights[games, column]
+        reason[playing & (reason == legal) & (height >= rows)] = column_overflow
+
+        dropping = playing & (reason == legal)
+        bit = np.left_shift(1, column * rows + np.minimum(height, rows - 1)).astype(np.uint16)
+        board = boards[move % 2]
+        board[dropping] |= bit[dropping]
+        heights[games[dropping], column[dropping]] += 1
+
+        wins = ((board[:, None] & winning_lines) == winning_lines).any(axis=1)
+        won_at[dropping & wins & (won_at < 0)] = move
+
+    won = won_at >= 0
+    expected_result = np.where(won, win_result,
+        np.where(move_counts == max_moves, draw_result, no_result))
+    reason[(reason == legal) & replayed & (game_results != expected_result)] = result_mismatch
+    return reason
+
+
+def check_games(games: Sequence[Sequence[Sequence[Any]]]) -> List[str]:
+    """
+    Check that each game in `games`, given as its rows of game_id, player_id,
+    move_number, column, and result as bytes or strings, with integer
+    move_number and column, is a legal game of Drop Token. Return the reason
+    each game is not legal, or an empty string for legal games.
+    """
+    rows = [row for game_rows in games for row in game_rows]
+    player_ids: Dict[Any, int] = {}
+    field = lambda values, dtype: np.fromiter(values, dtype=dtype, count=len(rows))
+
+    game_index = np.repeat(np.arange(len(games)), np.fromiter((len(game_rows)
+        for game_rows in games), dtype=np.int64, count=len(games)))
+    move_number = field((min(int(row[2]), max_moves + 1) for row in rows), np.int64)
+    column = field((min(int(row[3]), columns + 1) for row in rows), np.int64)
+    player = field((player_ids.setdefault(row[1], len(player_ids)) for row in rows), np.int64)
+    result = field((result_codes.get(row[4], -1) for row in rows), np.int8)
+
+    grid_columns, move_counts, game_results, reason = encode_moves(game_index, move_number,
+        column, player, result, len(games))
+    replay_reason = replay_games(grid_columns, move_counts, game_results)
+    reason = np.where(reason == legal, replay_reason, reason)
+    return [reasons[code] for code in reason]
@@ -0,0 +1,364 @@
+import collections
+import datetime
+import glob
+import gzip
+import queue
+import threading
+from typing import BinaryIO, Deque, List, Optional, Union
+
+import logger
+import utils
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+# The first bytes of each compressed format a game source can be in
+gzip_magic = b'\x1f\x8b'
+zstd_magic = b'\x28\xb5\x2f\xfd'
+
+
+def is_url(location: str) -> bool:
+    return location.startswith(('http://', 'https://'))
+
+
+def expand_locations(locations: Union[str, List[str]]) -> List[str]:
+    """
+    Return the shard locations of the game data at `locations`, a URL or
+    local path or a list of them. Local paths can be glob patterns, which
+    are expanded to the matching files in name order. Raise a ValueError if
+    there are no locations or a local path matches no files.
+    """
+    shards = []
+    for location in [locations] if isinstance(locations, str) else locations:
+        if is_url(location):
+            shards.append(location)
+            continue
+        matches = sorted(glob.glob(location))
+        if not matches:
+            raise ValueError(f'The game data location {location} matches no files.')
+        shards.extend(matches)
+
+    if not shards:
+        raise ValueError('No game data location is set.')
+    return shards
+
+
+def source_name(locations: Union[str, List[str]]) -> str:
+    """
+    Return the name the game data at `locations` is tracked by in the load
+    checkpoints and the source cache, which is the location itself when
+    there is only one.
+    """
+    return locations if isinstance(locations, str) else ' '.join(locations)
+
+
+class CountingReader:
+    """
+    Wraps the readable `source` of a shard, counting the bytes read from it
+    in `bytes_read`. `peek` returns the first bytes without consuming them,
+    so the compression can be detected on a stream that can not seek.
+    """
+
+    def __init__(self, source: utils.Readable):
+        self.source = source
+        self.bytes_read = 0
+        # Bytes are deleted from the front of a bytearray without copying the rest
+        self._buffer = bytearray()
+
+
+    def peek(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            chunk = self.source.read(size - len(self._buffer))
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            self._buffer += chunk
+        return bytes(self._buffer[:size])
+
+
+    def read(self, size: int = -1) -> bytes:
+        if self._buffer:
+            data = bytes(self._buffer if size < 0 else self._buffer[:size])
+            del self._buffer[:len(data)]
+            return data
+        data = self.source.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def detect_compression(source: CountingReader) -> str:
+    """
+    Return the compression of `source` from its first bytes: 'gzip',
+    'zstd', or 'none'.
+    """
+    start = source.peek(len(zstd_magic))
+    if start.startswith(gzip_magic):
+        return 'gzip'
+    if start.startswith(zstd_magic):
+        return 'zstd'
+    return 'none'
+
+
+def decompressing_reader(source: CountingReader, compression: str) -> utils.Readable:
+    """
+    Return a reader of the decompressed bytes of `source`, which holds
+    data with `compression`. Each read decompresses only as much as it
+    returns, so memory stays bounded however large the shard is. Raise a
+    ValueError for zstd data when the zstandard package is not installed.
+    """
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=source, mode='rb')  # type: ignore
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('Reading zstd compressed game data needs the zstandard package.')
+        return zstandard.ZstdDecompressor().stream_reader(source,  # type: ignore
+            read_across_frames=True)
+    return source
+
+
+class ShardStats:
+    """
+    The progress of reading one shard of the game data at `location`: its
+    `compression`, the `compressed_bytes` read from it and the `bytes` and
+    `rows` after decompression, excluding the header line, and the
+    `seconds` taken.
+    """
+
+    def __init__(self, location: str):
+        self.location = location
+        self.compression = 'none'
+        self.compressed_bytes = 0
+        self.bytes = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+
+class GameSourceReader:
+    """
+    File-like reader of the game data in the shards at `locations`, each a
+    URL or local path to a CSV that is uncompressed or compressed with gzip
+    or zstd, that can be handed to `cursor.copy_expert`. Up to
+    `worker_count` background threads read and decompress shards
+    concurrently, `chunk_size` bytes at a time, and queue whole lines of
+    their rows, without the header line of each shard, in a queue holding at
+    most `max_queued_chunks` chunks, so memory stays bounded. Rows of
+    different shards are interleaved a chunk at a time, and the rows of one
+    shard stay in order. When `tee_path` is set, the header line of the
+    first shard and every row read are also written to that file, so a
+    single uncompressed shard is copied unchanged. Each shard is timed as a
+    `game_read_source_shard` span in `log`, and its statistics are kept in
+    `shard_stats`.
+    """
+
+    def __init__(self, locations: List[str], log: logger.Log, worker_count: int = 4,
+        chunk_size: int = 1024 * 1024, max_queued_chunks: int = 8,
+        tee_path: Optional[str] = None):
+        self.locations = locations
+        self.log = log
+        self.chunk_size = chunk_size
+        self.tee_path = tee_path
+        self.shard_stats = [ShardStats(location) for location in locations]
+        self.download_seconds = 0.0
+        self._chunks: queue.Queue = queue.Queue(maxsize=max_queued_chunks)
+        # Chunks ready to be read, the first read from `_offset` on
+        self._ready: Deque[bytes] = collections.deque()
+        self._offset = 0
+        self._buffered = 0
+        self._ends_line = True
+        self._open_workers = min(max(worker_count, 1), len(locations))
+        self._next_shard = 0
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._tee_file: Optional[BinaryIO] = open(tee_path, 'wb') if tee_path else None
+        self._header_written = False
+        self._start = datetime.datetime.now()
+        self._threads = [threading.Thread(target=self._read_shards, daemon=True)
+            for _ in range(self._open_workers)]
+        for thread in self._threads:
+            thread.start()
+
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(stats.compressed_bytes for stats in self.shard_stats)
+
+
+    def _take_shard(self) -> Optional[int]:
+        with self._lock:
+            if self._stop.is_set() or self._next_shard >= len(self.locations):
+                return None
+            self._next_shard += 1
+            return self._next_shard - 1
+
+
+    def _read_shards(self) -> None:
+        try:
+            shard = self._take_shard()
+            while shard is not None:
+                with self.log.span('game_read_source_shard', shard=self.locations[shard]) as span:
+                    self._read_shard(self.shard_stats[shard])
+                    span.rows = self.shard_stats[shard].rows
+                shard = self._take_shard()
+        except BaseException as error:
+            self._error = error
+            self._stop.set()
+        finally:
+            self._chunks.put(None)
+
+
+    def _read_shard(self, stats: ShardStats) -> None:
+        time1 = datetime.datetime.now()
+        response = None
+        raw: utils.Readable
+        if is_url(stats.location):
+            response = utils.make_streaming_get_request(stats.location)
+            # Content-Encoding is undone here, and compression of the file itself below
+            response.raw.decode_content = True
+            raw = response.raw
+        else:
+            raw = open(stats.location, 'rb')
+
+        try:
+            counting = CountingReader(raw)
+            stats.compression = detect_compression(counting)
+            reader = decompressing_reader(counting, stats.compression)
+
+            header: Optional[bytes] = None
+            remainder = b''
+            chunk = reader.read(self.chunk_size)
+            while chunk and not self._stop.is_set():
+                data = remainder + chunk
+                if header is None:
+                    newline = data.find(b'\n')
+                    if newline < 0:
+                        remainder = data
+                        chunk = reader.read(self.chunk_size)
+                        continue
+                    header, data = data[:newline + 1], data[newline + 1:]
+
+                lines_end = data.rfind(b'\n') + 1
+                remainder = data[lines_end:]
+                if lines_end:
+                    self._put(stats, header, data[:lines_end])
+                    header = b''
+                stats.compressed_bytes = counting.bytes_read
+                chunk = reader.read(self.chunk_size)
+
+            # The last row of a shard may not end with a line ending
+            if header is None and remainder:
+                header, remainder = remainder + b'\n', b''
+            if remainder or header:
+                self._put(stats, header or b'', remainder)
+            stats.compressed_bytes = counting.bytes_read
+
+        finally:
+            if response is not None:
+                response.close()
+            else:
+                raw.close()  # type: ignore
+            stats.seconds = (datetime.datetime.now() - time1).total_seconds()
+
+
+    def _put(self, stats: ShardStats, header: bytes, data: bytes) -> None:
+        stats.bytes += len(data)
+        stats.rows += data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+        self._chunks.put((header, data))
+
+
+    def _fill(self, size: int) -> None:
+        while self._open_workers and (size < 0 or self._buffered < size):
+            item = self._chunks.get()
+            if item is None:
+                self._open_workers -= 1
+                if self._error:
+                    raise self._error
+                if not self._open_workers:
+                    self.download_seconds = (datetime.datetime.now()
+                        - self._start).total_seconds()
+                continue
+
+            header, data = item
+            if self._tee_file and header and not self._header_written:
+                self._tee_file.write(header)
+                self._header_written = True
+            if not data:
+                continue
+            if not self._ends_line:
+                # Separate the unterminated last row of a shard from the next shard
+                data = b'\n' + data
+            self._ends_line = data.endswith(b'\n')
+            if self._tee_file:
+                self._tee_file.write(data)
+            self._ready.append(data)
+            self._buffered += len(data)
+
+        if not self._open_workers and self._tee_file:
+            self._tee_file.close()
+            self._tee_file = None
+
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(size)
+        wanted = self._buffered if size < 0 else min(size, self._buffered)
+        self._buffered -= wanted
+        # Only the bytes returned are copied, not the rest of the chunk
+        pieces = []
+        while wanted:
+            chunk = self._ready[0]
+            piece = chunk[self._offset:self._offset + wanted]
+            pieces.append(piece)
+            wanted -= len(piece)
+            self._offset += len(piece)
+            if self._offset == len(chunk):
+                self._ready.popleft()
+                self._offset = 0
+        return b''.join(pieces)
+
+
+    def close(self) -> None:
+        # Stop and unblock the reading threads if the reader is abandoned early
+        self._stop.set()
+        while any(thread.is_alive() for thread in self._threads):
+            try:
+                self._chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if self._tee_file:
+            self._tee_file.close()
+            self._tee_file = None
+
+
+    def write_metrics(self) -> None:
+        """
+        Log the bytes read from each shard, before and after decompression.
+        """
+        for stats in self.shard_stats:
+            self.log.write_info(f'Read {stats.rows} game rows from {stats.location} '
+                f'({stats.compression}, {stats.compressed_bytes} bytes, {stats.bytes} bytes '
+                f'decompressed) in {stats.seconds:.3f} seconds.')
+        self.log.write_metric('game_source_shards', len(self.shard_stats))
+        self.log.write_metric('game_source_compressed_bytes', self.bytes_read)
+        self.log.write_metric('game_source_bytes',
+            sum(stats.bytes for stats in self.shard_stats))
+
+
+def copy_to_file(locations: List[str], local_csv_path: str, log: logger.Log,
+    worker_count: int = 4) -> int:
+    """
+    Read and decompress the game data at `locations` with up to
+    `worker_count` concurrent workers, and write it to the file at
+    `local_csv_path` as a single uncompressed CSV with one header line. Log
+    the statistics of each shard to `log`. Return the number of bytes read
+    from the shards.
+    """
+    reader = GameSourceReader(locations, log, worker_count, tee_path=local_csv_path)
+    try:
+        while reader.read(reader.chunk_size):
+            pass
+    finally:
+        reader.close()
+    reader.write_metrics()
+    return reader.bytes_read
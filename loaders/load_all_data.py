@@ -0,0 +1,143 @@
+import concurrent.futures
+import datetime
+import functools
+import psycopg2
+import psycopg2.pool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loaders import load_game_data as games, load_generation, load_player_data as players
+from loaders import game_sources, shadow_tables
+import logger
+import source_cache
+import utils
+
+
+def run_pipeline(name: str, pipeline: Callable[..., bool],
+    connection_pool: psycopg2.pool.AbstractConnectionPool,
+    log: logger.Log) -> Tuple[psycopg2.extensions.connection, bool]:
+    """
+    Run `pipeline` with a connection taken from `connection_pool`, leaving
+    its changes uncommitted. An error in the pipeline is logged to `log`
+    rather than raised, so it does not stop the other pipelines. Log the
+    time the pipeline took as the `<name>_pipeline_seconds` metric. Return
+    the connection and whether the pipeline succeeded.
+    """
+    connection = connection_pool.getconn()
+    loaded = False
+
+    time1 = datetime.datetime.now()
+    try:
+        loaded = pipeline(connection=connection)
+    except Exception as error:
+        connection.rollback()
+        log.write_error(f'The {name} pipeline failed. {error!r}')
+    time2 = datetime.datetime.now()
+
+    log.write_metric(f'{name}_pipeline_seconds', (time2 - time1).total_seconds())
+    return connection, loaded
+
+
+def publish(results: Dict[str, Tuple[psycopg2.extensions.connection, bool]],
+    connection_pool: psycopg2.pool.AbstractConnectionPool,
+    log: logger.Log, retained_generations: int = 2,
+    cache: Optional[source_cache.SourceCache] = None,
+    sources: Optional[Dict[str, str]] = None) -> Dict[str, bool]:
+    """
+    Commit the changes of each pipeline in `results` that succeeded, one
+    right after the other, so the reporting views see the new game and
+    player data at nearly the same time. Shadow tables built by a pipeline
+    are swapped in for the prepared tables just before its commit, keeping
+    the `retained_generations` most recent replaced tables, and the load
+    generation is advanced with each commit. Once a pipeline's data is
+    committed, its source URL in `sources` is marked loaded in `cache`.
+    Return every connection to `connection_pool`. Log to `log` the time
+    taken to publish as a metric. Return whether each pipeline's data was
+    published.
+    """
+    published = {name: False for name in results}
+
+    time1 = datetime.datetime.now()
+    for name, (connection, loaded) in results.items():
+        try:
+            if loaded:
+                cursor = connection.cursor()
+                generation = shadow_tables.swap_shadow_tables(cursor, retained_generations)
+                load_generation.advance_load_generation(cursor)
+                cursor.close()
+                connection.commit()
+                if cache is not None and sources and name in sources:
+                    cache.mark_loaded(sources[name])
+                if generation is not None:
+                    log.write_info(f'Swapped in the {name} data as generation {generation}.')
+                published[name] = True
+                log.write_info(f'Published the {name} data.')
+            else:
+                log.write_warning(f'The {name} data was not published.')
+        except (psycopg2.OperationalError, psycopg2.Error) as error:
+            log.write_error(f'There was a database error publishing the {name} data. '
+                f'{error.args}')
+        finally:
+            connection_pool.putconn(connection)
+    time2 = datetime.datetime.now()
+
+    log.write_metric('publish_seconds', (time2 - time1).total_seconds())
+    return published
+
+
+def load_data(config: Dict[Any, Any], local_games_csv_path: str) -> Dict[str, bool]:
+    """
+    Run the game and player pipelines concurrently using the settings in
+    `config`, each with its own connection from a shared connection pool,
+    then publish the data of the pipelines that succeeded. The game data is
+    downloaded to `local_games_csv_path` unless it is streamed. Data in the
+    prepared tables is replaced unless incremental loading is configured.
+    If a source cache is configured, pipelines whose source did not change
+    since it was last loaded skip the load.
+    Return whether each pipeline's data was published.
+    """
+    log = logger.Log()
+    log.write_info('Begin load_all_data.load_data')
+
+    cache = source_cache.make_source_cache_from_config(config)
+    sources = {'game': game_sources.source_name(config['game_data_csv_location']),
+        'player': config['player_data_location']}
+
+    database = {'host': config['database_server'], 'port': config['database_server_port'],
+        'database': config['database'], 'user': config['database_user'],
+        'password': config['database_password']}
+    pipelines = {
+        'game': functools.partial(games.load_data, config['game_data_csv_location'],
+            local_games_csv_path, False, replace_existing_data=True,
+            options=games.GameLoadOptions.from_config(config), cache=cache, **database),
+        'player': functools.partial(players.load_data, config['player_data_location'],
+            replace_existing_data=True, options=players.PlayerLoadOptions.from_config(config),
+            cache=cache, **database),
+    }
+
+    time1 = datetime.datetime.now()
+    published = {name: False for name in pipelines}
+    connection_pool = None
+
+    try:
+        connection_pool = utils.make_db_connection_pool_from_config(config, len(pipelines))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pipelines)) as executor:
+            futures = {name: executor.submit(run_pipeline, name, pipeline, connection_pool, log)
+                for name, pipeline in pipelines.items()}
+            results = {name: future.result() for name, future in futures.items()}
+
+        published = publish(results, connection_pool, log,
+            config.get('retained_generations', 2), cache, sources)
+
+    except (psycopg2.OperationalError, psycopg2.Error) as error:
+        log.write_error(f'There was a database error. {error.args}')
+
+    finally:
+        if connection_pool:
+            connection_pool.closeall()
+
+    time2 = datetime.datetime.now()
+    log.write_metric('total_load_seconds', (time2 - time1).total_seconds())
+    log.write_info('End load_all_data.load_data')
+
+    return published
@@ -1,152 +1,1238 @@
+import concurrent.futures
 import datetime
+import io
+import itertools
+import multiprocessing
 import os
 import psycopg2
 import requests
+import tempfile
+from typing import Any, Dict, List, Optional, Union
+import zlib
 
+from loaders import checkpoints, game_replay, game_sources, load_generation, quality_rules
+from loaders import packed_games, partitions, shadow_tables, validate_game_data
 import logger
+import source_cache
 import utils
 
+copy_game_data_sql = '''
+COPY stage.game_data (game_id, player_id, move_number, "column", result)
+FROM STDIN WITH (FORMAT text, DELIMITER ',')
+'''
 
-def download_data(url: str, local_csv_path: str, log: logger.Log) -> None:
+copy_game_shard_sql = '''
+COPY {table} (game_id, player_id, move_number, "column", result)
+FROM STDIN WITH (FORMAT text, DELIMITER ',')
+'''
+
+# The prepared tables a full load replaces, which a shadow publish swaps in
+published_tables = ['prepared.game_data', 'prepared.game_summary', 'prepared.game_fingerprint',
+    'prepared.player_game_stats', 'prepared.packed_game']
+
+# The game tables keyed by game_id, which are partitioned by the hash of
+# the game_id when a partition count is set. The staging table is split
+# alike, so each partition is loaded from its own staged rows
+partitioned_tables = ['stage.game_data', 'prepared.game_data', 'prepared.game_summary',
+    'prepared.game_fingerprint', 'error.game_data']
+
+# The prepared tables whose secondary indexes a bulk load drops and rebuilds
+bulk_load_tables = ['prepared.game_data', 'prepared.game_summary', 'prepared.player_game_stats']
+
+
+def download_data(locations: List[str], local_csv_path: str, log: logger.Log,
+    worker_count: int = 4) -> None:
     """
-    Download the data from `url` and write it to the file 
-    specified by `local_csv_path`. Log using `log` the time taken to 
-    download as a metric.
+    Download the game data in the shards at `locations`, up to `worker_count`
+    at a time, decompressing each into the single CSV at `local_csv_path`. Log
+    using `log` the time taken to download as a metric.
     """
     time1 = datetime.datetime.now()
-    content = utils.make_get_request(url).content
+    game_sources.copy_to_file(locations, local_csv_path, log, worker_count)
     time2 = datetime.datetime.now()
     log.write_metric('game_download_seconds', (time2 - time1).total_seconds())
-    open(local_csv_path, 'wb').write(content)
 
 
-def load_staging_table(local_csv_path: str, cursor: psycopg2.extensions.cursor) -> None:
+def fetch_cached_data(cache: source_cache.SourceCache, locations: List[str], source: str,
+    local_csv_path: str, log: logger.Log, worker_count: int = 4) -> bool:
+    """
+    As `download_data`, but download the URL shards through `cache` as part
+    of `source`. Return whether any shard changed since it was last loaded;
+    local shards always count as changed.
+    """
+    with tempfile.TemporaryDirectory() as download_directory:
+        shard_paths = [os.path.join(download_directory, f'game_data_{shard}')
+            if game_sources.is_url(location) else location
+            for shard, location in enumerate(locations)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(worker_count, 1)) as executor:
+            fetched = [executor.submit(cache.fetch_to_file, location, path, source)
+                for location, path in zip(locations, shard_paths)
+                if game_sources.is_url(location)]
+            changed = [future.result() for future in fetched]
+
+        download_data(shard_paths, local_csv_path, log, worker_count)
+    return any(changed) or len(changed) < len(locations)
+
+
+def load_staging_table(local_csv_path: str, cursor: psycopg2.extensions.cursor) -> int:
     """
     Copy data from the file at `local_csv_path` into the 
-    stage.game_data table using `cursor`.
+    stage.game_data table using `cursor`. Return the number of rows copied.
     """
     with open(local_csv_path, 'r') as f:
         next(f) # Skip the header line
-        cursor.copy_from(f, 'stage.game_data', 
-            columns=['game_id', 'player_id', 'move_number', '"column"', 'result'], 
-            sep=',')
+        cursor.copy_expert(copy_game_data_sql, f)
+    return cursor.rowcount
+
+
+def stage_in_chunks(local_csv_path: str, source: str, chunk_rows: int, host: str, port: int,
+    database: str, user: str, password: str, log: logger.Log) -> int:
+    """
+    Copy the file at `local_csv_path` into stage.game_data `chunk_rows` rows
+    at a time, committing each chunk with a checkpoint for `source` on its own
+    connection, and resuming from the checkpoint unless the file changed.
+    Return the number of rows staged by this call.
+    """
+    source_version = checkpoints.file_version(local_csv_path)
+    connection = utils.make_db_connection(host, port, database, user, password)
+    row_count = 0
+
+    try:
+        cursor = connection.cursor()
+        checkpoint = checkpoints.read_checkpoint(cursor, source)
+        if checkpoint and checkpoint.source_version == source_version:
+            if checkpoint.complete:
+                return 0
+            position = checkpoint.position
+            log.write_info(f'Resuming the staging of the game data at byte {position}.')
+        else:
+            checkpoints.clear_checkpoint(cursor, source, [])
+            cursor.execute('TRUNCATE TABLE stage.game_data;')
+            position = 0
+
+        with open(local_csv_path, 'rb') as f:
+            if position == 0:
+                next(f) # Skip the header line
+            else:
+                f.seek(position)
+
+            for lines in iter(lambda: list(itertools.islice(f, chunk_rows)), []):
+                cursor.copy_expert(copy_game_data_sql, io.BytesIO(b''.join(lines)))
+                row_count += cursor.rowcount
+                checkpoints.save_checkpoint(cursor, source, f.tell(), source_version)
+                connection.commit()
+
+            checkpoints.save_checkpoint(cursor, source, f.tell(), source_version, True)
+            connection.commit()
+        cursor.close()
+
+    finally:
+        connection.close()
+
+    return row_count
+
+
+def can_resume_staging(local_csv_path: str, source: str, host: str, port: int,
+    database: str, user: str, password: str) -> bool:
+    """
+    Return whether the checkpoint of `source` was saved for the file at
+    `local_csv_path`, so its chunked load can be resumed.
+    """
+    connection = utils.make_db_connection(host, port, database, user, password)
+
+    try:
+        cursor = connection.cursor()
+        checkpoint = checkpoints.read_checkpoint(cursor, source)
+        cursor.close()
+
+    finally:
+        connection.close()
+
+    return checkpoint is not None and \
+        checkpoint.source_version == checkpoints.file_version(local_csv_path)
+
+
+def stream_staging_table(locations: List[str], tee_csv_path: Optional[str],
+    cursor: psycopg2.extensions.cursor, log: logger.Log,
+    validate_in_stream: bool = False, validate_game_rules: bool = False,
+    prepared_schema: str = 'prepared',
+    rules: Optional[List[quality_rules.QualityRule]] = None, worker_count: int = 4) -> int:
+    """
+    Stream the game data in the shards at `locations` into stage.game_data
+    using `cursor`, also writing it to `tee_csv_path` if set. If
+    `validate_in_stream` is True load it with `load_validated_data` instead.
+    Log the download and load throughput. Return the number of rows loaded.
+    """
+    reader = game_sources.GameSourceReader(locations, log, worker_count, tee_path=tee_csv_path)
+
+    time1 = datetime.datetime.now()
+    try:
+        if validate_in_stream:
+            row_count = load_validated_data(reader, cursor, log, validate_game_rules,
+                prepared_schema, rules)
+        else:
+            cursor.copy_expert(copy_game_data_sql, reader)
+            row_count = cursor.rowcount
+    finally:
+        reader.close()
+    time2 = datetime.datetime.now()
+
+    load_seconds = (time2 - time1).total_seconds()
+    reader.write_metrics()
+    log.write_metric('game_download_seconds', reader.download_seconds)
+    log.write_metric('game_download_bytes_per_second',
+        reader.bytes_read / max(reader.download_seconds, 1e-9))
+    log.write_metric('game_load_seconds', load_seconds)
+    log.write_metric('game_load_bytes_per_second',
+        reader.bytes_read / max(load_seconds, 1e-9))
+    return row_count
+
+
+def make_data_quality_rules(rules: Optional[List[Dict[str, Any]]] = None) \
+    -> List[quality_rules.QualityRule]:
+    """
+    Return the data quality rules of the game data declared in `rules`, or
+    the default rules if None. Raise a ValueError if a rule is not valid.
+    """
+    return quality_rules.make_quality_rules(rules, quality_rules.default_game_rules,
+        quality_rules.game_columns, grouped=True)
 
 
 def check_and_mark_data_quality(cursor: psycopg2.extensions.cursor,
-    log: logger.Log) -> None:
+    log: logger.Log, table: str = 'stage.game_data',
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> int:
+    """
+    Using `cursor`, mark the rows of stage.game_data, or `table`, that pass
+    the data quality `rules`, or the default rules if None. All the rows of a
+    game fail if one does. Return the number of rows that pass.
+    """
+    if rules is None:
+        rules = make_data_quality_rules()
+    return quality_rules.check_and_mark_rows(cursor, log, table, rules, 'game', 'game_id')
+
+
+def check_game_rules(cursor: psycopg2.extensions.cursor, log: logger.Log,
+    batch_rows: int = 200000, table: str = 'stage.game_data') -> int:
+    """
+    Using `cursor`, replay the games of stage.game_data, or `table`, that
+    passed the data quality checks, `batch_rows` rows at a time, and reject
+    the games that are not legal. Return the number of games replayed.
+    """
+    cursor.execute('''
+    DROP TABLE IF EXISTS illegal_game;
+    CREATE TEMPORARY TABLE illegal_game (game_id text, reason text) ON COMMIT DROP;
+    ''')
+
+    rows_cursor = cursor.connection.cursor('stage_game_rows')
+    rows_cursor.execute(f'''
+    SELECT game_id, player_id, move_number, "column", result
+    FROM {table}
+    WHERE passed_data_quality_check = True
+    ORDER BY game_id;
+    ''')
+
+    game_count = 0
+    illegal_count = 0
+    pending_rows: list = []
+    rows = rows_cursor.fetchmany(batch_rows)
+    while rows:
+        pending_rows.extend(rows)
+        rows = rows_cursor.fetchmany(batch_rows)
+
+        # Keep the rows of the last game for the next batch, it may continue there
+        complete_rows = pending_rows
+        if rows:
+            last_game_id = pending_rows[-1][0]
+            split = len(pending_rows)
+            while split > 0 and pending_rows[split - 1][0] == last_game_id:
+                split -= 1
+            complete_rows, pending_rows = pending_rows[:split], pending_rows[split:]
+        else:
+            pending_rows = []
+
+        games = [list(game_rows) for _, game_rows in
+            itertools.groupby(complete_rows, key=lambda row: row[0])]
+        game_count += len(games)
+        illegal_games = [f'{game_rows[0][0]},{reason}\n' for game_rows, reason in
+            zip(games, game_replay.check_games(games)) if reason]
+        if illegal_games:
+            cursor.copy_expert("COPY illegal_game (game_id, reason) FROM STDIN "
+                "WITH (FORMAT text, DELIMITER ',')", io.StringIO(''.join(illegal_games)))
+            illegal_count += len(illegal_games)
+
+    rows_cursor.close()
+
+    cursor.execute(f'''
+    UPDATE {table} staged
+    SET passed_data_quality_check = False
+    , rejection_reason = illegal_game.reason
+    FROM illegal_game
+    WHERE staged.game_id = illegal_game.game_id;
+    ''')
+
+    if illegal_count > 0:
+        log.write_warning(f'Rejected {illegal_count} games that are not legal games.')
+
+    return game_count
+
+
+def move_checked_data(cursor: psycopg2.extensions.cursor, 
+    retain_staging_data: bool, table: str = 'stage.game_data',
+    prepared_schema: str = 'prepared') -> int:
+    """
+    Using `cursor`, copy the rows of stage.game_data, or `table`, that passed
+    the data quality checks to prepared.game_data and the rest to
+    error.game_data, one partition at a time. Empty the staging table unless
+    `retain_staging_data` is True. Return the number of rows copied.
+    """
+    # Copy the rows that passed the data quality check to the `prepared` table
+    prepared_count = 0
+    for source, target in partitions.matching_partitions(cursor, table,
+        f'{prepared_schema}.game_data'):
+        copy_to_prepared_sql = f'''
+        INSERT INTO {target} (game_id, player_id, move_number, "column", result, create_timestamp)
+        SELECT game_id, player_id, move_number::int, "column"::int, result, create_timestamp
+        FROM {source} WHERE passed_data_quality_check = True;
+        '''
+        cursor.execute(copy_to_prepared_sql)
+        prepared_count += cursor.rowcount
+
+    return prepared_count + move_failed_data(cursor, retain_staging_data, table)
+
+
+def move_failed_data(cursor: psycopg2.extensions.cursor,
+    retain_staging_data: bool, table: str = 'stage.game_data') -> int:
+    """
+    Using `cursor`, copy the rows of stage.game_data, or `table`, that failed
+    the data quality checks to error.game_data, and empty the staging table
+    unless `retain_staging_data` is True. Return the number of rows copied.
+    """
+    # Copy the rows that failed the data quality check to the `problem` table
+    error_count = 0
+    for source, target in partitions.matching_partitions(cursor, table, 'error.game_data'):
+        copy_to_error_sql = f'''
+        INSERT INTO {target} (game_id, player_id, move_number, "column", result,
+            create_timestamp, rejection_reason)
+        SELECT game_id, player_id, move_number, "column", result, create_timestamp,
+            rejection_reason
+        FROM {source} WHERE passed_data_quality_check = False;
+        '''
+        cursor.execute(copy_to_error_sql)
+        error_count += cursor.rowcount
+
+    # Clean out the stage table for the next run
+    if not retain_staging_data:
+        cursor.execute(f'TRUNCATE TABLE {table};')
+
+    return error_count
+
+
+def stage_game_fingerprints(cursor: psycopg2.extensions.cursor,
+    table: str = 'stage.game_data') -> int:
+    """
+    Using `cursor`, store a fingerprint of the moves of each game of
+    stage.game_data, or `table`, that passed the data quality checks in the
+    temporary table staged_game_fingerprint. Return the number of games.
+    """
+    stage_fingerprints_sql = f'''
+    DROP TABLE IF EXISTS staged_game_fingerprint;
+    CREATE TEMPORARY TABLE staged_game_fingerprint ON COMMIT DROP AS
+    SELECT game_id
+    , md5(string_agg(concat_ws(',', player_id, move_number, "column", result), ';' 
+        ORDER BY move_number::int, player_id)) AS fingerprint
+    FROM {table}
+    WHERE passed_data_quality_check = True
+    GROUP BY game_id;
+    '''
+    cursor.execute(stage_fingerprints_sql)
+    return cursor.rowcount
+
+
+def save_game_fingerprints(cursor: psycopg2.extensions.cursor,
+    replace_existing_data: bool, prepared_schema: str = 'prepared') -> int:
+    """
+    Using `cursor`, save the fingerprints in staged_game_fingerprint to
+    prepared.game_fingerprint, replacing the saved ones if
+    `replace_existing_data` is True. Return the number of games saved.
+    """
+    if replace_existing_data:
+        cursor.execute(f'TRUNCATE TABLE {prepared_schema}.game_fingerprint;')
+
+    save_fingerprints_sql = f'''
+    INSERT INTO {prepared_schema}.game_fingerprint (game_id, fingerprint)
+    SELECT game_id, fingerprint
+    FROM staged_game_fingerprint
+    ON CONFLICT (game_id) DO UPDATE SET fingerprint = EXCLUDED.fingerprint
+    , create_timestamp = NOW();
+    '''
+    cursor.execute(save_fingerprints_sql)
+    return cursor.rowcount
+
+
+def move_changed_data(cursor: psycopg2.extensions.cursor,
+    retain_staging_data: bool, log: logger.Log,
+    table: str = 'stage.game_data') -> Dict[str, int]:
+    """
+    Incremental counterpart of `move_checked_data`: update prepared.game_data
+    only for the games whose fingerprint was added, changed, or removed, and
+    leave their players in game_change_player. Log to `log` and return the
+    number of games added, changed, removed, and unchanged.
+    """
+    find_changes_sql = '''
+    DROP TABLE IF EXISTS game_change;
+    CREATE TEMPORARY TABLE game_change ON COMMIT DROP AS
+    SELECT COALESCE(staged.game_id, saved.game_id) AS game_id
+    , CASE WHEN saved.game_id IS NULL THEN 'added'
+    WHEN staged.game_id IS NULL THEN 'removed'
+    ELSE 'changed' END AS change
+    , staged.fingerprint
+    FROM staged_game_fingerprint staged
+    FULL JOIN prepared.game_fingerprint saved ON staged.game_id = saved.game_id
+    WHERE staged.fingerprint IS DISTINCT FROM saved.fingerprint;
+    '''
+    cursor.execute(find_changes_sql)
+
+    remove_changed_sql = '''
+    DROP TABLE IF EXISTS game_change_player;
+    CREATE TEMPORARY TABLE game_change_player ON COMMIT DROP AS
+    SELECT DISTINCT player_id
+    FROM prepared.game_data
+    WHERE game_id IN (SELECT game_id FROM game_change WHERE change IN ('changed', 'removed'));
+
+    DELETE FROM prepared.game_fingerprint
+    WHERE game_id IN (SELECT game_id FROM game_change WHERE change = 'removed');
+    '''
+    cursor.execute(remove_changed_sql)
+
+    for source, target in partitions.matching_partitions(cursor, table, 'prepared.game_data'):
+        replace_changed_sql = f'''
+        DELETE FROM {target}
+        WHERE game_id IN (SELECT game_id FROM game_change WHERE change IN ('changed', 'removed'));
+
+        INSERT INTO {target} (game_id, player_id, move_number, "column", result, create_timestamp)
+        SELECT game_id, player_id, move_number::int, "column"::int, result, create_timestamp
+        FROM {source}
+        WHERE passed_data_quality_check = True
+        AND game_id IN (SELECT game_id FROM game_change WHERE change IN ('added', 'changed'));
+        '''
+        cursor.execute(replace_changed_sql)
+
+    copy_changed_to_prepared_sql = '''
+    INSERT INTO prepared.game_fingerprint (game_id, fingerprint)
+    SELECT game_id, fingerprint
+    FROM game_change
+    WHERE change IN ('added', 'changed')
+    ON CONFLICT (game_id) DO UPDATE SET fingerprint = EXCLUDED.fingerprint
+    , create_timestamp = NOW();
+
+    INSERT INTO game_change_player (player_id)
+    SELECT DISTINCT player_id
+    FROM prepared.game_data
+    WHERE game_id IN (SELECT game_id FROM game_change WHERE change IN ('added', 'changed'))
+    EXCEPT
+    SELECT player_id FROM game_change_player;
+    '''
+    cursor.execute(copy_changed_to_prepared_sql)
+
+    cursor.execute("SELECT "
+        "COUNT(*) FILTER (WHERE change = 'added'), "
+        "COUNT(*) FILTER (WHERE change = 'changed'), "
+        "COUNT(*) FILTER (WHERE change = 'removed'), "
+        "(SELECT COUNT(*) FROM staged_game_fingerprint) "
+        "- COUNT(*) FILTER (WHERE change IN ('added', 'changed')) "
+        "FROM game_change;")
+    added, changed, removed, unchanged = cursor.fetchone()
+    changes = {'added': added, 'changed': changed, 'removed': removed, 'unchanged': unchanged}
+
+    for change, count in changes.items():
+        log.write_metric(f'games_{change}', count)
+    log.write_info(f'Games added: {added}, changed: {changed}, removed: {removed}, '
+        f'unchanged: {unchanged}.')
+
+    move_failed_data(cursor, retain_staging_data, table)
+
+    return changes
+
+
+def load_validated_data(source: utils.Readable, cursor: psycopg2.extensions.cursor,
+    log: logger.Log, validate_game_rules: bool = False,
+    prepared_schema: str = 'prepared',
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> int:
+    """
+    Using `cursor`, copy the game rows read from `source`, after its header,
+    straight to prepared.game_data or error.game_data by the data quality
+    `rules`, replaying the games if `validate_game_rules` is True. Return the
+    number of rows read.
+    """
+    cursor.execute('SELECT NOW()::timestamp::text;')
+    create_timestamp = cursor.fetchone()[0]
+
+    row_count = validate_game_data.route_validated_data(source, cursor,
+        create_timestamp.encode(), log, validate_game_rules=validate_game_rules,
+        prepared_schema=prepared_schema, rules=rules)
+    split_game_count = reprocess_split_games(cursor, create_timestamp, log,
+        validate_game_rules, prepared_schema, rules)
+    log.write_metric('game_split_games', split_game_count)
+
+    return row_count
+
+
+def reprocess_split_games(cursor: psycopg2.extensions.cursor, create_timestamp: str,
+    log: logger.Log, validate_game_rules: bool = False,
+    prepared_schema: str = 'prepared',
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> int:
     """
-    Using `cursor`, mark rows in the stage.game_data table that
-    satisfy data quality rules. Log to `log` a warning if any rows
-    fail data quality.
+    Using `cursor`, move the games `load_validated_data` routed in more than
+    one part, copied with `create_timestamp`, back through stage.game_data so
+    they are checked whole. Return the number of games reprocessed.
     """
-    quality_check_sql = '''
-    UPDATE stage.game_data 
-    SET passed_data_quality_check = True 
-    WHERE game_id NOT IN
+    find_split_games_sql = '''
+    DROP TABLE IF EXISTS split_game;
+    CREATE TEMPORARY TABLE split_game ON COMMIT DROP AS
+    SELECT game_id FROM routed_game GROUP BY game_id HAVING COUNT(*) > 1;
+    '''
+    cursor.execute(find_split_games_sql)
+    cursor.execute('SELECT COUNT(*) FROM split_game;')
+    split_game_count = cursor.fetchone()[0]
+    if split_game_count == 0:
+        return 0
+
+    restage_sql = f'''
+    WITH moved_prepared AS
     (
-    SELECT distinct(game_id)
-    FROM stage.game_data
-    WHERE move_number ~ '\D' -- Must be an integer
-    OR "column" ~ '\D' -- Must be an integer
-    OR "column"::int > 4  -- The grid is 4x4
-    OR result NOT IN ('', 'win', 'draw') -- Valid values for result
+    DELETE FROM {prepared_schema}.game_data
+    WHERE game_id IN (SELECT game_id FROM split_game) AND create_timestamp = %(create_timestamp)s
+    RETURNING game_id, player_id, move_number, "column", result, create_timestamp
     )
-    AND game_id NOT IN
+    , moved_error AS
     (
+    DELETE FROM error.game_data
+    WHERE game_id IN (SELECT game_id FROM split_game) AND create_timestamp = %(create_timestamp)s
+    RETURNING game_id, player_id, move_number, "column", result, create_timestamp
+    )
+
+    INSERT INTO stage.game_data (game_id, player_id, move_number, "column", result, create_timestamp)
+    SELECT game_id, player_id, move_number::text, "column"::text, result, create_timestamp
+    FROM moved_prepared
+    UNION ALL
+    SELECT game_id, player_id, move_number, "column", result, create_timestamp
+    FROM moved_error;
+
+    DELETE FROM staged_game_fingerprint WHERE game_id IN (SELECT game_id FROM split_game);
+    '''
+    cursor.execute(restage_sql, {'create_timestamp': create_timestamp})
+    check_and_mark_data_quality(cursor, log, rules=rules)
+    if validate_game_rules:
+        check_game_rules(cursor, log)
+
+    restaged_fingerprints_sql = '''
+    INSERT INTO staged_game_fingerprint (game_id, fingerprint)
     SELECT game_id
+    , md5(string_agg(concat_ws(',', player_id, move_number, "column", result), ';'
+        ORDER BY move_number::int, player_id))
     FROM stage.game_data
+    WHERE passed_data_quality_check = True
+    GROUP BY game_id;
+    '''
+    cursor.execute(restaged_fingerprints_sql)
+    move_checked_data(cursor, False, prepared_schema=prepared_schema)
+
+    return split_game_count
+
+
+def refresh_game_summary(cursor: psycopg2.extensions.cursor,
+    changed_games_only: bool, prepared_schema: str = 'prepared') -> int:
+    """
+    Using `cursor`, rebuild prepared.game_summary from prepared.game_data,
+    only for the games in game_change if `changed_games_only` is True, and
+    otherwise one partition at a time. Return the number of games summarized.
+    """
+    game_data, game_summary = f'{prepared_schema}.game_data', f'{prepared_schema}.game_summary'
+    if changed_games_only:
+        cursor.execute(f'DELETE FROM {game_summary} '
+            'WHERE game_id IN (SELECT game_id FROM game_change);')
+        game_filter = "AND game_id IN (SELECT game_id FROM game_change " \
+            "WHERE change IN ('added', 'changed'))"
+        return summarize_games(cursor, game_data, game_summary, game_filter)
+
+    summarized = 0
+    for source, target in partitions.matching_partitions(cursor, game_data, game_summary):
+        cursor.execute(f'TRUNCATE TABLE {target};')
+        summarized += summarize_games(cursor, source, target)
+    return summarized
+
+
+def summarize_games(cursor: psycopg2.extensions.cursor, source: str, target: str,
+    game_filter: str = '') -> int:
+    # The loser of a won game is the game's other player
+    refresh_summary_sql = f'''
+    WITH game_players AS
+    (
+    SELECT game_id, MIN(player_id) AS first_player_id, MAX(player_id) AS last_player_id
+    FROM {source}
+    WHERE true {game_filter}
     GROUP BY game_id
-    HAVING COUNT(DISTINCT(player_id)) <> 2  -- A game should have 2 players
-    );
+    )
+
+    INSERT INTO {target} (game_id, total_moves, initial_player, concluding_player,
+        initial_column, concluding_column, result, winner, loser)
+    SELECT DISTINCT ON (game_id) game_id
+    , concluding_moves.move_number
+    , initial_moves.player_id
+    , concluding_moves.player_id
+    , initial_moves."column"
+    , concluding_moves."column"
+    , concluding_moves.result
+    , CASE WHEN concluding_moves.result = 'win' THEN concluding_moves.player_id END
+    , CASE WHEN concluding_moves.result = 'win' THEN
+        CASE WHEN concluding_moves.player_id = game_players.first_player_id
+        THEN game_players.last_player_id ELSE game_players.first_player_id END
+    END
+    FROM {source} initial_moves
+    JOIN {source} concluding_moves USING (game_id)
+    JOIN game_players USING (game_id)
+    WHERE initial_moves.move_number = 1
+    AND concluding_moves.result <> ''
+    ORDER BY game_id, concluding_moves.move_number DESC;
     '''
-    cursor.execute(quality_check_sql)
+    cursor.execute(refresh_summary_sql)
+    return cursor.rowcount
 
-    cursor.execute("SELECT COUNT(*) FROM stage.game_data WHERE "
-        "passed_data_quality_check = false;")
-    number_bad = cursor.fetchone()[0]
-    if number_bad > 0:
-        log.write_warning(f'Rejected {number_bad} game records due to data quality.')
 
-def move_checked_data(cursor: psycopg2.extensions.cursor, 
-    retain_staging_data: bool) -> None:
+def refresh_player_stats(cursor: psycopg2.extensions.cursor,
+    changed_games_only: bool, prepared_schema: str = 'prepared') -> int:
     """
-    Using `cursor`, copy rows from stage.game_data to prepared.game_data
-    rows that passed the data quality checks. Copy rows that failed the 
-    data quality checks from stage.game_data to error.game_data.
-    Remove rows from the stage.game_data table to clean up for the next
-    run unless `retain_staging_data` is True.
+    Using `cursor`, rebuild prepared.player_game_stats after
+    `refresh_game_summary`, only for the players in game_change_player if
+    `changed_games_only` is True. Return the number of players rebuilt.
     """
-    # Copy the rows that passed the data quality check to the `prepared` table
-    copy_to_prepared_sql = '''
-    INSERT INTO prepared.game_data (game_id, player_id, move_number, "column", result, create_timestamp) 
-    SELECT game_id, player_id, move_number::int, "column"::int, result, create_timestamp
-    FROM stage.game_data WHERE passed_data_quality_check = True;
+    if changed_games_only:
+        cursor.execute(f'DELETE FROM {prepared_schema}.player_game_stats '
+            'WHERE player_id IN (SELECT player_id FROM game_change_player);')
+        player_filter = 'AND player_id IN (SELECT player_id FROM game_change_player)'
+    else:
+        cursor.execute(f'TRUNCATE TABLE {prepared_schema}.player_game_stats;')
+        player_filter = ''
+
+    # A player of a won game is either its winner or its loser, as in
+    # reporting.single_game_player
+    refresh_stats_sql = f'''
+    WITH player_game AS
+    (
+    SELECT DISTINCT game_id, player_id
+    FROM {prepared_schema}.game_data
+    WHERE true {player_filter}
+    )
+
+    INSERT INTO {prepared_schema}.player_game_stats (player_id, games_played, wins, losses,
+        draws, first_game_id, last_game_id, single_game_id, single_game_outcome)
+    SELECT pg.player_id
+    , COUNT(*)
+    , COUNT(*) FILTER (WHERE pg.player_id = gs.winner)
+    , COUNT(*) FILTER (WHERE pg.player_id = gs.loser)
+    , COUNT(*) FILTER (WHERE gs.result <> 'win')
+    , MIN(pg.game_id)
+    , MAX(pg.game_id)
+    , CASE WHEN COUNT(*) = 1 THEN MIN(pg.game_id) END
+    , CASE WHEN COUNT(*) = 1 THEN MIN(CASE WHEN gs.game_id IS NULL THEN NULL
+        WHEN pg.player_id = gs.winner THEN 'won'
+        WHEN pg.player_id = gs.loser THEN 'lost'
+        ELSE 'drew' END) END
+    FROM player_game pg
+    LEFT JOIN {prepared_schema}.game_summary gs ON pg.game_id = gs.game_id
+    GROUP BY pg.player_id;
     '''
-    cursor.execute(copy_to_prepared_sql)
+    cursor.execute(refresh_stats_sql)
+    return cursor.rowcount
 
-    # Copy the rows that failed the data quality check to the `problem` table
-    copy_to_error_sql = '''
-    INSERT INTO error.game_data (game_id, player_id, move_number, "column", result, create_timestamp) 
-    SELECT game_id, player_id, move_number, "column", result, create_timestamp
-    FROM stage.game_data WHERE passed_data_quality_check = False;
+
+def refresh_packed_games(cursor: psycopg2.extensions.cursor,
+    changed_games_only: bool, prepared_schema: str = 'prepared') -> int:
+    """
+    Using `cursor`, rebuild prepared.packed_game from prepared.game_data,
+    leaving out games that can not be packed without loss, only for the games
+    in game_change if `changed_games_only` is True. Return the number of games
+    packed.
+    """
+    game_data, packed_game = f'{prepared_schema}.game_data', f'{prepared_schema}.packed_game'
+    if changed_games_only:
+        cursor.execute(f'DELETE FROM {packed_game} WHERE game_key IN (SELECT game_key '
+            'FROM prepared.game_key WHERE game_id IN (SELECT game_id FROM game_change));')
+        game_filter = "AND game_id IN (SELECT game_id FROM game_change " \
+            "WHERE change IN ('added', 'changed'))"
+        return pack_games(cursor, game_data, packed_game, game_filter)
+
+    # packed_game is keyed by game_key, so it is not partitioned by game_id
+    cursor.execute(f'TRUNCATE TABLE {packed_game};')
+    return sum(pack_games(cursor, source, packed_game)
+        for source in partitions.table_partitions(cursor, game_data) or [game_data])
+
+
+def pack_games(cursor: psycopg2.extensions.cursor, source: str, target: str,
+    game_filter: str = '') -> int:
+    # Games and players get a key the first time they are packed
+    cursor.execute(f'''
+    INSERT INTO prepared.game_key (game_id)
+    SELECT DISTINCT game_id
+    FROM {source} source
+    WHERE true {game_filter}
+    AND NOT EXISTS (SELECT FROM prepared.game_key k WHERE k.game_id = source.game_id);
+
+    INSERT INTO prepared.player_key (player_id)
+    SELECT DISTINCT player_id
+    FROM {source} source
+    WHERE player_id IS NOT NULL {game_filter}
+    AND NOT EXISTS (SELECT FROM prepared.player_key k WHERE k.player_id = source.player_id);
+    ''')
+
+    refresh_packed_sql = f'''
+    WITH ordered_move AS
+    (
+    SELECT game_id
+    , player_id
+    , move_number
+    , "column"
+    , COALESCE(result, '') AS result
+    , first_value(player_id) OVER game_moves AS first_player
+    , row_number() OVER game_moves AS move_index
+    FROM {source}
+    WHERE true {game_filter}
+    WINDOW game_moves AS (PARTITION BY game_id ORDER BY move_number)
+    )
+
+    , packed AS
+    (
+    SELECT game_id
+    , MIN(first_player) AS first_player
+    , MIN(player_id) FILTER (WHERE player_id <> first_player) AS second_player
+    , string_agg(set_byte(decode('00', 'hex'), 0, "column"
+        + CASE WHEN player_id = first_player THEN 0 ELSE {packed_games.second_player_flag} END),
+        ''::bytea ORDER BY move_number) AS moves
+    , CASE MAX(result) WHEN 'win' THEN {game_replay.win_result}
+        WHEN 'draw' THEN {game_replay.draw_result} ELSE {game_replay.no_result} END AS result
+    FROM ordered_move
+    GROUP BY game_id
+    HAVING bool_and(COALESCE(move_number = move_index AND player_id IS NOT NULL
+        AND "column" BETWEEN 0 AND {packed_games.max_column}
+        AND result IN ('', 'win', 'draw'), false))
+    AND COUNT(DISTINCT player_id) <= 2
+    AND COUNT(*) FILTER (WHERE result <> '') <= 1
+    AND COALESCE(MAX(move_number) FILTER (WHERE result <> ''), COUNT(*)) = COUNT(*)
+    )
+
+    INSERT INTO {target} (game_key, first_player, second_player, moves, result)
+    SELECT game.game_key
+    , first_player.player_key
+    , second_player.player_key
+    , packed.moves
+    , packed.result
+    FROM packed
+    JOIN prepared.game_key game ON packed.game_id = game.game_id
+    JOIN prepared.player_key first_player ON packed.first_player = first_player.player_id
+    LEFT JOIN prepared.player_key second_player
+        ON packed.second_player = second_player.player_id;
     '''
-    cursor.execute(copy_to_error_sql)
+    cursor.execute(refresh_packed_sql)
+    return cursor.rowcount
+
+
+def game_shard_table(shard: int) -> str:
+    """
+    Return the name of the unlogged staging table for game shard `shard`.
+    """
+    return f'stage.game_data_shard_{shard}'
+
+
+def split_game_data(source: utils.Readable, shard_paths: List[str],
+    batch_lines: int = 100000) -> List[int]:
+    """
+    Write the game rows read from `source`, after its header, to the files at
+    `shard_paths` by a hash of their game_id, `batch_lines` at a time. Return
+    the number of rows written to each shard.
+    """
+    shard_count = len(shard_paths)
+    shard_files = [open(path, 'wb') for path in shard_paths]
+    shard_lines: List[List[bytes]] = [[] for _ in shard_paths]
+    row_counts = [0] * shard_count
+
+    def write_lines() -> None:
+        for shard, lines in enumerate(shard_lines):
+            if lines:
+                shard_files[shard].write(b'\n'.join(lines) + b'\n')
+                row_counts[shard] += len(lines)
+                lines.clear()
+
+    try:
+        pending_lines = 0
+        for line in validate_game_data.iter_lines(source):
+            shard_lines[zlib.crc32(line.split(b',', 1)[0]) % shard_count].append(line)
+            pending_lines += 1
+            if pending_lines >= batch_lines:
+                write_lines()
+                pending_lines = 0
+        write_lines()
+
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+    return row_counts
+
+
+def load_game_shard(shard_path: str, shard: int, host: str, port: int, database: str,
+    user: str, password: str, validate_game_rules: bool = False,
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> None:
+    """
+    Run in a worker process by `load_game_shards`: copy the file at
+    `shard_path` into the unlogged staging table of shard `shard` and check
+    it against the data quality `rules` and, if `validate_game_rules` is True,
+    the game rules.
+    """
+    log = logger.Log()
+    table = game_shard_table(shard)
+    connection = utils.make_db_connection(host, port, database, user, password)
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f'''
+        DROP TABLE IF EXISTS {table};
+        CREATE UNLOGGED TABLE {table} (LIKE stage.game_data INCLUDING DEFAULTS);
+        ''')
+        with log.span('game_copy_shard', shard=str(shard)) as span:
+            with open(shard_path, 'rb') as f:
+                cursor.copy_expert(copy_game_shard_sql.format(table=table), f)
+            span.rows = cursor.rowcount
+
+        with log.span('game_check_data_quality', shard=str(shard)) as span:
+            span.rows = check_and_mark_data_quality(cursor, log, table, rules)
+        if validate_game_rules:
+            with log.span('game_check_rules', shard=str(shard)) as span:
+                span.rows = check_game_rules(cursor, log, table=table)
+
+        cursor.close()
+        connection.commit()
+
+    finally:
+        connection.close()
+        log.flush()
 
-    # Clean out the stage table for the next run
-    if not retain_staging_data:
-        cursor.execute('TRUNCATE TABLE stage.game_data;')
+
+def load_game_shards(source: utils.Readable, shard_count: int, host: str, port: int,
+    database: str, user: str, password: str, log: logger.Log,
+    validate_game_rules: bool = False,
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> int:
+    """
+    Split the game rows read from `source` into `shard_count` shards by
+    game_id and load each in its own worker process with `load_game_shard`,
+    leaving them for `publish_game_shards`. Return the number of rows loaded.
+    """
+    with tempfile.TemporaryDirectory() as shard_directory:
+        shard_paths = [os.path.join(shard_directory, f'game_data_{shard}.csv')
+            for shard in range(shard_count)]
+
+        time1 = datetime.datetime.now()
+        row_counts = split_game_data(source, shard_paths)
+        time2 = datetime.datetime.now()
+
+        # Workers are spawned, as forking a process running threads can copy held locks
+        with concurrent.futures.ProcessPoolExecutor(max_workers=shard_count,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=logger.configure_metrics,
+            initargs=(logger.metrics_exporter.metrics_file, None)) as executor:
+            futures = [executor.submit(load_game_shard, shard_path, shard, host, port,
+                database, user, password, validate_game_rules, rules)
+                for shard, shard_path in enumerate(shard_paths)]
+            for future in futures:
+                future.result()
+        time3 = datetime.datetime.now()
+
+    log.write_metric('game_shard_split_seconds', (time2 - time1).total_seconds())
+    log.write_metric('game_shard_load_seconds', (time3 - time2).total_seconds())
+    log.write_info(f'Game rows per shard: {row_counts}.')
+    return sum(row_counts)
+
+
+def partition_game_tables(cursor: psycopg2.extensions.cursor,
+    partition_count: int) -> List[str]:
+    """
+    Using `cursor`, repartition the `partitioned_tables` that are not split
+    into `partition_count` partitions, keeping their rows. Return the tables
+    repartitioned.
+    """
+    repartitioned = [table for table in partitioned_tables
+        if len(partitions.table_partitions(cursor, table)) != partition_count]
+    for table in repartitioned:
+        shadow_tables.repartition_table(cursor, table, partition_count)
+    return repartitioned
+
+
+def drop_secondary_indexes(cursor: psycopg2.extensions.cursor, tables: List[str]) -> List[str]:
+    """
+    Using `cursor`, drop the indexes of each table in `tables` that do not
+    back a constraint, so a bulk load does not maintain them row by row.
+    Return their definitions for `rebuild_indexes`.
+    """
+    definitions = []
+    for table in tables:
+        for index, definition in shadow_tables.secondary_indexes(cursor, table):
+            cursor.execute(f'DROP INDEX {index};')
+            definitions.append(definition)
+    return definitions
+
+
+def rebuild_indexes(cursor: psycopg2.extensions.cursor, definitions: List[str],
+    maintenance_workers: int = 4) -> None:
+    """
+    Using `cursor`, create the indexes in `definitions` after a bulk load,
+    each built by up to `maintenance_workers` parallel workers where the
+    server allows it, for the rest of the transaction.
+    """
+    cursor.execute('SET LOCAL max_parallel_maintenance_workers = %s;', (maintenance_workers,))
+    for definition in definitions:
+        cursor.execute(definition)
+
+
+def publish_game_shards(cursor: psycopg2.extensions.cursor, shard_count: int,
+    replace_existing_data: bool, incremental: bool, log: logger.Log,
+    prepared_schema: str = 'prepared') -> None:
+    """
+    Using `cursor`, move the rows of the `shard_count` shard tables loaded by
+    `load_game_shards` to the prepared and error tables in one transaction, as
+    `move_changed_data` does if `incremental` is True, and drop the shards.
+    """
+    shard_tables = [game_shard_table(shard) for shard in range(shard_count)]
+    cursor.execute('DROP VIEW IF EXISTS staged_game_data; '
+        'CREATE TEMPORARY VIEW staged_game_data AS '
+        + ' UNION ALL '.join(f'SELECT * FROM {table}' for table in shard_tables) + ';')
+
+    stage_game_fingerprints(cursor, 'staged_game_data')
+    if incremental:
+        move_changed_data(cursor, True, log, 'staged_game_data')
+    else:
+        if replace_existing_data:
+            cursor.execute(f'TRUNCATE TABLE {prepared_schema}.game_data;')
+
+        move_checked_data(cursor, True, 'staged_game_data', prepared_schema)
+        save_game_fingerprints(cursor, replace_existing_data, prepared_schema)
+
+    cursor.execute('DROP VIEW staged_game_data; '
+        + ' '.join(f'DROP TABLE {table};' for table in shard_tables))
+
+
+class GameLoadMode:
+    """
+    The steps a game load takes, resolved by `GameLoadOptions.load_mode`:
+    whether it loads shards in worker processes, validates in the stream,
+    stages in chunks, streams the data, or builds shadow tables or bulk
+    loads, and the schema of the tables it builds.
+    """
+
+    def __init__(self) -> None:
+        self.sharded = False
+        self.validate_in_stream = False
+        self.chunked = False
+        self.stream_data = False
+        self.shadow = False
+        self.bulk = False
+        self.prepared_schema = 'prepared'
+
+
+class GameLoadOptions:
+    """
+    How `load_data` loads the game data. Each option is set by the setting
+    of configuration.yml that `from_config` reads for it, as described in
+    the README, and `load_mode` resolves how they combine for one load.
+    """
+
+    def __init__(self, stream_data: bool = False, incremental: bool = False,
+        validate_in_stream: bool = False, validate_game_rules: bool = False,
+        worker_count: int = 1, shadow_publish: bool = False, retained_generations: int = 2,
+        bulk_load: bool = False, index_build_workers: int = 4, chunk_rows: int = 0,
+        data_quality_rules: Optional[List[Dict[str, Any]]] = None, partition_count: int = 0,
+        source_workers: int = 4):
+        self.stream_data = stream_data
+        self.incremental = incremental
+        self.validate_in_stream = validate_in_stream
+        self.validate_game_rules = validate_game_rules
+        self.worker_count = worker_count
+        self.shadow_publish = shadow_publish
+        self.retained_generations = retained_generations
+        self.bulk_load = bulk_load
+        self.index_build_workers = index_build_workers
+        self.chunk_rows = chunk_rows
+        self.data_quality_rules = data_quality_rules
+        self.partition_count = partition_count
+        self.source_workers = source_workers
+
+
+    @classmethod
+    def from_config(cls, config: Dict[Any, Any]) -> 'GameLoadOptions':
+        """
+        Return the options set in `config`, the settings of configuration.yml.
+        """
+        return cls(stream_data=config.get('stream_game_data', False),
+            incremental=config.get('incremental_game_load', False),
+            validate_in_stream=config.get('validate_game_data_in_stream', False),
+            validate_game_rules=config.get('validate_game_rules', False),
+            worker_count=config.get('game_load_workers', 1),
+            shadow_publish=config.get('shadow_publish', False),
+            retained_generations=config.get('retained_generations', 2),
+            bulk_load=config.get('bulk_load', False),
+            index_build_workers=config.get('bulk_load_index_workers', 4),
+            chunk_rows=config.get('load_chunk_rows', 0),
+            data_quality_rules=config.get('game_quality_rules'),
+            partition_count=config.get('game_partitions', 0),
+            source_workers=config.get('game_source_workers', 4))
+
+
+    def load_mode(self, replace_existing_data: bool, cached: bool) -> GameLoadMode:
+        """
+        Return how a load replacing the existing data if
+        `replace_existing_data` is True, and downloaded through a source
+        cache if `cached` is True, applies these options.
+        """
+        mode = GameLoadMode()
+        mode.sharded = self.worker_count > 1
+        mode.validate_in_stream = self.validate_in_stream and not self.incremental \
+            and not mode.sharded
+        mode.chunked = self.chunk_rows > 0 and not mode.sharded and not mode.validate_in_stream
+        # A cached CSV must be downloaded before it is known whether it
+        # changed, and chunks are read from the file at checkpointed offsets
+        mode.stream_data = self.stream_data and not cached and not mode.chunked
+        full_load = replace_existing_data and not self.incremental
+        mode.shadow = self.shadow_publish and full_load
+        mode.bulk = self.bulk_load and full_load and not mode.shadow
+        mode.prepared_schema = shadow_tables.shadow_schema if mode.shadow else 'prepared'
+        return mode
 
 
-def load_data(data_url: str, local_csv_path: str, retain_csv_file: bool,
-    host: str, port: int, database: str, user: str, password: str, 
-    replace_existing_data: bool) -> None:
+def load_data(data_url: Union[str, List[str]], local_csv_path: str, retain_csv_file: bool,
+    host: str, port: int, database: str, user: str, password: str,
+    replace_existing_data: bool, options: Optional[GameLoadOptions] = None,
+    connection: Optional[psycopg2.extensions.connection] = None,
+    cache: Optional[source_cache.SourceCache] = None) -> bool:
     """
-    Wrapper function for the game pipeline. Download data from `data_url`
-    to a file at `local_csv_path`. Create a database connection using
-    `host`, `port`, `database`, `user`, and `password` and load downloaded
-    data into the stage.game_data table. Move rows that satisfy data quality
-    rules to the prepared.game_data table and rows that fail checks to the
-    error.game_data table. Delete the download file unless `retain_csv_file`
-    is True. If `replace_existing_data` is True remove data from the 
-    prepared.game_data table before new data is added from the stage.game_data 
-    table.
+    Wrapper function for the game pipeline. Download the game data from
+    `data_url`, one or more URLs or local paths, and load it with the
+    settings of `options`, moving the rows that pass the data quality checks
+    to the prepared tables and the rest to error.game_data. If `connection`
+    is given the changes are left for the caller to publish, and if `cache`
+    is given unchanged data is not loaded. Return True if the data was
+    loaded or unchanged.
     """
     log = logger.Log()
     log.write_info('Begin load_game_data.load_data')
+    options = options or GameLoadOptions()
+    mode = options.load_mode(replace_existing_data, cache is not None)
 
     try:
-        download_data(data_url, local_csv_path, log)
+        rules = make_data_quality_rules(options.data_quality_rules)
+    except ValueError as error:
+        log.write_error(f'The game data quality rules are not valid. {error.args}')
+        return False
 
-    except (requests.exceptions.HTTPError) as error:
-        log.write_error(f'There was an error downloading the CSV file. {error.args}')
+    try:
+        locations = game_sources.expand_locations(data_url)
+    except ValueError as error:
+        log.write_error(f'The game data location is not valid. {error.args}')
+        return False
+
+    changed = True
+    source = game_sources.source_name(data_url)
+    checkpoint_source = f'game {source}'
+    resume = False
+    if mode.chunked and os.path.exists(local_csv_path):
+        try:
+            resume = can_resume_staging(local_csv_path, checkpoint_source, host, port, database,
+                user, password)
+        except (psycopg2.OperationalError, psycopg2.Error) as error:
+            log.write_error(f'There was a database error. {error.args}')
+        if resume:
+            log.write_info('Resuming the chunked load of the game data from the kept CSV file.')
 
-    connection = None
+    if not mode.stream_data and not resume:
+        try:
+            with log.span('game_download_csv'):
+                if cache is not None:
+                    changed = fetch_cached_data(cache, locations, source, local_csv_path, log,
+                        options.source_workers)
+                else:
+                    download_data(locations, local_csv_path, log, options.source_workers)
+
+        except (requests.exceptions.HTTPError, ValueError, OSError) as error:
+            log.write_error(f'There was an error downloading the game data. {error.args}')
+            if os.path.exists(local_csv_path):
+                os.remove(local_csv_path)
+            log.write_info('End load_game_data.load_data')
+            log.export_metrics()
+            return False
+
+    if not changed:
+        log.write_info('The game data has not changed since it was last loaded.')
+        if not retain_csv_file:
+            os.remove(local_csv_path)
+        log.write_info('End load_game_data.load_data')
+        log.export_metrics()
+        return True
+
+    owns_connection = connection is None
+    loaded = False
+    prepared_schema = mode.prepared_schema
 
     try:
-        connection = utils.make_db_connection(host, port, database, user, password)
+        if mode.sharded:
+            with log.span('game_load_shards') as span:
+                if mode.stream_data:
+                    reader = game_sources.GameSourceReader(locations, log, options.source_workers,
+                        tee_path=local_csv_path if retain_csv_file else None)
+                    try:
+                        span.rows = load_game_shards(reader, options.worker_count, host, port,
+                            database, user, password, log, options.validate_game_rules, rules)
+                    finally:
+                        reader.close()
+                    reader.write_metrics()
+                else:
+                    with open(local_csv_path, 'rb') as f:
+                        next(f) # Skip the header line
+                        span.rows = load_game_shards(f, options.worker_count, host, port,
+                            database, user, password, log, options.validate_game_rules, rules)
+
+        if mode.chunked:
+            with log.span('game_stage_chunks') as span:
+                span.rows = stage_in_chunks(local_csv_path, checkpoint_source,
+                    options.chunk_rows, host, port, database, user, password, log)
+
+        if connection is None:
+            connection = utils.make_db_connection(host, port, database, user, password)
         cursor = connection.cursor()
 
-        load_staging_table(local_csv_path, cursor)
-        check_and_mark_data_quality(cursor, log)
+        # The checkpoint is cleared with the publish, and a load that is not
+        # chunked discards the chunks staged by an interrupted one
+        checkpoints.clear_checkpoint(cursor, checkpoint_source, [] if mode.chunked
+            else ['stage.game_data'])
 
-        if replace_existing_data:
-            cursor.execute('TRUNCATE TABLE prepared.game_data;')
-            
-        move_checked_data(cursor, False)
+        with log.span('game_partition_tables'):
+            repartitioned = partition_game_tables(cursor, options.partition_count)
+        if repartitioned:
+            log.write_info(f'Split {", ".join(repartitioned)} into '
+                f'{options.partition_count} partitions.')
+        if options.partition_count > 0:
+            cursor.execute(partitions.partitionwise_planning_sql)
+
+        if mode.shadow:
+            with log.span('game_create_shadow_tables'):
+                shadow_tables.create_shadow_tables(cursor, published_tables)
+        if mode.bulk:
+            with log.span('game_drop_indexes'):
+                index_definitions = drop_secondary_indexes(cursor, bulk_load_tables)
+
+        if mode.sharded:
+            with log.span('game_publish_shards'):
+                publish_game_shards(cursor, options.worker_count, replace_existing_data,
+                    options.incremental, log, prepared_schema)
+        elif mode.validate_in_stream:
+            if replace_existing_data and not mode.shadow:
+                with log.span('game_truncate_prepared'):
+                    cursor.execute('TRUNCATE TABLE prepared.game_data;')
+
+            with log.span('game_validate_in_stream') as span:
+                if mode.stream_data:
+                    span.rows = stream_staging_table(locations,
+                        local_csv_path if retain_csv_file else None, cursor, log, True,
+                        options.validate_game_rules, prepared_schema, rules,
+                        options.source_workers)
+                else:
+                    with open(local_csv_path, 'rb') as f:
+                        next(f) # Skip the header line
+                        span.rows = load_validated_data(f, cursor, log,
+                            options.validate_game_rules, prepared_schema, rules)
+
+            with log.span('game_save_fingerprints') as span:
+                span.rows = save_game_fingerprints(cursor, replace_existing_data, prepared_schema)
+        else:
+            if not mode.chunked:
+                with log.span('game_copy_stage') as span:
+                    if mode.stream_data:
+                        span.rows = stream_staging_table(locations,
+                            local_csv_path if retain_csv_file else None, cursor, log,
+                            worker_count=options.source_workers)
+                    else:
+                        span.rows = load_staging_table(local_csv_path, cursor)
+
+            with log.span('game_check_data_quality') as span:
+                span.rows = check_and_mark_data_quality(cursor, log, rules=rules)
+            if options.validate_game_rules:
+                with log.span('game_check_rules') as span:
+                    span.rows = check_game_rules(cursor, log)
+            with log.span('game_stage_fingerprints') as span:
+                span.rows = stage_game_fingerprints(cursor)
+
+            if options.incremental:
+                with log.span('game_move_changed_data'):
+                    move_changed_data(cursor, False, log)
+            else:
+                if replace_existing_data and not mode.shadow:
+                    with log.span('game_truncate_prepared'):
+                        cursor.execute('TRUNCATE TABLE prepared.game_data;')
 
+                with log.span('game_move_checked_data') as span:
+                    span.rows = move_checked_data(cursor, False, prepared_schema=prepared_schema)
+                with log.span('game_save_fingerprints') as span:
+                    span.rows = save_game_fingerprints(cursor, replace_existing_data,
+                        prepared_schema)
+
+        with log.span('game_refresh_summary') as span:
+            span.rows = refresh_game_summary(cursor, options.incremental, prepared_schema)
+        with log.span('game_refresh_player_stats') as span:
+            span.rows = refresh_player_stats(cursor, options.incremental, prepared_schema)
+        with log.span('game_refresh_packed_games') as span:
+            span.rows = refresh_packed_games(cursor, options.incremental, prepared_schema)
+
+        if mode.bulk:
+            with log.span('game_rebuild_indexes'):
+                rebuild_indexes(cursor, index_definitions, options.index_build_workers)
+            with log.span('game_analyze'):
+                for table in published_tables:
+                    cursor.execute(f'ANALYZE {table};')
+
+        if mode.shadow:
+            with log.span('game_build_shadow_indexes'):
+                shadow_tables.build_shadow_indexes(cursor, published_tables)
+            if owns_connection:
+                with log.span('game_swap_shadow_tables'):
+                    shadow_tables.swap_shadow_tables(cursor, options.retained_generations)
+
+        if owns_connection:
+            load_generation.advance_load_generation(cursor)
         cursor.close()
-        connection.commit()
+        if owns_connection:
+            with log.span('game_commit'):
+                connection.commit()
+            if cache is not None:
+                cache.mark_loaded(source)
+        loaded = True
 
+    except (requests.exceptions.HTTPError) as error:
+        log.write_error(f'There was an error downloading the CSV file. {error.args}')
+    except ValueError as error:
+        log.write_error(f'The game data is not in the expected format. {error.args}')
     except (psycopg2.OperationalError, psycopg2.Error) as error:
         log.write_error(f'There was a database error. {error.args}')
 
     finally:
-        if connection:
+        if connection and owns_connection:
             connection.close()
+        elif connection and not loaded:
+            connection.rollback()
 
-    if not retain_csv_file:
+    if mode.chunked and not loaded and os.path.exists(local_csv_path):
+        log.write_info(f'Kept {local_csv_path} to resume the chunked load.')
+    elif not retain_csv_file and not mode.stream_data:
         os.remove(local_csv_path)
 
     log.write_info(f'End load_game_data.load_data')
+    log.export_metrics()
+
+    return loaded
 
   
@@ -0,0 +1,20 @@
+import psycopg2
+
+load_generation_table = 'generation.load_generation'
+
+
+def advance_load_generation(cursor: psycopg2.extensions.cursor) -> int:
+    """
+    Using `cursor`, count a new load generation, which tells readers of the
+    reporting views that cache their results that the data changed. Call it
+    in the transaction that publishes the change, right before the commit,
+    as it locks the counter until then. Return the new generation.
+    """
+    cursor.execute(f'UPDATE {load_generation_table} '
+        'SET generation = generation + 1, published_timestamp = NOW() RETURNING generation;')
+    return cursor.fetchone()[0]
+
+
+def current_load_generation(cursor: psycopg2.extensions.cursor) -> int:
+    cursor.execute(f'SELECT generation FROM {load_generation_table};')
+    return cursor.fetchone()[0]
@@ -1,40 +1,239 @@
+import concurrent.futures
 import datetime
+import io
 import json
 import psycopg2
+import re
 import requests
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
+from loaders import checkpoints, load_generation, quality_rules, shadow_tables
 import logger
+import source_cache
 import utils
 
+copy_player_blobs_sql = 'COPY stage.player_blobs (player_blob) FROM STDIN'
+
+# The prepared tables a full load replaces, which a shadow publish swaps in
+published_tables = ['prepared.player_info']
+
+# The fields of each player's details projected into typed columns of
+# prepared.player_info, by column name. The reporting views read these
+# columns, so they are always projected
+required_detail_columns = {
+    'nationality': {'field': 'nat', 'type': 'text'},
+    'email_address': {'field': 'email', 'type': 'text'},
+}
+projected_details = "(details -> 'data')"
+detail_column_types = ['text', 'int', 'bigint', 'numeric', 'boolean', 'date', 'timestamp']
+details_gin_index = 'ix_player_info_details'
+identifier = re.compile(r'^[a-z_][a-z0-9_]*$')
+field_path = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+
+
+def fetch_player_pages(url: str, session: requests.Session, worker_count: int = 1,
+    pages_ahead: Optional[int] = None, cache: Optional[source_cache.SourceCache] = None,
+    first_page: int = 0) \
+    -> Iterator[Tuple[int, Union[requests.Response, source_cache.CachedResponse]]]:
+    """
+    Download player data from `url` in pages using `session`, yielding
+    `(page, response)` pairs in page order until the first empty page (`[]`).
+    Pages are requested concurrently by `worker_count` threads, with up to
+    `pages_ahead` pages (default twice `worker_count`) requested ahead of
+    the page being yielded. Requests for pages past the first empty page
+    are discarded. If `cache` is given the pages are fetched through it as
+    parts of the source `url`. Pages before `first_page` are skipped.
+    """
+    if pages_ahead is None:
+        pages_ahead = worker_count * 2
+    pages_ahead = max(pages_ahead, 1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        pending: Dict[int, concurrent.futures.Future] = {}
+        next_page_to_request = first_page
+        page = first_page
+
+        try:
+            while True:
+                while next_page_to_request < page + pages_ahead:
+                    page_url = f'{url}?page={next_page_to_request}'
+                    if cache is not None:
+                        pending[next_page_to_request] = executor.submit(cache.get, page_url,
+                            session, url)
+                    else:
+                        pending[next_page_to_request] = executor.submit(utils.make_get_request,
+                            page_url, True, session)
+                    next_page_to_request += 1
+
+                player_response = pending.pop(page).result()
+                if player_response.content.strip() == b'[]':
+                    break
+
+                yield page, player_response
+                page += 1
+
+        finally:
+            for future in pending.values():
+                future.cancel()
+
+    if cache is not None:
+        cache.discard(url, [f'{url}?page={ahead}' for ahead in range(page + 1,
+            next_page_to_request)])
+
 
 def download_and_insert_data(url: str, cursor: psycopg2.extensions.cursor, 
-    log: logger.Log) -> None:
+    log: logger.Log, worker_count: int = 1, batch_pages: int = 100,
+    batch_bytes: int = 16 * 1024 * 1024,
+    cache: Optional[source_cache.SourceCache] = None, first_page: int = 0,
+    on_batch: Optional[Callable[[int], None]] = None) -> int:
     """
     Download player data from `url` in pages, inserting each page
     (a JSON array) into the stage.player_blobs table using `cursor`.
+    Pages are downloaded concurrently by `worker_count` threads sharing
+    a pooled HTTP session, and are copied into the table in batches of up
+    to `batch_pages` pages or `batch_bytes` bytes. If `cache` is given the
+    pages are fetched through it. Download starts at `first_page`, and
+    `on_batch` is called with the number of the next page after each batch
+    is copied.
     Log as a metric using `log` the time it took to download all
-    the player data, across all pages.
+    the player data, across all pages. Return the number of pages.
     """
-    page = 0
-    empty_response = False
-
     time1 = datetime.datetime.now()
 
-    while not empty_response:
-        player_response = utils.make_get_request(f"{url}?page={page}")
+    page_count = 0
+    batch_count = 0
+    rejected_count = 0
+    batch: List[bytes] = []
+    batch_size = 0
+
+    with utils.make_http_session(pool_size=worker_count) as session:
+        for page, player_response in fetch_player_pages(url, session, worker_count,
+            cache=cache, first_page=first_page):
+            batch.append(player_response.content)
+            batch_size += len(player_response.content)
+            page_count += 1
+
+            if len(batch) >= batch_pages or batch_size >= batch_bytes:
+                rejected_count += insert_player_blobs(cursor, batch)
+                batch_count += 1
+                batch = []
+                batch_size = 0
+                if on_batch:
+                    on_batch(page + 1)
+
+    if batch:
+        rejected_count += insert_player_blobs(cursor, batch)
+        batch_count += 1
+        if on_batch:
+            on_batch(first_page + page_count)
+
+    time2 = datetime.datetime.now()
+    log.write_metric('player_download_seconds', (time2 - time1).total_seconds())
+    log.write_metric('player_download_pages', page_count)
+    log.write_metric('player_copy_batches', batch_count)
+    if rejected_count > 0:
+        log.write_warning(f'Rejected {rejected_count} player pages that are not valid JSON.')
+
+    return page_count
+
+
+def stage_pages_in_chunks(url: str, source: str, chunk_pages: int, host: str, port: int,
+    database: str, user: str, password: str, log: logger.Log, worker_count: int = 1,
+    cache: Optional[source_cache.SourceCache] = None) -> Tuple[int, bool]:
+    """
+    Download player data from `url` in pages into the stage.player_blobs
+    table in chunks of up to `chunk_pages` pages. Each chunk is committed
+    on its own database connection, created using `host`, `port`,
+    `database`, `user`, and `password`, together with a checkpoint of the
+    pages staged for `source`, so the size of each transaction stays
+    bounded. A load interrupted by an error resumes from the page after the
+    last checkpoint, unless the first page changed since, in which case the
+    staged pages are discarded. Pages are downloaded by `worker_count`
+    threads, through `cache` if given. Log to `log` where a load resumes.
+    Return the number of pages staged by this call and whether it resumed
+    a load.
+    """
+    # The first page is fetched again, so pages of two versions of the data
+    # are not staged as one snapshot
+    source_version = checkpoints.content_version(
+        utils.make_get_request(f'{url}?page=0').content)
+    connection = utils.make_db_connection(host, port, database, user, password)
 
-        if player_response.content == b'[]':
-            empty_response = True
+    try:
+        cursor = connection.cursor()
+        checkpoint = checkpoints.read_checkpoint(cursor, source)
+        resumed = False
+        if checkpoint and checkpoint.source_version == source_version:
+            if checkpoint.complete:
+                return 0, True
+            resumed = True
+            first_page = checkpoint.position
+            log.write_info(f'Resuming the staging of the player data at page {first_page}.')
         else:
-            content_blob = player_response.json()
-            content_blob = json.dumps(content_blob).replace("'", "''")  
-            insert_player_blob(cursor, content_blob)
+            if checkpoint:
+                log.write_info('The player data changed since its staging was interrupted, '
+                    'so it is staged again.')
+            checkpoints.clear_checkpoint(cursor, source, [])
+            cursor.execute('TRUNCATE TABLE stage.player_blobs;')
+            first_page = 0
+
+        def save_chunk(next_page: int) -> None:
+            checkpoints.save_checkpoint(cursor, source, next_page, source_version)
+            connection.commit()
+
+        page_count = download_and_insert_data(url, cursor, log, worker_count, chunk_pages,
+            cache=cache, first_page=first_page, on_batch=save_chunk)
+        checkpoints.save_checkpoint(cursor, source, first_page + page_count, source_version,
+            True)
+        connection.commit()
+        cursor.close()
 
-        page += 1
+    finally:
+        connection.close()
+
+    return page_count, resumed
+
+
+def insert_player_blobs(cursor: psycopg2.extensions.cursor, blobs: List[bytes]) -> int:
+    """
+    Using `cursor`, copy each JSON document in `blobs` into the
+    stage.player_blobs table in a single COPY. The documents are sent as
+    received, without being parsed. If the COPY fails because a document is
+    not valid JSON, the documents are parsed to find the invalid ones, and
+    the valid ones are copied. Return the number of documents rejected.
+    """
+    cursor.execute('SAVEPOINT insert_player_blobs;')
+
+    try:
+        copy_player_blobs(cursor, blobs)
+        rejected_count = 0
+
+    except psycopg2.DataError:
+        cursor.execute('ROLLBACK TO SAVEPOINT insert_player_blobs;')
+        valid_blobs = list(filter(is_valid_json, blobs))
+        copy_player_blobs(cursor, valid_blobs)
+        rejected_count = len(blobs) - len(valid_blobs)
+
+    cursor.execute('RELEASE SAVEPOINT insert_player_blobs;')
+    return rejected_count
+
+
+def copy_player_blobs(cursor: psycopg2.extensions.cursor, blobs: List[bytes]) -> None:
+    """
+    Using `cursor`, copy each JSON document in `blobs` into the
+    stage.player_blobs table in a single COPY.
+    """
+    rows = b''.join(utils.escape_copy_text(blob) + b'\n' for blob in blobs)
+    cursor.copy_expert(copy_player_blobs_sql, io.BytesIO(rows))
+
+
+def is_valid_json(blob: bytes) -> bool:
+    try:
+        json.loads(blob)
+        return True
+    except ValueError:
+        return False
 
-    time2 = datetime.datetime.now()
-    log.write_metric('player_download_seconds', (time2 - time1).total_seconds())
-  
 
 def insert_player_blob(cursor: psycopg2.extensions.cursor, content_json: str) -> None:
     """
@@ -42,13 +241,14 @@ def insert_player_blob(cursor: psycopg2.extensions.cursor, content_json: str) ->
     This functionality is split into its own function to enable using a
     test data file.
     """
-    cursor.execute(f"INSERT INTO stage.player_blobs(player_blob) VALUES ('{content_json}') ")
+    copy_player_blobs(cursor, [content_json.encode('utf-8')])
 
 
-def debatch_blob(cursor: psycopg2.extensions.cursor):
+def debatch_blob(cursor: psycopg2.extensions.cursor) -> int:
     """
     Using `cursor`, split the JSON arrays in stage.player_blobs
     into individual player records and insert them into stage.player_info.
+    Return the number of player records.
     """
     debatch_sql = """
     INSERT INTO stage.player_info (player_id, details, create_timestamp)
@@ -64,112 +264,443 @@ def debatch_blob(cursor: psycopg2.extensions.cursor):
     """
 
     cursor.execute(debatch_sql)
+    return cursor.rowcount
+
+
+def make_data_quality_rules(rules: Optional[List[Dict[str, Any]]] = None) \
+    -> List[quality_rules.QualityRule]:
+    """
+    Return the data quality rules of the player data declared in `rules`, or
+    the default rules if None. Raise a ValueError if a rule is not valid.
+    """
+    return quality_rules.make_quality_rules(rules, quality_rules.default_player_rules,
+        quality_rules.player_columns, quality_rules.player_json_columns)
 
 
 def check_and_mark_data_quality(cursor: psycopg2.extensions.cursor,
-    log: logger.Log) -> None:
+    log: logger.Log, rules: Optional[List[quality_rules.QualityRule]] = None) -> int:
     """
     Using `cursor`, mark rows in the stage.player_info table that
-    satisfy data quality rules. Log to `log` a warning if any rows
-    fail data quality.
+    satisfy the data quality `rules`, or the default player rules if None,
+    with the code of the first rule a row fails as its rejection_reason.
+    Log to `log` the rows failing each rule as metrics and a warning if any
+    rows fail data quality. Return the number of rows that pass.
+    """
+    if rules is None:
+        rules = make_data_quality_rules()
+    return quality_rules.check_and_mark_rows(cursor, log, 'stage.player_info', rules, 'player')
+
+
+def make_detail_columns(detail_columns: Optional[Dict[str, Dict[str, str]]] = None) \
+    -> Dict[str, Dict[str, str]]:
+    """
+    Return the required detail columns together with `detail_columns`, a
+    mapping of column name to the `field` of the details it holds, with
+    nested fields separated by dots, and its `type`. Raise a ValueError if
+    a name, field, or type is not valid.
+    """
+    columns = dict(required_detail_columns)
+    columns.update(detail_columns or {})
+
+    for name, column in columns.items():
+        if not identifier.match(name) or name in ('player_id', 'details', 'details_hash',
+            'create_timestamp'):
+            raise ValueError(f'{name} is not a valid detail column name.')
+        if not field_path.match(column.get('field', '')):
+            raise ValueError(f'{column.get("field")} is not a valid field of the details.')
+        if column.get('type', 'text') not in detail_column_types:
+            raise ValueError(f'{column.get("type")} is not a supported detail column type.')
+
+    return {name: {'field': column['field'], 'type': column.get('type', 'text')}
+        for name, column in columns.items()}
+
+
+def detail_projection(column: Dict[str, str], details: str = 'details') -> str:
     """
-    quality_check_sql = """
-    UPDATE stage.player_info
-    SET passed_data_quality_check = true
-    WHERE details ? 'data';
+    Return the SQL expression extracting the field of `column` from the
+    jsonb expression `details`, cast to the column's type. Empty strings
+    are NULL in columns that are not text.
     """
+    value = f"{details} #>> '{{{','.join(column['field'].split('.'))}}}'"
+    if column['type'] == 'text':
+        return value
+    return f"NULLIF({value}, '')::{column['type']}"
 
-    cursor.execute(quality_check_sql)
 
-    cursor.execute("SELECT COUNT(*) FROM stage.player_info WHERE "
-        "passed_data_quality_check = false;")
-    number_bad = cursor.fetchone()[0]
-    if number_bad > 0:
-        log.write_warning(f'Rejected {number_bad} player records due to data quality.')
+def prepare_detail_columns(cursor: psycopg2.extensions.cursor,
+    detail_columns: Dict[str, Dict[str, str]], gin_index: bool = False) -> List[str]:
+    """
+    Using `cursor`, add each column in `detail_columns` that
+    prepared.player_info lacks, filled from the details of the players
+    already loaded, with a btree index. Create a `jsonb_path_ops` GIN index
+    on the details if `gin_index` is True, or drop it otherwise. Changing
+    the table locks it, so it is only changed when the configuration has.
+    Return the names of the columns added.
+    """
+    cursor.execute("SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = 'prepared' AND table_name = 'player_info';")
+    existing_columns = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT indexname FROM pg_indexes "
+        "WHERE schemaname = 'prepared' AND tablename = 'player_info';")
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+
+    added_columns = [name for name in detail_columns if name not in existing_columns]
+    for name in added_columns:
+        cursor.execute(f'ALTER TABLE prepared.player_info '
+            f'ADD COLUMN {name} {detail_columns[name]["type"]};')
+        cursor.execute(f'UPDATE prepared.player_info '
+            f'SET {name} = {detail_projection(detail_columns[name])};')
+
+    for name in detail_columns:
+        if f'ix_player_info_{name}' not in existing_indexes:
+            cursor.execute(f'CREATE INDEX ix_player_info_{name} ON prepared.player_info ({name});')
+
+    if gin_index and details_gin_index not in existing_indexes:
+        cursor.execute(f'CREATE INDEX {details_gin_index} '
+            'ON prepared.player_info USING GIN (details jsonb_path_ops);')
+    elif not gin_index and details_gin_index in existing_indexes:
+        cursor.execute(f'DROP INDEX prepared.{details_gin_index};')
+
+    return added_columns
 
 
 def move_checked_data(cursor: psycopg2.extensions.cursor, 
-    retain_staging_data: bool) -> None:
+    retain_staging_data: bool, prepared_schema: str = 'prepared',
+    detail_columns: Optional[Dict[str, Dict[str, str]]] = None) -> int:
     """
-    Using `cursor`, copy rows from stage.player_info to prepared.player_info
-    rows that passed the data quality checks. Copy rows that failed the 
-    data quality checks from stage.player_info to error.player_info.
-    Remove rows from the stage.player_blobs and stage.player_info tables to clean 
-    up for the next run unless `retain_staging_data` is True.
+    Using `cursor`, copy the rows of stage.player_info that passed the data
+    quality checks to prepared.player_info, projecting the fields of
+    `detail_columns` into their columns, and the rest to error.player_info.
+    Empty the staging tables unless `retain_staging_data` is True. Return the
+    number of rows copied.
     """
+    detail_columns = detail_columns or make_detail_columns()
+    column_names = ''.join(f', {name}' for name in detail_columns)
+    projections = ''.join(', ' + detail_projection(column, projected_details)
+        for column in detail_columns.values())
+
     # Copy the rows that passed the data quality check to the `prepared` table
-    copy_to_processed_sql = """
-    INSERT INTO prepared.player_info (player_id, details, create_timestamp)
+    copy_to_processed_sql = f"""
+    INSERT INTO {prepared_schema}.player_info (player_id, details, details_hash, create_timestamp
+    {column_names})
     SELECT player_id
     , details -> 'data'
+    , md5((details -> 'data')::text)
     , create_timestamp
+    {projections}
     FROM stage.player_info
     WHERE passed_data_quality_check = true;
     """
 
     cursor.execute(copy_to_processed_sql)
+    prepared_count = cursor.rowcount
 
+    return prepared_count + move_failed_data(cursor, retain_staging_data)
+
+
+def move_failed_data(cursor: psycopg2.extensions.cursor,
+    retain_staging_data: bool) -> int:
+    """
+    Using `cursor`, copy rows that failed the data quality checks from
+    stage.player_info to error.player_info. Remove rows from the
+    stage.player_blobs and stage.player_info tables to clean up for the
+    next run unless `retain_staging_data` is True. Return the number of
+    rows copied.
+    """
     # Copy the rows that failed the data quality check to the `problem` table
     copy_to_error_sql = """
-    INSERT INTO error.player_info (player_id, details, create_timestamp)
+    INSERT INTO error.player_info (player_id, details, create_timestamp, rejection_reason)
     SELECT player_id
     , details
     , create_timestamp
+    , rejection_reason
     FROM stage.player_info
     WHERE passed_data_quality_check = false;
     """
     
     cursor.execute(copy_to_error_sql)
+    error_count = cursor.rowcount
 
     # Clean out the stage tables for the next run
     if not retain_staging_data:
         cursor.execute('TRUNCATE TABLE stage.player_blobs;')
         cursor.execute('TRUNCATE TABLE stage.player_info;')
 
+    return error_count
+
+
+def upsert_checked_data(cursor: psycopg2.extensions.cursor,
+    retain_staging_data: bool, full_snapshot: bool, log: logger.Log,
+    detail_columns: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, int]:
+    """
+    Incremental counterpart of `move_checked_data`. Using `cursor`, insert
+    players from stage.player_info that passed the data quality checks and
+    are not in prepared.player_info, and update the players whose `data`
+    document hash changed. Players that did not change are not written. If
+    `full_snapshot` is True, players missing from stage.player_info are
+    deleted from prepared.player_info. Copy rows that failed the data quality
+    checks to error.player_info. Remove rows from the stage tables unless
+    `retain_staging_data` is True. The fields of `detail_columns` (default
+    the required detail columns) are projected into their columns. Log to
+    `log` and return the number of players added, changed, removed, and
+    unchanged.
+    """
+    detail_columns = detail_columns or make_detail_columns()
+    column_names = ''.join(f', {name}' for name in detail_columns)
+    projections = ''.join(f', {detail_projection(column, projected_details)} AS {name}'
+        for name, column in detail_columns.items())
+    updates = ''.join(f', {name} = staged.{name}' for name in detail_columns)
+
+    stage_players_sql = f"""
+    DROP TABLE IF EXISTS staged_player;
+    CREATE TEMPORARY TABLE staged_player ON COMMIT DROP AS
+    SELECT DISTINCT ON (player_id) player_id
+    , details -> 'data' AS details
+    , md5((details -> 'data')::text) AS details_hash
+    , create_timestamp
+    {projections}
+    FROM stage.player_info
+    WHERE passed_data_quality_check = true
+    ORDER BY player_id, create_timestamp DESC;
+
+    CREATE INDEX ON staged_player (player_id);
+    ANALYZE staged_player;
+    """
+    cursor.execute(stage_players_sql)
+
+    update_changed_sql = f"""
+    UPDATE prepared.player_info prepared
+    SET details = staged.details
+    , details_hash = staged.details_hash
+    , create_timestamp = staged.create_timestamp
+    {updates}
+    FROM staged_player staged
+    WHERE prepared.player_id = staged.player_id
+    AND prepared.details_hash IS DISTINCT FROM staged.details_hash;
+    """
+    cursor.execute(update_changed_sql)
+    changed = cursor.rowcount
+
+    insert_added_sql = f"""
+    INSERT INTO prepared.player_info (player_id, details, details_hash, create_timestamp
+    {column_names})
+    SELECT player_id, details, details_hash, create_timestamp{column_names}
+    FROM staged_player staged
+    WHERE NOT EXISTS
+    (SELECT 1 FROM prepared.player_info prepared WHERE prepared.player_id = staged.player_id);
+    """
+    cursor.execute(insert_added_sql)
+    added = cursor.rowcount
+
+    removed = 0
+    if full_snapshot:
+        delete_removed_sql = """
+        DELETE FROM prepared.player_info prepared
+        WHERE NOT EXISTS
+        (SELECT 1 FROM staged_player staged WHERE staged.player_id = prepared.player_id);
+        """
+        cursor.execute(delete_removed_sql)
+        removed = cursor.rowcount
+
+    cursor.execute('SELECT COUNT(*) FROM staged_player;')
+    unchanged = cursor.fetchone()[0] - added - changed
+    changes = {'added': added, 'changed': changed, 'removed': removed, 'unchanged': unchanged}
+
+    for change, count in changes.items():
+        log.write_metric(f'players_{change}', count)
+    log.write_metric('player_rows_touched', added + changed + removed)
+    log.write_metric('player_rows_skipped', unchanged)
+
+    move_failed_data(cursor, retain_staging_data)
+
+    return changes
+
+
+class PlayerLoadOptions:
+    """
+    How `load_data` loads the player data, as set by configuration.yml.
+    Player pages are downloaded concurrently by `download_workers` threads.
+    If `incremental` is True only players that are new or whose details
+    changed are written to prepared.player_info, and players missing from
+    the download are deleted if `full_snapshot` is True. If `shadow_publish`
+    is True full loads are built in a shadow table that is swapped in,
+    keeping the `retained_generations` most recent replaced tables. The
+    fields in `detail_columns`, along with the required detail columns, are
+    projected into typed, indexed columns of prepared.player_info, and the
+    details are indexed with a GIN index if `details_gin_index` is True. If
+    `chunk_pages` is greater than 0 the pages are staged in chunks of that
+    many pages, each committed with a checkpoint a failed load resumes from.
+    Players must pass the `data_quality_rules`, or the default rules if None.
+    """
+
+    def __init__(self, download_workers: int = 1, incremental: bool = False,
+        full_snapshot: bool = True, shadow_publish: bool = False, retained_generations: int = 2,
+        detail_columns: Optional[Dict[str, Dict[str, str]]] = None,
+        details_gin_index: bool = False, chunk_pages: int = 0,
+        data_quality_rules: Optional[List[Dict[str, Any]]] = None):
+        self.download_workers = download_workers
+        self.incremental = incremental
+        self.full_snapshot = full_snapshot
+        self.shadow_publish = shadow_publish
+        self.retained_generations = retained_generations
+        self.detail_columns = detail_columns
+        self.details_gin_index = details_gin_index
+        self.chunk_pages = chunk_pages
+        self.data_quality_rules = data_quality_rules
+
+
+    @classmethod
+    def from_config(cls, config: Dict[Any, Any]) -> 'PlayerLoadOptions':
+        """
+        Return the options set in `config`, the settings of configuration.yml.
+        """
+        return cls(download_workers=config.get('player_download_workers', 1),
+            incremental=config.get('incremental_player_load', False),
+            shadow_publish=config.get('shadow_publish', False),
+            retained_generations=config.get('retained_generations', 2),
+            detail_columns=config.get('player_detail_columns'),
+            details_gin_index=config.get('player_details_gin_index', False),
+            chunk_pages=config.get('load_chunk_pages', 0),
+            data_quality_rules=config.get('player_quality_rules'))
+
 
 def load_data(data_url: str, host: str, port: int, database: str, user: str, 
-    password: str, replace_existing_data: bool) -> None:
+    password: str, replace_existing_data: bool, options: Optional[PlayerLoadOptions] = None,
+    connection: Optional[psycopg2.extensions.connection] = None,
+    cache: Optional[source_cache.SourceCache] = None) -> bool:
     """
     Wrapper function for the player pipeline. Download data from `data_url`. 
     Create a database connection using `host`, `port`, `database`, `user`, 
     and `password` and load downloaded data into the stage.player_info table. 
-    Move rows that satisfy data quality
-    rules to the prepared.player_info table and rows that fail checks to the
-    error.player_info table. If `replace_existing_data` is True remove data 
+    Move rows that pass the data quality rules to the prepared.player_info
+    table and rows that fail checks to the error.player_info table, with the
+    code of the rule they fail. If `replace_existing_data` is True remove data 
     from the prepared.player_info table before new data is added from the 
-    stage.player_info table.
+    stage.player_info table, unless the load is incremental. The load is
+    configured by `options`, or the defaults if None. If `connection` is
+    given it is used instead of creating one, and the changes are left
+    uncommitted for the caller to publish, or rolled back if the load fails.
+    A shadow table is then left for the caller to swap in with
+    `shadow_tables.swap_shadow_tables`. If `cache` is given the pages are
+    fetched through it, and if no page changed since the player data was
+    last loaded the load is skipped. The pages are marked loaded once
+    committed, so the caller marks them if it publishes the changes. Moving
+    the players to prepared.player_info is done in a single transaction.
+    Return True if the data was loaded or unchanged.
     """
+    options = options or PlayerLoadOptions()
     log = logger.Log()
     log.write_info('Begin load_player_data.load_data')
 
-    connection = None
+    try:
+        columns = make_detail_columns(options.detail_columns)
+        rules = make_data_quality_rules(options.data_quality_rules)
+    except ValueError as error:
+        log.write_error(f'The player detail columns or data quality rules are not valid. '
+            f'{error.args}')
+        log.write_info('End load_player_data.load_data')
+        log.export_metrics()
+        return False
+
+    owns_connection = connection is None
+    loaded = False
+    shadow = options.shadow_publish and replace_existing_data and not options.incremental
     
+    checkpoint_source = f'player {data_url}'
+    chunked = options.chunk_pages > 0
+    resumed = False
+
     try:
-        connection = utils.make_db_connection(host, port, database, user, password)
+        if chunked:
+            with log.span('player_stage_chunks') as span:
+                span.rows, resumed = stage_pages_in_chunks(data_url, checkpoint_source,
+                    options.chunk_pages, host, port, database, user, password, log,
+                    options.download_workers, cache)
+
+        if connection is None:
+            connection = utils.make_db_connection(host, port, database, user, password)
         cursor = connection.cursor()
 
-        download_and_insert_data(data_url, cursor, log)
-        debatch_blob(cursor)
-        check_and_mark_data_quality(cursor,log)
-
-        if replace_existing_data:
-            cursor.execute('TRUNCATE TABLE prepared.player_info;')
-
-        move_checked_data(cursor, False)
-
+        with log.span('player_prepare_detail_columns'):
+            added_columns = prepare_detail_columns(cursor, columns, options.details_gin_index)
+        if added_columns:
+            log.write_info(f'Added the player detail columns {", ".join(added_columns)}.')
+
+        # The checkpoint is cleared with the publish, and a load that is not
+        # chunked discards the pages staged by an interrupted one
+        checkpoints.clear_checkpoint(cursor, checkpoint_source, [] if chunked
+            else ['stage.player_blobs'])
+
+        if not chunked:
+            if cache is not None:
+                cursor.execute('SAVEPOINT load_player_pages;')
+            with log.span('player_load_pages') as span:
+                span.rows = download_and_insert_data(data_url, cursor, log,
+                    options.download_workers, cache=cache)
+
+        # Pages staged before a resumed load are loaded whether they changed or not
+        unchanged = cache is not None and not resumed and not cache.has_changes(data_url)
+        if unchanged:
+            if chunked:
+                cursor.execute('TRUNCATE TABLE stage.player_blobs;')
+            else:
+                cursor.execute('ROLLBACK TO SAVEPOINT load_player_pages;')
+            log.write_info('The player data has not changed since it was last loaded.')
+        else:
+            with log.span('player_debatch') as span:
+                span.rows = debatch_blob(cursor)
+            with log.span('player_check_data_quality') as span:
+                span.rows = check_and_mark_data_quality(cursor, log, rules)
+
+            if options.incremental:
+                with log.span('player_upsert_checked_data'):
+                    upsert_checked_data(cursor, False, options.full_snapshot, log, columns)
+            elif shadow:
+                with log.span('player_create_shadow_tables'):
+                    shadow_tables.create_shadow_tables(cursor, published_tables)
+                with log.span('player_move_checked_data') as span:
+                    span.rows = move_checked_data(cursor, False, shadow_tables.shadow_schema,
+                        columns)
+                with log.span('player_build_shadow_indexes'):
+                    shadow_tables.build_shadow_indexes(cursor, published_tables)
+                if owns_connection:
+                    with log.span('player_swap_shadow_tables'):
+                        shadow_tables.swap_shadow_tables(cursor, options.retained_generations)
+            else:
+                if replace_existing_data:
+                    with log.span('player_truncate_prepared'):
+                        cursor.execute('TRUNCATE TABLE prepared.player_info;')
+
+                with log.span('player_move_checked_data') as span:
+                    span.rows = move_checked_data(cursor, False, detail_columns=columns)
+
+        if owns_connection and not unchanged:
+            load_generation.advance_load_generation(cursor)
         cursor.close()
-        connection.commit()
+        if owns_connection:
+            with log.span('player_commit'):
+                connection.commit()
+            if cache is not None:
+                cache.mark_loaded(data_url)
+        loaded = True
 
     except (requests.exceptions.HTTPError) as error:
         log.write_error(f'There was an error downloading the player data. {error.args}')
+    except ValueError as error:
+        log.write_error(f'The player data is not in the expected format. {error.args}')
     except (psycopg2.OperationalError, psycopg2.Error) as error:
         log.write_error(f'There was a database error. {error.args}')
 
     finally:
-        if connection:
+        if connection and owns_connection:
             connection.close()
+        elif connection and not loaded:
+            connection.rollback()
 
     log.write_info('End load_player_data.load_data')
+    log.export_metrics()
+
+    return loaded
 
 
 
@@ -0,0 +1,135 @@
+import numpy as np
+import psycopg2
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+from loaders import game_replay
+
+# Each move of a packed game is one byte holding the move's column, plus
+# second_player_flag when the move was made by the game's second player
+second_player_flag = 0x80
+max_column = second_player_flag - 1
+
+result_names = {game_replay.no_result: '', game_replay.win_result: 'win',
+    game_replay.draw_result: 'draw'}
+
+read_packed_games_sql = '''
+SELECT game_id, first_player, second_player, moves, result
+FROM reporting.packed_game
+ORDER BY game_id;
+'''
+
+
+class PackedGame:
+    """
+    A game of reporting.packed_game. `moves` holds one byte per move in move
+    order, and `result` is the `game_replay` result code of the last move.
+    """
+
+    def __init__(self, game_id: str, first_player: str, second_player: Optional[str],
+        moves: bytes, result: int):
+        self.game_id = game_id
+        self.first_player = first_player
+        self.second_player = second_player
+        self.moves = bytes(moves)
+        self.result = result
+
+
+    def player(self, move: int) -> Optional[str]:
+        return self.second_player if move & second_player_flag else self.first_player
+
+
+    @property
+    def columns(self) -> List[int]:
+        return [move & max_column for move in self.moves]
+
+
+    @property
+    def players(self) -> List[Optional[str]]:
+        return [self.player(move) for move in self.moves]
+
+
+    @property
+    def first_column(self) -> Optional[int]:
+        return self.moves[0] & max_column if self.moves else None
+
+
+    @property
+    def last_player(self) -> Optional[str]:
+        return self.player(self.moves[-1]) if self.moves else None
+
+
+    @property
+    def winner(self) -> Optional[str]:
+        return self.last_player if self.result == game_replay.win_result else None
+
+
+    def rows(self) -> List[Tuple[str, Optional[str], int, int, str]]:
+        """
+        Return the game's rows as in prepared.game_data: game_id, player_id,
+        move_number, column, and result.
+        """
+        last = len(self.moves)
+        return [(self.game_id, self.player(move), number, move & max_column,
+            result_names[self.result] if number == last else '')
+            for number, move in enumerate(self.moves, start=1)]
+
+
+def pack_moves(players: Sequence[str], columns: Sequence[int]) \
+    -> Tuple[str, Optional[str], bytes]:
+    """
+    Pack the moves of a game, given the player and column of each move in
+    move order, as `load_game_data.refresh_packed_games` does. Return the
+    first player, the second player, and the packed moves. Raise a
+    ValueError if the game has more than two players or a column does not
+    fit in a packed move.
+    """
+    first_player = players[0]
+    second_players = set(players) - {first_player}
+    if len(second_players) > 1:
+        raise ValueError('A packed game can only have two players.')
+    if any(not 0 <= column <= max_column for column in columns):
+        raise ValueError(f'The columns of a packed game must be between 0 and {max_column}.')
+
+    moves = bytes(column | (second_player_flag if player != first_player else 0)
+        for player, column in zip(players, columns))
+    return first_player, next(iter(second_players), None), moves
+
+
+def decode_moves(moves: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decode the packed `moves` of many games at once into grids with one row
+    per game and one column per move number, laid out as by
+    `game_replay.encode_moves`, so they can be passed to
+    `game_replay.replay_games`. Return the grid of columns, the grid of
+    whether each move was made by the second player, and the number of moves
+    in each game.
+    """
+    move_counts = np.fromiter((len(game) for game in moves), dtype=np.int64, count=len(moves))
+    width = max(game_replay.max_moves, int(move_counts.max(initial=0)))
+    packed = np.frombuffer(b''.join(moves), dtype=np.uint8)
+
+    # The position of each packed move within its game
+    game_index = np.repeat(np.arange(len(moves)), move_counts)
+    slot = np.arange(len(packed)) - np.repeat(np.cumsum(move_counts) - move_counts, move_counts)
+    grid = np.zeros((len(moves), width), dtype=np.uint8)
+    grid[game_index, slot] = packed
+
+    return (grid & max_column).astype(np.int64), (grid & second_player_flag) != 0, move_counts
+
+
+def read_packed_games(connection: psycopg2.extensions.connection,
+    batch_rows: int = 10000) -> Iterator[PackedGame]:
+    """
+    Using `connection`, read the games of reporting.packed_game in game_id
+    order through a server-side cursor, `batch_rows` games at a time, so
+    reading every game needs little memory.
+    """
+    cursor: Any = connection.cursor('read_packed_games',
+        cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cursor.itersize = batch_rows
+        cursor.execute(read_packed_games_sql)
+        for row in cursor:
+            yield PackedGame(*row)
+    finally:
+        cursor.close()
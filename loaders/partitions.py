@@ -0,0 +1,90 @@
+import psycopg2
+import re
+from typing import List, Tuple
+
+# The game tables are partitioned by the hash of their game_id
+partition_key = 'game_id'
+
+partition_bound = re.compile(r'remainder (\d+)')
+
+# Plans joins and aggregates of partitioned tables one partition at a time,
+# for the rest of the current transaction
+partitionwise_planning_sql = 'SET LOCAL enable_partitionwise_join = on; ' \
+    'SET LOCAL enable_partitionwise_aggregate = on;'
+
+
+def partition_name(table: str, remainder: int) -> str:
+    """
+    Return the name of the partition of `table` holding the rows whose
+    hash leaves `remainder`.
+    """
+    return f'{table}_p{remainder}'
+
+
+def table_partitions(cursor: psycopg2.extensions.cursor, table: str) -> List[str]:
+    """
+    Using `cursor`, return the partitions of `table` in the order of their
+    hash remainder, or an empty list if it is not partitioned.
+    """
+    cursor.execute('''
+    SELECT partition.oid::regclass::text, pg_get_expr(partition.relpartbound, partition.oid)
+    FROM pg_inherits
+    JOIN pg_class partition ON pg_inherits.inhrelid = partition.oid
+    WHERE pg_inherits.inhparent = %s::regclass;
+    ''', (table,))
+    bounds = []
+    for partition, bound in cursor.fetchall():
+        remainder = partition_bound.search(bound)
+        bounds.append((int(remainder.group(1)) if remainder else 0, partition))
+    return [partition for _, partition in sorted(bounds)]
+
+
+def create_table_like(cursor: psycopg2.extensions.cursor, table: str, like_table: str,
+    partition_count: int) -> None:
+    """
+    Using `cursor`, create `table` with the columns, defaults, and check
+    constraints of `like_table`, but not its indexes or key constraints.
+    If `partition_count` is greater than 0 the table is partitioned into
+    that many partitions by the hash of the `partition_key`.
+    """
+    partitioning = f' PARTITION BY HASH ({partition_key})' if partition_count > 0 else ''
+    cursor.execute(f'CREATE TABLE {table} (LIKE {like_table} INCLUDING ALL '
+        f'EXCLUDING INDEXES){partitioning};')
+    for remainder in range(partition_count):
+        cursor.execute(f'CREATE TABLE {partition_name(table, remainder)} PARTITION OF {table} '
+            f'FOR VALUES WITH (MODULUS {partition_count}, REMAINDER {remainder});')
+
+
+def move_table(cursor: psycopg2.extensions.cursor, table: str, schema: str,
+    name: str) -> None:
+    """
+    Using `cursor`, rename `table` to `name` in `schema`, together with its
+    partitions, which keep their suffix after the table's name.
+    """
+    table_schema, table_name = table.split('.')
+    for partition in table_partitions(cursor, table):
+        partition_schema, old_name = partition.split('.')
+        new_name = name + old_name[len(table_name):]
+        if new_name != old_name:
+            cursor.execute(f'ALTER TABLE {partition} RENAME TO {new_name};')
+        if partition_schema != schema:
+            cursor.execute(f'ALTER TABLE {partition_schema}.{new_name} SET SCHEMA {schema};')
+
+    if name != table_name:
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {name};')
+    if table_schema != schema:
+        cursor.execute(f'ALTER TABLE {table_schema}.{name} SET SCHEMA {schema};')
+
+
+def matching_partitions(cursor: psycopg2.extensions.cursor, source: str,
+    target: str) -> List[Tuple[str, str]]:
+    """
+    Using `cursor`, pair each partition of `source` with the partition of
+    `target` holding the same game_ids, or return the two tables as the
+    only pair if they are not partitioned alike.
+    """
+    source_partitions = table_partitions(cursor, source)
+    target_partitions = table_partitions(cursor, target)
+    if source_partitions and len(source_partitions) == len(target_partitions):
+        return list(zip(source_partitions, target_partitions))
+    return [(source, target)]
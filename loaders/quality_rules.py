@@ -0,0 +1,391 @@
+import collections
+import decimal
+import functools
+import json
+import psycopg2
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import logger
+
+# The kinds of rules, with the kinds that apply to a group of rows
+rule_kinds = ['not_null', 'regex', 'range', 'enum', 'has_key', 'distinct_count']
+group_rule_kinds = ['distinct_count']
+
+# The columns of the stage tables rules can check, and the columns that hold JSON
+game_columns = ['game_id', 'player_id', 'move_number', 'column', 'result']
+player_columns = ['player_id', 'details']
+player_json_columns = ['details']
+
+# The rules applied when `configuration.yml` does not set them. Rows of a
+# game are rejected together, so a game fails if any of its rows fail
+default_game_rules: List[Dict[str, Any]] = [
+    {'code': 'game_id_missing', 'column': 'game_id', 'not_null': True},
+    {'code': 'move_number_not_integer', 'column': 'move_number', 'regex': '^[0-9]+$'},
+    {'code': 'column_not_integer', 'column': 'column', 'regex': '^[0-9]+$'},
+    {'code': 'column_out_of_range', 'column': 'column', 'range': {'max': 4}},
+    {'code': 'invalid_result', 'column': 'result', 'enum': ['', 'win', 'draw']},
+    {'code': 'not_two_players', 'column': 'player_id', 'distinct_count': {'min': 2, 'max': 2}},
+]
+default_player_rules: List[Dict[str, Any]] = [
+    {'code': 'missing_data', 'column': 'details', 'has_key': 'data'},
+]
+
+identifier = re.compile(r'^[a-z_][a-z0-9_]*$')
+field_path = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+numeric_pattern = r'^-?[0-9]+(\.[0-9]+)?$'
+
+# The parts of a regex that Python's re and PostgreSQL's regular expressions
+# read alike: escaped punctuation, bracket expressions of literal characters
+# and ranges, greedy quantifiers, and other literal characters. Everything
+# else, such as \d, lookarounds, and (?i), is not portable
+pattern_token = re.compile(r'''
+    (?P<escape>\\[^A-Za-z0-9\s])
+    | (?P<bracket>\[\^?\]?[^\]\\\[]*\])
+    | (?P<quantifier>[*+?]|\{[0-9]+(,[0-9]*)?\})
+    | (?P<literal>[^\\\[\]{}*+?])
+    ''', re.VERBOSE)
+
+
+class QualityRule:
+    """
+    A data quality rule that rows of a stage table must pass, recorded as
+    `code` in the rejection_reason of the rows that fail it. The rule checks
+    `column`, or the `field` of it when `column` holds JSON, with nested
+    fields separated by dots. `kind` is one of `rule_kinds`, and `argument`
+    is its pattern, bounds, values, or key. Null values pass every kind but
+    not_null and has_key. Range rules only compare numbers, leaving other
+    values to a regex rule. A distinct_count rule bounds the number of
+    distinct values in each group of rows.
+    """
+
+    def __init__(self, code: str, column: str, kind: str, argument: Any,
+        field: Optional[str] = None):
+        self.code = code
+        self.column = column
+        self.kind = kind
+        self.argument = argument
+        self.field = field
+
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, QualityRule) and vars(self) == vars(other)
+
+
+    @property
+    def is_group_rule(self) -> bool:
+        return self.kind in group_rule_kinds
+
+
+    def value_sql(self) -> str:
+        if self.field:
+            return f'("{self.column}" #>> \'{{{self.field.replace(".", ",")}}}\')'
+        return f'"{self.column}"'
+
+
+    def condition_sql(self, cursor: psycopg2.extensions.cursor) -> str:
+        """
+        Return the SQL condition that is false for the rows, or groups of
+        rows for a distinct_count rule, that fail the rule, with its
+        literals quoted by `cursor`.
+        """
+        value = self.value_sql()
+        literal = lambda argument: cursor.mogrify('%s', (argument,)).decode()
+
+        if self.kind == 'not_null':
+            return f'{value} IS NOT NULL'
+        if self.kind == 'regex':
+            return f'{value} ~ {literal(self.argument)}'
+        if self.kind == 'enum':
+            return f'{value} IN ({", ".join(literal(v) for v in self.argument)})'
+        if self.kind == 'has_key':
+            path = f'{self.field}.{self.argument}' if self.field else self.argument
+            return f'"{self.column}" #> {literal(path.split("."))} IS NOT NULL'
+
+        if self.kind == 'range':
+            measured = f'CASE WHEN {value}::text ~ \'{numeric_pattern}\' ' \
+                f'THEN {value}::text::numeric END'
+        else:
+            measured = f'COUNT(DISTINCT {value})'
+        bounds = [f'{measured} {operator} {literal(self.argument[bound])}' for bound, operator in
+            (('min', '>='), ('max', '<=')) if self.argument.get(bound) is not None]
+        return ' AND '.join(bounds) or 'true'
+
+
+    def passes(self, values: Sequence[Optional[str]]) -> bool:
+        """
+        Return whether `values`, the value of a row or the values of a
+        group for a distinct_count rule, pass the rule, as the SQL
+        condition does.
+        """
+        if self.kind == 'distinct_count':
+            count = len({value for value in values if value is not None})
+            return self.in_range(count)
+
+        if self.field or self.kind == 'has_key':
+            raise ValueError(f'The rule {self.code} can only be checked in the database.')
+        value = values[0]
+        if self.kind == 'not_null':
+            return value is not None
+        if value is None:
+            return True
+        if self.kind == 'regex':
+            return python_pattern(self.argument).search(value) is not None
+        if self.kind == 'enum':
+            return value in self.argument
+        return not re.match(numeric_pattern, value) or self.in_range(decimal.Decimal(value))
+
+
+    def passes_json(self, document: Any) -> bool:
+        """
+        Return whether `document`, the decoded JSON value of the rule's
+        column in a row, passes the rule, as the SQL condition does. The
+        checked field is compared as the text `json_text` returns. Raise a
+        ValueError if the rule compares a whole JSON object or array, whose
+        text only the database produces.
+        """
+        path = self.field.split('.') if self.field else []
+        if self.kind == 'has_key':
+            path += self.argument.split('.')
+        value, found = document, True
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                value, found = None, False
+                break
+            value = value[key]
+
+        if self.kind == 'has_key':
+            return found
+        if self.kind == 'not_null':
+            return value is not None
+        if isinstance(value, (dict, list)):
+            raise ValueError(f'The rule {self.code} can only be checked in the database.')
+        return self.passes([json_text(value)])
+
+
+    def in_range(self, number: Any) -> bool:
+        minimum, maximum = self.argument.get('min'), self.argument.get('max')
+        return (minimum is None or number >= minimum) and (maximum is None or number <= maximum)
+
+
+@functools.lru_cache(maxsize=None)
+def python_pattern(pattern: str) -> 're.Pattern[str]':
+    """
+    Return `pattern`, a regex as PostgreSQL reads it, compiled to match the
+    same values in Python, where `.` also matches a line break and `$` only
+    the end of the value. Raise a ValueError if `pattern` is not made of
+    the parts of a regex both read alike.
+    """
+    translated = []
+    previous = None
+    position = 0
+    while position < len(pattern):
+        token = pattern_token.match(pattern, position)
+        # A quantifier must repeat something, and quantifiers do not stack
+        if token is None or (token.lastgroup == 'quantifier' and previous in (None, '^',
+            'quantifier', '(', '|')):
+            raise ValueError(f'{pattern} is not a pattern PostgreSQL and Python read alike.')
+        text = token.group()
+        translated.append('\\Z' if text == '$' else text)
+        previous = token.lastgroup if token.lastgroup != 'literal' else text
+        position = token.end()
+
+    try:
+        return re.compile(''.join(translated), re.DOTALL)
+    except re.error:
+        raise ValueError(f'{pattern} is not a valid pattern.')
+
+
+def json_text(value: Any) -> Optional[str]:
+    """
+    Return `value`, decoded from JSON, as text in the way the PostgreSQL
+    `->>` operator does.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return json.dumps(value)
+
+
+def make_quality_rules(rules: Optional[List[Dict[str, Any]]],
+    default_rules: List[Dict[str, Any]], columns: List[str],
+    json_columns: Sequence[str] = (), grouped: bool = False) -> List[QualityRule]:
+    """
+    Return the `QualityRule`s declared in `rules`, or in `default_rules` if
+    it is None. Each declaration has the rule's `code`, its `column`, one of
+    `columns`, an optional `field` of the `json_columns`, and one of
+    `rule_kinds` as the key of its argument. has_key rules apply to the
+    `json_columns`, and distinct_count rules only if the rows are `grouped`.
+    Raise a ValueError if a declaration is not valid.
+    """
+    quality_rules = []
+    codes = set()
+    for rule in default_rules if rules is None else rules:
+        code, column, field = rule.get('code', ''), rule.get('column', ''), rule.get('field')
+        kinds = [kind for kind in rule_kinds if kind in rule]
+        if not identifier.match(code) or code in codes:
+            raise ValueError(f'{code} is not a valid data quality rule code.')
+        if column not in columns:
+            raise ValueError(f'{column} is not a valid column for the rule {code}.')
+        if field is not None and (column not in json_columns or not field_path.match(field)):
+            raise ValueError(f'{field} is not a valid field for the rule {code}.')
+        if len(kinds) != 1:
+            raise ValueError(f'The rule {code} must have one of {", ".join(rule_kinds)}.')
+
+        kind, argument = kinds[0], rule[kinds[0]]
+        if (kind == 'has_key' and column not in json_columns) or \
+            (kind in group_rule_kinds and not grouped):
+            raise ValueError(f'The rule {code} can not be a {kind} rule of these rows.')
+        if kind in ('range', 'distinct_count'):
+            if not isinstance(argument, dict) or not set(argument) <= {'min', 'max'} \
+                or not all(isinstance(v, (int, float)) for v in argument.values()):
+                raise ValueError(f'The {kind} of the rule {code} must have a numeric min or max.')
+        elif kind == 'enum':
+            if not isinstance(argument, list):
+                raise ValueError(f'The enum of the rule {code} must be a list.')
+            argument = [str(value) for value in argument]
+        elif kind == 'has_key':
+            if not isinstance(argument, str) or not field_path.match(argument):
+                raise ValueError(f'{argument} is not a valid key for the rule {code}.')
+        elif kind == 'regex':
+            if not isinstance(argument, str):
+                raise ValueError(f'{argument} is not a valid pattern for the rule {code}.')
+            try:
+                python_pattern(argument)
+            except ValueError as error:
+                raise ValueError(f'{error.args[0]} The rule {code} can not use it.')
+
+        codes.add(code)
+        quality_rules.append(QualityRule(code, column, kind, argument, field))
+    return quality_rules
+
+
+def first_failure_sql(failures: List[Tuple[str, str]],
+    cursor: psycopg2.extensions.cursor) -> str:
+    """
+    Return a SQL expression for the code of the first of `failures`, each a
+    rule code and the condition of failing it, that is true, or null if
+    none are.
+    """
+    if not failures:
+        return 'NULL::text'
+    cases = ' '.join(f'WHEN {condition} THEN {cursor.mogrify("%s", (code,)).decode()}'
+        for code, condition in failures)
+    return f'CASE {cases} END'
+
+
+def check_and_mark_rows(cursor: psycopg2.extensions.cursor, log: logger.Log, table: str,
+    rules: List[QualityRule], metric_prefix: str, group_column: Optional[str] = None) -> int:
+    """
+    Using `cursor`, mark the rows of the stage table `table` that pass every
+    rule in `rules`, and set the rejection_reason of each other row to the
+    code of the first rule it fails. If `group_column` is set the rows with
+    the same value of it are rejected together, with the code of the first
+    rule a row of the group fails, and distinct_count rules apply to each
+    group. The rows are checked and marked in one update that also counts
+    the rows failing each rule, so more rules do not mean more scans. Log to `log` the count of each rule
+    as the `<metric_prefix>_rejected_<code>` metric, and a warning if any
+    rows fail. Return the number of rows that pass.
+    """
+    row_rules = [rule for rule in rules if not rule.is_group_rule]
+    group_rules = [rule for rule in rules if rule.is_group_rule]
+    row_conditions = [(rule.code, rule.condition_sql(cursor)) for rule in row_rules]
+    row_reason = first_failure_sql(
+        [(code, f'({condition}) IS FALSE') for code, condition in row_conditions], cursor)
+
+    group_reason = 'NULL::text'
+    group_source = ''
+    group_flags = ''
+    if group_column is not None:
+        # A group fails a row rule when any of its rows do, and the rules
+        # are tried in the order they are declared. Rows without a group
+        # are checked on their own
+        row_condition = dict(row_conditions)
+        group_failures = [(rule.code, f'({rule.condition_sql(cursor)}) IS FALSE')
+            if rule.is_group_rule else (rule.code, f'bool_or(({row_condition[rule.code]}) '
+            'IS FALSE)') for rule in rules]
+        checked_flags = ''.join(f', ({rule.condition_sql(cursor)}) IS FALSE AS failed_{index}'
+            for index, rule in enumerate(group_rules))
+        group_reason = 'CASE WHEN NOT checked_group.group_key_missing THEN checked_group.reason END'
+        group_flags = ''.join(f', NOT checked_group.group_key_missing AND '
+            f'checked_group.failed_{index} AS failed_group_{index}'
+            for index in range(len(group_rules)))
+        # The groups join on two keys rather than IS NOT DISTINCT FROM so
+        # that the join can hash
+        group_source = f'''
+        FROM
+        (
+        SELECT "{group_column}"::text AS group_key
+        , "{group_column}" IS NULL AS group_key_missing
+        , {first_failure_sql(group_failures, cursor)} AS reason
+        {checked_flags}
+        FROM {table}
+        GROUP BY "{group_column}"
+        ) AS checked_group
+        WHERE COALESCE(staged."{group_column}"::text, '') = COALESCE(checked_group.group_key, '')
+        AND (staged."{group_column}" IS NULL) = checked_group.group_key_missing'''
+
+    failure_counts = ''.join(f', COUNT(*) FILTER (WHERE failed_{index})'
+        for index in range(len(row_rules)))
+    failure_counts += ''.join(f', COUNT(*) FILTER (WHERE failed_group_{index})'
+        for index in range(len(group_rules)))
+    returned_flags = ''.join(f', ({condition}) IS FALSE AS failed_{index}'
+        for index, (_, condition) in enumerate(row_conditions))
+    cursor.execute(f'''
+    WITH marked AS
+    (
+    UPDATE {table} staged
+    SET passed_data_quality_check = COALESCE({row_reason}, {group_reason}) IS NULL
+    , rejection_reason = COALESCE({row_reason}, {group_reason})
+    {group_source}
+    RETURNING passed_data_quality_check {returned_flags} {group_flags}
+    )
+    SELECT COUNT(*) FILTER (WHERE passed_data_quality_check), COUNT(*) {failure_counts}
+    FROM marked;
+    ''')
+    passed, total, *counts = cursor.fetchone()
+
+    rule_counts = dict(zip([rule.code for rule in row_rules + group_rules], counts))
+    for rule in rules:
+        log.write_metric(f'{metric_prefix}_rejected_{rule.code}', rule_counts[rule.code])
+    if total > passed:
+        failed_rules = ', '.join(f'{rule.code} {rule_counts[rule.code]}' for rule in rules
+            if rule_counts[rule.code])
+        log.write_warning(f'Rejected {total - passed} {metric_prefix} records due to data '
+            f'quality. Rows failing each rule: {failed_rules}.')
+
+    return passed
+
+
+def check_group(rules: List[QualityRule], columns: List[str],
+    rows: List[List[Optional[str]]]) -> Tuple[List[Optional[str]], Dict[str, int]]:
+    """
+    Apply `rules` to `rows`, the rows of one group as lists of the values of
+    `columns`, as `check_and_mark_rows` does. Return the rejection reason
+    of each row, or None if the group passes, and the number of rows failing
+    each rule.
+    """
+    failures: Dict[str, int] = collections.Counter()
+    row_reasons: List[Optional[str]] = [None] * len(rows)
+    group_reason = None
+
+    for rule in rules:
+        position = columns.index(rule.column)
+        if rule.is_group_rule:
+            if not rule.passes([row[position] for row in rows]):
+                failures[rule.code] += len(rows)
+                group_reason = group_reason or rule.code
+            continue
+
+        for index, row in enumerate(rows):
+            if not rule.passes([row[position]]):
+                failures[rule.code] += 1
+                row_reasons[index] = row_reasons[index] or rule.code
+                group_reason = group_reason or rule.code
+
+    if group_reason is None:
+        return row_reasons, failures
+    return [reason or group_reason for reason in row_reasons], failures
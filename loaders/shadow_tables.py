@@ -0,0 +1,269 @@
+import psycopg2
+import re
+from typing import List, Optional, Tuple
+
+from loaders import partitions
+
+shadow_schema = 'shadow'
+generation_schema = 'generation'
+
+
+def shadow_table(table: str) -> str:
+    """
+    Return the name of the shadow of `table`, a table in the prepared schema.
+    """
+    return f'{shadow_schema}.{table.split(".")[1]}'
+
+
+def key_constraints(cursor: psycopg2.extensions.cursor, table: str) -> List[Tuple[str, str]]:
+    """
+    Using `cursor`, return the name and definition of each constraint of
+    `table` that is backed by an index.
+    """
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND conindid <> 0;", (table,))
+    return cursor.fetchall()
+
+
+def add_constraints(cursor: psycopg2.extensions.cursor, table: str,
+    constraints: List[Tuple[str, str]]) -> None:
+    for constraint_name, constraint_definition in constraints:
+        cursor.execute(f'ALTER TABLE {table} '
+            f'ADD CONSTRAINT {constraint_name} {constraint_definition};')
+
+
+def create_shadow_tables(cursor: psycopg2.extensions.cursor, tables: List[str]) -> None:
+    """
+    Using `cursor`, create an empty shadow table for each prepared table in
+    `tables`, with its columns, defaults, constraints, and partitions, so
+    new data can be loaded without locking the prepared tables. Key
+    constraints are kept for the upserts that rely on them, with the same
+    names. The other indexes are added by `build_shadow_indexes` once the
+    data is loaded.
+    """
+    for table in tables:
+        cursor.execute(f'DROP TABLE IF EXISTS {shadow_table(table)};')
+        partitions.create_table_like(cursor, shadow_table(table), table,
+            len(partitions.table_partitions(cursor, table)))
+        add_constraints(cursor, shadow_table(table), key_constraints(cursor, table))
+
+
+def secondary_indexes(cursor: psycopg2.extensions.cursor,
+    table: str) -> List[Tuple[str, str]]:
+    """
+    Using `cursor`, return the name and definition of each index of
+    `table` that does not back a constraint. The index of a partitioned
+    table is defined to be created on all its partitions.
+    """
+    cursor.execute('''
+    SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid)
+    FROM pg_index
+    WHERE indrelid = %s::regclass
+    AND indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = indrelid)
+    ORDER BY indexrelid;
+    ''', (table,))
+    return [(index, definition.replace(' ON ONLY ', ' ON ', 1))
+        for index, definition in cursor.fetchall()]
+
+
+def build_shadow_indexes(cursor: psycopg2.extensions.cursor, tables: List[str]) -> None:
+    """
+    Using `cursor`, create the indexes of each prepared table in `tables`
+    that do not back a constraint on its loaded shadow table, with the same
+    names, and analyze the shadow table so it is ready to be queried once
+    swapped in.
+    """
+    for table in tables:
+        for _, index_definition in secondary_indexes(cursor, table):
+            cursor.execute(re.sub(rf' ON (ONLY )?{re.escape(table)} ',
+                f' ON {shadow_table(table)} ', index_definition, count=1))
+
+        cursor.execute(f'ANALYZE {shadow_table(table)};')
+
+
+def dependent_views(cursor: psycopg2.extensions.cursor, table: str) -> List[Tuple[str, str]]:
+    """
+    Using `cursor`, return the name and definition of each view that reads
+    `table` directly. Views are bound to tables rather than their names, so
+    they must be recreated to read a table swapped in under the same name.
+    """
+    cursor.execute('''
+    SELECT DISTINCT dependent.oid::regclass::text, pg_get_viewdef(dependent.oid)
+    FROM pg_depend
+    JOIN pg_rewrite ON pg_depend.objid = pg_rewrite.oid
+    JOIN pg_class dependent ON pg_rewrite.ev_class = dependent.oid
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass
+    AND pg_depend.refobjid = %s::regclass
+    AND dependent.oid <> pg_depend.refobjid;
+    ''', (table,))
+    return cursor.fetchall()
+
+
+def recreate_views(cursor: psycopg2.extensions.cursor, views: List[Tuple[str, str]]) -> None:
+    for view, definition in views:
+        cursor.execute(f'CREATE OR REPLACE VIEW {view} AS {definition}')
+
+
+def rename_indexes(cursor: psycopg2.extensions.cursor, table: str, old_suffix: str,
+    new_suffix: str) -> None:
+    """
+    Using `cursor`, replace the suffix `old_suffix` of the name of each
+    index of `table` and of its partitions with `new_suffix`, so indexes of
+    different generations of a table do not collide.
+    """
+    schema = table.split('.')[0]
+    for indexed_table in [table] + partitions.table_partitions(cursor, table):
+        cursor.execute('SELECT indexrelid::regclass::text FROM pg_index '
+            'WHERE indrelid = %s::regclass;', (indexed_table,))
+        for (index,) in cursor.fetchall():
+            name = index.split('.')[-1]
+            if name.endswith(old_suffix):
+                cursor.execute(f'ALTER INDEX {schema}.{name} '
+                    f'RENAME TO {name[:len(name) - len(old_suffix)]}{new_suffix};')
+
+
+def repartition_table(cursor: psycopg2.extensions.cursor, table: str,
+    partition_count: int) -> None:
+    """
+    Using `cursor`, replace `table` with a copy of its rows partitioned
+    into `partition_count` partitions by `partitions.partition_key`, or not
+    partitioned if it is 0. The copy gets the constraints and indexes of
+    `table` under the same names, and the views that read `table` are
+    recreated to read it.
+    """
+    schema, name = table.split('.')
+    new_table = f'{table}_repartitioned'
+    replaced_table = f'{table}_replaced'
+    constraints = key_constraints(cursor, table)
+    indexes = secondary_indexes(cursor, table)
+    views = dependent_views(cursor, table)
+
+    cursor.execute(f'DROP TABLE IF EXISTS {new_table};')
+    partitions.create_table_like(cursor, new_table, table, partition_count)
+    cursor.execute(f'INSERT INTO {new_table} SELECT * FROM {table};')
+
+    partitions.move_table(cursor, table, schema, f'{name}_replaced')
+    partitions.move_table(cursor, new_table, schema, name)
+    recreate_views(cursor, views)
+    cursor.execute(f'DROP TABLE {replaced_table};')
+
+    add_constraints(cursor, table, constraints)
+    for _, index_definition in indexes:
+        cursor.execute(index_definition)
+    cursor.execute(f'ANALYZE {table};')
+
+
+def pending_shadow_tables(cursor: psycopg2.extensions.cursor) -> List[str]:
+    """
+    Using `cursor`, return the prepared tables whose shadow tables were
+    built in the current transaction and are waiting to be swapped in.
+    """
+    cursor.execute('''
+    SELECT relname
+    FROM pg_class
+    WHERE relnamespace = %s::regnamespace
+    AND relkind IN ('r', 'p')
+    AND NOT relispartition
+    ORDER BY relname;
+    ''', (shadow_schema,))
+    return [f'prepared.{table}' for (table,) in cursor.fetchall()]
+
+
+def swap_shadow_tables(cursor: psycopg2.extensions.cursor,
+    retained_generations: int) -> Optional[int]:
+    """
+    Using `cursor`, replace each prepared table that has a shadow table
+    with its shadow, and recreate the views that read it. The replaced
+    tables are moved to the generation schema under a new generation number
+    so the publish can be rolled back with `rollback_generation`, and all
+    but the `retained_generations` most recent generations of each table
+    are dropped. The swap only takes the locks of the prepared tables and
+    their views for the rest of the transaction, so commit right after it.
+    Return the generation number, or None if there was nothing to swap.
+    """
+    tables = pending_shadow_tables(cursor)
+    if not tables:
+        return None
+
+    cursor.execute(f'SELECT nextval(\'{generation_schema}.generation_seq\');')
+    generation = cursor.fetchone()[0]
+
+    for table in tables:
+        name = table.split('.')[1]
+        retired_table = f'{generation_schema}.{name}_g{generation}'
+        views = dependent_views(cursor, table)
+
+        rename_indexes(cursor, table, '', f'_g{generation}')
+        partitions.move_table(cursor, table, generation_schema, f'{name}_g{generation}')
+        partitions.move_table(cursor, shadow_table(table), 'prepared', name)
+        recreate_views(cursor, views)
+
+        cursor.execute(f'INSERT INTO {generation_schema}.retired_table '
+            '(generation, table_name, retired_table_name) VALUES (%s, %s, %s);',
+            (generation, table, retired_table))
+
+    drop_old_generations(cursor, tables, retained_generations)
+    return generation
+
+
+def drop_old_generations(cursor: psycopg2.extensions.cursor, tables: List[str],
+    retained_generations: int) -> int:
+    """
+    Using `cursor`, drop all but the `retained_generations` most recent
+    retired generations of each prepared table in `tables`. Return the
+    number of tables dropped.
+    """
+    cursor.execute(f'''
+    DELETE FROM {generation_schema}.retired_table
+    WHERE (generation, table_name) IN
+    (
+    SELECT generation, table_name
+    FROM
+    (
+    SELECT generation, table_name
+    , ROW_NUMBER() OVER (PARTITION BY table_name ORDER BY generation DESC) AS age
+    FROM {generation_schema}.retired_table
+    WHERE table_name = ANY(%s)
+    ) AS a
+    WHERE age > %s
+    )
+    RETURNING retired_table_name;
+    ''', (tables, retained_generations))
+
+    dropped_tables = [row[0] for row in cursor.fetchall()]
+    for retired_table in dropped_tables:
+        cursor.execute(f'DROP TABLE IF EXISTS {retired_table};')
+    return len(dropped_tables)
+
+
+def latest_generation(cursor: psycopg2.extensions.cursor) -> Optional[int]:
+    cursor.execute(f'SELECT MAX(generation) FROM {generation_schema}.retired_table;')
+    return cursor.fetchone()[0]
+
+
+def rollback_generation(cursor: psycopg2.extensions.cursor, generation: int) -> List[str]:
+    """
+    Using `cursor`, undo the publish of `generation` by swapping the tables
+    it replaced back into the prepared schema, recreating the views that
+    read them, and dropping the tables it published. Return the names of
+    the prepared tables restored.
+    """
+    cursor.execute(f'SELECT table_name, retired_table_name FROM {generation_schema}.retired_table '
+        'WHERE generation = %s ORDER BY table_name;', (generation,))
+    retired_tables = cursor.fetchall()
+
+    for table, retired_table in retired_tables:
+        name = table.split('.')[1]
+        views = dependent_views(cursor, table)
+
+        # Move the published table out of the way, then restore the retired one
+        cursor.execute(f'DROP TABLE IF EXISTS {shadow_table(table)};')
+        partitions.move_table(cursor, table, shadow_schema, name)
+        rename_indexes(cursor, retired_table, f'_g{generation}', '')
+        partitions.move_table(cursor, retired_table, 'prepared', name)
+        recreate_views(cursor, views)
+        cursor.execute(f'DROP TABLE {shadow_table(table)};')
+
+    cursor.execute(f'DELETE FROM {generation_schema}.retired_table WHERE generation = %s;',
+        (generation,))
+    return [table for table, _ in retired_tables]
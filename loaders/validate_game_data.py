@@ -0,0 +1,255 @@
+import collections
+import hashlib
+import io
+import psycopg2
+from typing import Iterator, List, Optional, Tuple
+
+from loaders import game_replay, quality_rules
+import logger
+import utils
+
+copy_prepared_sql = '''
+COPY {schema}.game_data (game_id, player_id, move_number, "column", result, create_timestamp)
+FROM STDIN WITH (FORMAT text, DELIMITER ',')
+'''
+
+copy_error_sql = '''
+COPY error.game_data (game_id, player_id, move_number, "column", result, create_timestamp,
+    rejection_reason)
+FROM STDIN WITH (FORMAT text, DELIMITER ',')
+'''
+
+copy_fingerprint_sql = '''
+COPY staged_game_fingerprint (game_id, fingerprint) FROM STDIN WITH (FORMAT text, DELIMITER ',')
+'''
+
+copy_routed_game_sql = 'COPY routed_game (game_id) FROM STDIN'
+
+valid_results = {b'', b'win', b'draw'}
+
+
+def iter_lines(source: utils.Readable, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Yield the lines read from `source`, without line endings, reading
+    `chunk_size` bytes at a time.
+    """
+    remainder = b''
+    chunk = source.read(chunk_size)
+    while chunk:
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line.rstrip(b'\r')
+        chunk = source.read(chunk_size)
+
+    if remainder.rstrip(b'\r'):
+        yield remainder.rstrip(b'\r')
+
+
+def is_valid_game(rows: List[List[bytes]]) -> bool:
+    """
+    Apply the default data quality rules of the game data to the `rows` of
+    a single game, each a list of game_id, player_id, move_number, column,
+    and result, faster than `quality_rules.check_group`.
+    """
+    if rows[0][0] == b'\\N':
+        return False
+    for _, _, move_number, column, result in rows:
+        if not move_number.isdigit() or not column.isdigit() or int(column) > 4 \
+            or result not in valid_results:
+            return False
+
+    return len({row[1] for row in rows} - {b'\\N'}) == 2
+
+
+def decode_row(row: List[bytes]) -> List[Optional[str]]:
+    # Fields are in the COPY text format, where \N is null
+    return [None if value == b'\\N' else value.decode('utf-8', 'replace') for value in row]
+
+
+def game_fingerprint(rows: List[List[bytes]]) -> bytes:
+    """
+    Compute the same fingerprint of the `rows` of a single game as
+    `load_game_data.stage_game_fingerprints`.
+    """
+    ordered_rows = sorted(rows, key=lambda row: (int(row[2]), row[1]))
+    moves = b';'.join(b','.join(row[1:]) for row in ordered_rows)
+    return hashlib.md5(moves).hexdigest().encode()
+
+
+class GameRowRouter:
+    """
+    Validate games as their rows arrive and, using `cursor`, copy the rows of
+    valid games to prepared.game_data and of invalid games to error.game_data
+    in batches of `batch_rows`. Rows are buffered per game only while it is
+    among the `max_open_games` most recently seen, so grouped input needs
+    little memory; games evicted early are listed more than once in
+    routed_game.
+    """
+
+    def __init__(self, cursor: psycopg2.extensions.cursor, create_timestamp: bytes,
+        batch_rows: int = 50000, max_open_games: int = 10000,
+        validate_game_rules: bool = False, batch_games: int = 20000,
+        prepared_schema: str = 'prepared',
+        rules: Optional[List[quality_rules.QualityRule]] = None):
+        self.cursor = cursor
+        self.copy_prepared_sql = copy_prepared_sql.format(schema=prepared_schema)
+        self.create_timestamp = create_timestamp
+        self.batch_rows = batch_rows
+        self.max_open_games = max_open_games
+        self.validate_game_rules = validate_game_rules
+        self.batch_games = batch_games
+        self.unchecked_games: List[Tuple[bytes, List[List[bytes]]]] = []
+        self.open_games: collections.OrderedDict = collections.OrderedDict()
+        self.prepared_rows: List[bytes] = []
+        self.error_rows: List[bytes] = []
+        self.fingerprint_rows: List[bytes] = []
+        self.routed_games: List[bytes] = []
+        self.valid_row_count = 0
+        self.invalid_row_count = 0
+
+        default_rules = quality_rules.make_quality_rules(None, quality_rules.default_game_rules,
+            quality_rules.game_columns, grouped=True)
+        self.rules = default_rules if rules is None else rules
+        # Games that pass the default rules are found without decoding their rows
+        self.default_rules = self.rules == default_rules
+        self.rule_failures: collections.Counter = collections.Counter()
+
+
+    def add_row(self, row: List[bytes]) -> None:
+        game_id = row[0]
+        rows = self.open_games.get(game_id)
+        if rows is None:
+            if len(self.open_games) >= self.max_open_games:
+                self.route_game(*self.open_games.popitem(last=False))
+            rows = self.open_games[game_id] = []
+        else:
+            self.open_games.move_to_end(game_id)
+        rows.append(row)
+
+
+    def route_game(self, game_id: bytes, rows: List[List[bytes]]) -> None:
+        self.routed_games.append(game_id + b'\n')
+        reasons = self.quality_failures(rows)
+        if reasons:
+            self.add_error_rows(rows, reasons)
+        elif self.validate_game_rules:
+            self.unchecked_games.append((game_id, rows))
+            if len(self.unchecked_games) >= self.batch_games:
+                self.route_checked_games()
+        else:
+            self.add_prepared_rows(game_id, rows)
+
+        if len(self.prepared_rows) >= self.batch_rows:
+            self.flush_prepared()
+        if len(self.error_rows) >= self.batch_rows:
+            self.flush_errors()
+
+
+    def quality_failures(self, rows: List[List[bytes]]) -> Optional[List[bytes]]:
+        """
+        Return the rejection reason of each of the `rows` of a game, or None
+        if the game passes the data quality rules.
+        """
+        if self.default_rules and is_valid_game(rows):
+            return None
+
+        reasons, failures = quality_rules.check_group(self.rules, quality_rules.game_columns,
+            [decode_row(row) for row in rows])
+        self.rule_failures.update(failures)
+        if reasons[0] is None:
+            return None
+        return [reason.encode() for reason in reasons if reason]
+
+
+    def route_checked_games(self) -> None:
+        reasons = game_replay.check_games([rows for _, rows in self.unchecked_games])
+        for (game_id, rows), reason in zip(self.unchecked_games, reasons):
+            if reason:
+                self.add_error_rows(rows, [reason.encode()] * len(rows))
+            else:
+                self.add_prepared_rows(game_id, rows)
+        self.unchecked_games = []
+
+
+    def add_prepared_rows(self, game_id: bytes, rows: List[List[bytes]]) -> None:
+        self.prepared_rows.extend(b','.join(row) + b',' + self.create_timestamp + b'\n'
+            for row in rows)
+        self.fingerprint_rows.append(game_id + b',' + game_fingerprint(rows) + b'\n')
+        self.valid_row_count += len(rows)
+
+
+    def add_error_rows(self, rows: List[List[bytes]], reasons: List[bytes]) -> None:
+        self.error_rows.extend(b','.join(row) + b',' + self.create_timestamp + b',' + reason
+            + b'\n' for row, reason in zip(rows, reasons))
+        self.invalid_row_count += len(rows)
+
+
+
+    def copy_rows(self, copy_sql: str, rows: List[bytes]) -> None:
+        if rows:
+            self.cursor.copy_expert(copy_sql, io.BytesIO(b''.join(rows)))
+
+
+    def flush_prepared(self) -> None:
+        self.copy_rows(self.copy_prepared_sql, self.prepared_rows)
+        self.copy_rows(copy_fingerprint_sql, self.fingerprint_rows)
+        self.copy_rows(copy_routed_game_sql, self.routed_games)
+        self.prepared_rows = []
+        self.fingerprint_rows = []
+        self.routed_games = []
+
+
+    def flush_errors(self) -> None:
+        self.copy_rows(copy_error_sql, self.error_rows)
+        self.copy_rows(copy_routed_game_sql, self.routed_games)
+        self.error_rows = []
+        self.routed_games = []
+
+
+    def finish(self) -> None:
+        while self.open_games:
+            self.route_game(*self.open_games.popitem(last=False))
+        if self.unchecked_games:
+            self.route_checked_games()
+        self.flush_prepared()
+        self.flush_errors()
+
+
+def route_validated_data(source: utils.Readable, cursor: psycopg2.extensions.cursor,
+    create_timestamp: bytes, log: logger.Log, batch_rows: int = 50000,
+    max_open_games: int = 10000, validate_game_rules: bool = False,
+    prepared_schema: str = 'prepared',
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> int:
+    """
+    Using `cursor`, copy the game rows read from `source`, after its header,
+    straight to prepared.game_data or error.game_data with a `GameRowRouter`,
+    stamped with `create_timestamp`. Log to `log` the rows routed to each
+    table and failing each rule. Return the number of rows read.
+    """
+    cursor.execute('''
+    DROP TABLE IF EXISTS staged_game_fingerprint;
+    CREATE TEMPORARY TABLE staged_game_fingerprint (game_id text, fingerprint text)
+    ON COMMIT DROP;
+
+    DROP TABLE IF EXISTS routed_game;
+    CREATE TEMPORARY TABLE routed_game (game_id text) ON COMMIT DROP;
+    ''')
+
+    router = GameRowRouter(cursor, create_timestamp, batch_rows, max_open_games,
+        validate_game_rules, prepared_schema=prepared_schema, rules=rules)
+    for line_number, line in enumerate(iter_lines(source), start=2):
+        row = line.split(b',')
+        if len(row) != 5:
+            raise ValueError(f'Expected 5 fields on line {line_number} of the game data '
+                f'but found {len(row)}.')
+        router.add_row(row)
+    router.finish()
+
+    log.write_metric('game_validated_rows', router.valid_row_count)
+    for rule in router.rules:
+        log.write_metric(f'game_rejected_{rule.code}', router.rule_failures[rule.code])
+    if router.invalid_row_count > 0:
+        log.write_warning(f'Rejected {router.invalid_row_count} game records due to data quality.')
+
+    return router.valid_row_count + router.invalid_row_count
@@ -1,14 +1,163 @@
+import atexit
+import contextlib
 import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 
 default_log_file = './log.txt'
+default_metrics_file = './metrics.jsonl'
+default_prometheus_file = './metrics.prom'
+
+
+class Span:
+    """
+    The timing of one run of a pipeline stage named `name`, with `labels`
+    that tell runs of the same stage apart. Set `rows` to the number of
+    rows the stage handled.
+    """
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.start = datetime.datetime.now()
+        self.seconds = 0.0
+        self.rows: Optional[int] = None
+        self.failed = False
+
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        if self.rows is None:
+            return None
+        return self.rows / max(self.seconds, 1e-9)
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'span': self.name, 'labels': self.labels, 'start': self.start.isoformat(),
+            'seconds': self.seconds, 'rows': self.rows,
+            'rows_per_second': self.rows_per_second, 'failed': self.failed}
+
+
+class MetricsExporter:
+    """
+    Collects the spans recorded by every `Log` in the process. Spans are
+    written as JSON lines appended to `metrics_file` by a background thread
+    every `flush_interval` seconds, so recording a span does not wait on
+    the disk. `export_prometheus` writes the latest run of each stage to
+    `prometheus_file` in the Prometheus text format, for the node exporter
+    textfile collector. Either file is skipped if its path is None.
+    """
+
+    def __init__(self, metrics_file: Optional[str] = default_metrics_file,
+        prometheus_file: Optional[str] = default_prometheus_file,
+        flush_interval: float = 1.0):
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.flush_interval = flush_interval
+        self.reset()
+        atexit.register(self.flush)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset)
+
+
+    def reset(self) -> None:
+        # Worker processes forked from a process with spans start over, with
+        # new locks, as another thread may have held them at the fork
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pid = os.getpid()
+        self.pending_lines: List[str] = []
+        self.latest_spans: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Span] = {}
+        self.thread: Optional[threading.Thread] = None
+
+
+    def record(self, span: Span) -> None:
+        line = json.dumps(span.to_dict())
+        if self.pid != os.getpid():
+            self.reset()
+        with self.lock:
+            self.pending_lines.append(line)
+            self.latest_spans[(span.name, tuple(sorted(span.labels.items())))] = span
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.flush_periodically, daemon=True)
+                self.thread.start()
+
+
+    def flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+    def flush(self) -> None:
+        with self.write_lock:
+            with self.lock:
+                lines, self.pending_lines = self.pending_lines, []
+            if lines and self.metrics_file:
+                with open(self.metrics_file, 'a') as f:
+                    f.write('\n'.join(lines) + '\n')
+
+
+    def export_prometheus(self) -> None:
+        self.flush()
+        if not self.prometheus_file:
+            return
+
+        with self.lock:
+            spans = list(self.latest_spans.values())
+
+        samples: Dict[str, List[str]] = {'seconds': [], 'rows': [], 'rows_per_second': [],
+            'failed': [], 'last_run_timestamp_seconds': []}
+        for span in spans:
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in
+                [('stage', span.name)] + sorted(span.labels.items()))
+            samples['seconds'].append(f'{{{labels}}} {span.seconds}')
+            if span.rows is not None:
+                samples['rows'].append(f'{{{labels}}} {span.rows}')
+                samples['rows_per_second'].append(f'{{{labels}}} {span.rows_per_second}')
+            samples['failed'].append(f'{{{labels}}} {int(span.failed)}')
+            samples['last_run_timestamp_seconds'].append(
+                f'{{{labels}}} {span.start.timestamp()}')
+
+        lines = []
+        for sample_name, values in samples.items():
+            metric = f'drop_token_stage_{sample_name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.extend(metric + value for value in values)
+
+        # Replace the file in one step so the collector never reads part of it
+        temporary_file = f'{self.prometheus_file}.{os.getpid()}.tmp'
+        with open(temporary_file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary_file, self.prometheus_file)
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics_exporter = MetricsExporter()
+
+
+def configure_metrics(metrics_file: Optional[str], prometheus_file: Optional[str]) -> None:
+    """
+    Set the files spans are exported to. Either is skipped if None.
+    """
+    metrics_exporter.flush()
+    metrics_exporter.metrics_file = metrics_file
+    metrics_exporter.prometheus_file = prometheus_file
+
 
 class Log:
 
     def __init__(self, log_file: str = default_log_file):
         self.file_handle = open(log_file, 'a')
 
-    
+
     def __del__(self):
         if self.file_handle:
             self.file_handle.close()
@@ -30,9 +179,43 @@ class Log:
 
 
     def write_metric(self, metric_name: str, value: float):
+        # Metrics are flushed with the next message or by `flush`
         self.file_handle.write(f'METRIC: {datetime.datetime.now()} {metric_name}: {value}\n')
-        self.file_handle.flush()
 
 
+    @contextlib.contextmanager
+    def span(self, name: str, **labels: str) -> Iterator[Span]:
+        """
+        Time the stage run in the `with` block as a `Span` named `name`,
+        with `labels`. The span's duration, and its rows if set, are written
+        as metrics and recorded for export.
+        """
+        span = Span(name, labels)
+        time1 = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.failed = True
+            raise
+        finally:
+            span.seconds = time.perf_counter() - time1
+            self.write_metric(f'{name}_seconds', span.seconds)
+            if span.rows is not None:
+                self.write_metric(f'{name}_rows', span.rows)
+            metrics_exporter.record(span)
+
+
+    def flush(self):
+        """
+        Write out buffered metrics and spans.
+        """
+        self.file_handle.flush()
+        metrics_exporter.flush()
 
 
+    def export_metrics(self):
+        """
+        Write out buffered metrics and spans, and the Prometheus textfile.
+        """
+        self.file_handle.flush()
+        metrics_exporter.export_prometheus()
@@ -0,0 +1,466 @@
+#! /usr/bin/env python3
+#
+# This script answers the three reporting analyses without loading
+# the data into PostgreSQL. The game CSV and the player pages are read
+# into compact columnar arrays, with integer codes for game and player
+# ids, result codes, and interned nationalities, and the analyses are
+# computed with vectorized group-bys. The rows returned match the
+# `reporting` views, so it can be used for quick what-if runs on large
+# snapshots and as a cross-check of the SQL.
+# Run from the project root to analyze the sources in `configuration.yml`:
+# python ./offline_analytics.py
+import decimal
+import json
+import numpy as np
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from loaders import game_replay, game_sources, load_game_data as game_loader
+from loaders import load_player_data as players, quality_rules, validate_game_data
+import logger
+import utils
+
+
+class GameData:
+    """
+    The moves of the games that pass the data quality checks, as arrays
+    with one entry per move. `game` and `player` are integer codes into the
+    sorted `game_ids` and `player_ids`, and `result` holds `game_replay`
+    result codes.
+    """
+
+    def __init__(self, game_ids: np.ndarray, player_ids: np.ndarray, game: np.ndarray,
+        player: np.ndarray, move_number: np.ndarray, column: np.ndarray, result: np.ndarray):
+        self.game_ids = game_ids
+        self.player_ids = player_ids
+        self.game = game
+        self.player = player
+        self.move_number = move_number
+        self.column = column
+        self.result = result
+
+
+class PlayerData:
+    """
+    The player records that pass the data quality checks, as arrays with
+    one entry per record. `player` is a code into the `player_ids` of the
+    `GameData` the players were matched with, or -1 for players who are
+    not in the games. `nationality` is a code into `nationalities`, or -1
+    if missing, and `email` holds the email addresses, or None.
+    """
+
+    def __init__(self, player_ids: List[Optional[str]], nationalities: List[str],
+        nationality: np.ndarray, email: np.ndarray):
+        self.player_ids = player_ids
+        self.nationalities = nationalities
+        self.nationality = nationality
+        self.email = email
+        self.player = np.full(len(player_ids), -1, dtype=np.int64)
+
+
+def parse_integers(values: np.ndarray, max_digits: int = 9) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert `values`, an array of bytes, to integers. Return the integers
+    and whether each value is made only of digits, as the data quality
+    checks require. Values too long to convert are given the largest value
+    of `max_digits` digits.
+    """
+    valid = np.char.isdigit(values)
+    short = valid & (np.char.str_len(values) <= max_digits)
+    integers = np.where(short, values, b'0').astype(np.int64)
+    integers[valid & ~short] = 10 ** max_digits - 1
+    return integers, valid
+
+
+def rule_failures(rule: quality_rules.QualityRule, values: np.ndarray) -> np.ndarray:
+    """
+    Return whether each of `values`, an array of bytes in the COPY text
+    format, fails the row `rule`. Each distinct value is checked once.
+    """
+    distinct, index = np.unique(values, return_inverse=True)
+    passing = np.array([rule.passes(validate_game_data.decode_row([value])) for value in
+        distinct.tolist()], dtype=bool)
+    return ~passing[index.reshape(-1)]
+
+
+def distinct_count_failures(rule: quality_rules.QualityRule, game: np.ndarray,
+    game_count: int, values: np.ndarray) -> np.ndarray:
+    """
+    Return whether each of the `game_count` games fails the distinct_count
+    `rule`, counting the distinct values that are not null of `values`, an
+    array of bytes in the COPY text format, in the rows of each code of
+    `game`.
+    """
+    distinct, value = np.unique(values, return_inverse=True)
+    value = value.reshape(-1)
+    present = values != b'\\N'
+    pairs = np.unique(game[present] * len(distinct) + value[present])
+    counts = np.bincount(pairs // max(len(distinct), 1), minlength=game_count)
+    passing = np.array([rule.in_range(count) for count in range(int(counts.max(initial=0)) + 1)],
+        dtype=bool)
+    return ~passing[counts]
+
+
+def read_game_csv(source: utils.Readable, validate_game_rules: bool = False,
+    batch_lines: int = 1000000,
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> GameData:
+    """
+    Read game rows from `source`, which must be positioned after the header
+    line, `batch_lines` rows at a time, and keep the moves of the games that
+    pass the data quality `rules`, or the default rules of the game data if
+    None. If `validate_game_rules` is True games that are not legal games
+    of Drop Token are also dropped. Raise a ValueError if the rules let
+    through a game whose move numbers or columns are not integers, or
+    whose results are not known to `game_replay`, as the load would fail.
+    """
+    default_rules = game_loader.make_data_quality_rules()
+    custom_rules = [] if rules is None or rules == default_rules else rules
+    row_rules = [rule for rule in custom_rules if not rule.is_group_rule]
+    group_rules = [rule for rule in custom_rules if rule.is_group_rule]
+    columns = quality_rules.game_columns
+
+    batches: List[List[np.ndarray]] = []
+    fields: List[List[bytes]] = [[], [], [], [], []]
+
+    def add_batch() -> None:
+        move_number, move_number_valid = parse_integers(np.array(fields[2], dtype=bytes))
+        column, column_valid = parse_integers(np.array(fields[3], dtype=bytes))
+        results = np.array(fields[4], dtype=bytes)
+        result = np.full(len(results), -1, dtype=np.int8)
+        for value in (b'', b'win', b'draw'):
+            result[results == value] = game_replay.result_codes[value]
+
+        analyzable = move_number_valid & column_valid & (result >= 0)
+        group_values = [np.array(fields[columns.index(rule.column)], dtype=bytes)
+            for rule in group_rules]
+        if custom_rules:
+            valid = np.ones(len(results), dtype=bool)
+            for rule in row_rules:
+                valid &= ~rule_failures(rule, np.array(fields[columns.index(rule.column)],
+                    dtype=bytes))
+        else:
+            valid = analyzable & (column <= game_replay.columns)
+        batches.append([np.array(fields[0], dtype=bytes), np.array(fields[1], dtype=bytes),
+            move_number, column, result, valid, analyzable, *group_values])
+        for values in fields:
+            values.clear()
+
+    for line_number, line in enumerate(validate_game_data.iter_lines(source), start=2):
+        row = line.split(b',')
+        if len(row) != 5:
+            raise ValueError(f'Expected 5 fields on line {line_number} of the game data '
+                f'but found {len(row)}.')
+        for values, value in zip(fields, row):
+            values.append(value)
+        if len(fields[0]) >= batch_lines:
+            add_batch()
+    if fields[0] or not batches:
+        add_batch()
+
+    game_bytes, player_bytes, move_number, column, result, valid, analyzable, *group_values = \
+        [np.concatenate(arrays) for arrays in zip(*batches)]
+    game_ids, game = np.unique(game_bytes, return_inverse=True)
+    player_ids, player = np.unique(player_bytes, return_inverse=True)
+    game = game.reshape(-1)
+    player = player.reshape(-1)
+
+    # A game fails if any of its rows or its distinct_count rules fail, and
+    # the default rules also require 2 players
+    failed = np.bincount(game[~valid], minlength=len(game_ids)) > 0
+    if custom_rules:
+        for rule, rule_values in zip(group_rules, group_values):
+            failed |= distinct_count_failures(rule, game, len(game_ids), rule_values)
+        if (~analyzable & ~failed[game]).any():
+            raise ValueError('Games that pass the game data quality rules must have integer '
+                'move numbers and columns and a result of win, draw, or empty.')
+    else:
+        game_players = np.unique(game * len(player_ids) + player) // max(len(player_ids), 1)
+        failed |= np.bincount(game_players, minlength=len(game_ids)) != 2
+
+    if validate_game_rules:
+        checked = np.nonzero(~failed)[0]
+        kept = ~failed[game]
+        game_index = np.searchsorted(checked, game[kept])
+        grid_columns, move_counts, game_results, reason = game_replay.encode_moves(game_index,
+            np.minimum(move_number[kept], game_replay.max_moves + 1),
+            np.minimum(column[kept], game_replay.columns + 1), player[kept],
+            result[kept], len(checked))
+        reason = np.where(reason == game_replay.legal,
+            game_replay.replay_games(grid_columns, move_counts, game_results), reason)
+        failed[checked[reason != game_replay.legal]] = True
+
+    kept = ~failed[game]
+    return GameData(game_ids, player_ids, game[kept], player[kept], move_number[kept],
+        column[kept], result[kept])
+
+
+def read_player_pages(pages: Iterable[bytes],
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> PlayerData:
+    """
+    Read the player records from `pages`, each a JSON array of players as
+    served by the player API, and keep those that pass the data quality
+    `rules`, or the default rules of the player data if None. Pages that
+    are not valid JSON are skipped, as the player pipeline does. Raise a
+    ValueError if a rule compares a whole JSON object or array.
+    """
+    custom_rules = [] if rules is None or rules == players.make_data_quality_rules() else rules
+    player_ids: List[Optional[str]] = []
+    emails: List[Optional[str]] = []
+    nationality: List[int] = []
+    nationality_codes: Dict[str, int] = {}
+
+    for page in pages:
+        try:
+            records = json.loads(page)
+        except ValueError:
+            continue
+
+        for record in records:
+            player_id = quality_rules.json_text(record.get('id')) \
+                if isinstance(record, dict) else None
+            if custom_rules:
+                if not all(rule.passes([player_id]) if rule.column == 'player_id'
+                    else rule.passes_json(record) for rule in custom_rules):
+                    continue
+            elif not isinstance(record, dict) or 'data' not in record:
+                continue
+            data = record.get('data') if isinstance(record, dict) else None
+            details = data if isinstance(data, dict) else {}
+            player_ids.append(player_id)
+            emails.append(quality_rules.json_text(details.get('email')))
+            nat = quality_rules.json_text(details.get('nat'))
+            nationality.append(-1 if nat is None else nationality_codes.setdefault(nat,
+                len(nationality_codes)))
+
+    return PlayerData(player_ids, list(nationality_codes), np.array(nationality, dtype=np.int64),
+        np.array(emails, dtype=object))
+
+
+def match_players(games: GameData, player_data: PlayerData) -> None:
+    """
+    Set the `player` codes of `player_data` to the codes of the same player
+    ids in `games`.
+    """
+    ids = np.array([b'' if player_id is None else player_id.encode() for player_id in
+        player_data.player_ids], dtype=bytes)
+    position = np.searchsorted(games.player_ids, ids)
+    found = position < len(games.player_ids)
+    found[found] = games.player_ids[position[found]] == ids[found]
+    found &= np.array([player_id is not None for player_id in player_data.player_ids],
+        dtype=bool)
+    player_data.player = np.where(found, position, -1)
+
+
+def game_summary(games: GameData) -> Dict[str, np.ndarray]:
+    """
+    Summarize each game as `load_game_data.refresh_game_summary` does, for
+    the games with a first move and a move with a result. Return arrays with
+    one entry per summarized game of its game code, total moves, initial and
+    concluding players and columns, result, and winner and loser codes, or
+    -1 if the game was not won.
+    """
+    game_count = len(games.game_ids)
+
+    initial_moves = np.nonzero(games.move_number == 1)[0]
+    initial_games, first = np.unique(games.game[initial_moves], return_index=True)
+    initial_moves = initial_moves[first]
+
+    # The move with a result and the highest move number concludes the game
+    concluding_moves = np.nonzero(games.result != game_replay.no_result)[0]
+    concluding_moves = concluding_moves[np.lexsort((-games.move_number[concluding_moves],
+        games.game[concluding_moves]))]
+    concluding_games, first = np.unique(games.game[concluding_moves], return_index=True)
+    concluding_moves = concluding_moves[first]
+
+    has_initial = np.zeros(game_count, dtype=bool)
+    has_initial[initial_games] = True
+    has_concluding = np.zeros(game_count, dtype=bool)
+    has_concluding[concluding_games] = True
+    initial_moves = initial_moves[has_concluding[initial_games]]
+    concluding_moves = concluding_moves[has_initial[concluding_games]]
+
+    # The loser of a won game is the game's other player
+    first_player = np.full(game_count, np.iinfo(np.int64).max, dtype=np.int64)
+    last_player = np.full(game_count, -1, dtype=np.int64)
+    np.minimum.at(first_player, games.game, games.player)
+    np.maximum.at(last_player, games.game, games.player)
+
+    game = games.game[concluding_moves]
+    concluding_player = games.player[concluding_moves]
+    result = games.result[concluding_moves]
+    won = result == game_replay.win_result
+    other_player = np.where(concluding_player == first_player[game], last_player[game],
+        first_player[game])
+
+    return {'game': game, 'total_moves': games.move_number[concluding_moves],
+        'initial_player': games.player[initial_moves], 'concluding_player': concluding_player,
+        'initial_column': games.column[initial_moves],
+        'concluding_column': games.column[concluding_moves], 'result': result,
+        'winner': np.where(won, concluding_player, -1), 'loser': np.where(won, other_player, -1)}
+
+
+def player_games(games: GameData) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the game and player codes of each distinct pair of a game and a
+    player in it, as in `reporting.player_game`.
+    """
+    pairs = np.unique(games.game * len(games.player_ids) + games.player)
+    return pairs // max(len(games.player_ids), 1), pairs % max(len(games.player_ids), 1)
+
+
+def join_players(player: np.ndarray, player_data: PlayerData) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Join the player codes in `player` to the records of `player_data` with
+    the same code. Return the index into `player` and the index of the
+    player record of each joined pair.
+    """
+    order = np.argsort(player_data.player, kind='stable')
+    record_players = player_data.player[order]
+    starts = np.searchsorted(record_players, player, side='left')
+    counts = np.searchsorted(record_players, player, side='right') - starts
+
+    index = np.repeat(np.arange(len(player)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return index, order[np.repeat(starts, counts) + offsets]
+
+
+def round_percent(count: int, total: int) -> decimal.Decimal:
+    percent = decimal.Decimal(count * 100) / decimal.Decimal(total)
+    return percent.quantize(decimal.Decimal('0.01'), rounding=decimal.ROUND_HALF_UP)
+
+
+def winning_initial_column(games: GameData) -> List[Tuple[int, int, int, decimal.Decimal]]:
+    """
+    Compute the rows of `reporting.winning_initial_column` for `games`: for
+    the games won by the first player, the number and percent of games by
+    the column of the first move, ordered by the number of games, then the
+    column.
+    """
+    summary = game_summary(games)
+    qualifying = (summary['concluding_player'] == summary['initial_player']) \
+        & (summary['result'] == game_replay.win_result)
+    counts = np.bincount(summary['initial_column'][qualifying])
+    total = int(qualifying.sum())
+
+    rows = [(column, int(count), total, round_percent(int(count), total))
+        for column, count in enumerate(counts) if count > 0]
+    return sorted(rows, key=lambda row: (-row[1], row[0]))
+
+
+def nationality_participation(games: GameData,
+    player_data: PlayerData) -> List[Tuple[Optional[str], int]]:
+    """
+    Compute the rows of `reporting.nationality_participation` for `games`
+    and `player_data`: the number of distinct games played by players of
+    each nationality, ordered by nationality, with missing nationalities last.
+    """
+    game, player = player_games(games)
+    pair, record = join_players(player, player_data)
+
+    nationality = player_data.nationality[record] + 1
+    nationality_games = np.unique(game[pair] * (len(player_data.nationalities) + 1)
+        + nationality)
+    counts = np.bincount(nationality_games % (len(player_data.nationalities) + 1),
+        minlength=len(player_data.nationalities) + 1)
+
+    rows: List[Tuple[Optional[str], int]] = sorted((name, int(count)) for name, count in
+        zip(player_data.nationalities, counts[1:]) if count > 0)
+    if counts[0] > 0:
+        rows.append((None, int(counts[0])))
+    return rows
+
+
+def single_game_player(games: GameData,
+    player_data: PlayerData) -> List[Tuple[str, str, str, Optional[str], str]]:
+    """
+    Compute the rows of `reporting.single_game_player` for `games` and
+    `player_data`: the player id, game id, email address, nationality, and
+    whether they won, lost, or drew, of players with an email address who
+    played only one game, ordered by player id and game id.
+    """
+    game, player = player_games(games)
+    single_game = np.bincount(player, minlength=len(games.player_ids)) == 1
+    summary = game_summary(games)
+    summarized = np.full(len(games.game_ids), -1, dtype=np.int64)
+    summarized[summary['game']] = np.arange(len(summary['game']))
+
+    kept = single_game[player] & (summarized[game] >= 0)
+    game, player = game[kept], player[kept]
+    pair, record = join_players(player, player_data)
+    has_email = np.array([email is not None for email in player_data.email[record]], dtype=bool)
+    pair, record = pair[has_email], record[has_email]
+
+    game_summary_index = summarized[game[pair]]
+    outcome = np.where(player[pair] == summary['winner'][game_summary_index], 'won',
+        np.where(player[pair] == summary['loser'][game_summary_index], 'lost', 'drew'))
+
+    rows = [(games.player_ids[player_code].decode(), games.game_ids[game_code].decode(), email,
+        None if nationality < 0 else player_data.nationalities[nationality], str(result))
+        for player_code, game_code, email, nationality, result in zip(player[pair].tolist(),
+        game[pair].tolist(), player_data.email[record].tolist(),
+        player_data.nationality[record].tolist(), outcome.tolist())]
+    return sorted(rows, key=lambda row: (row[0], row[1]))
+
+
+def read_game_data(locations: Union[str, List[str]], validate_game_rules: bool = False,
+    worker_count: int = 4,
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> GameData:
+    """
+    Read the game data at `locations`, a URL or local path or a list of
+    them, of CSV shards that may be compressed, as `load_game_data.load_data`
+    reads them, keeping the games that pass the data quality `rules`. Up to
+    `worker_count` shards are streamed and decompressed concurrently.
+    """
+    reader = game_sources.GameSourceReader(game_sources.expand_locations(locations),
+        logger.Log(), worker_count)
+    try:
+        return read_game_csv(reader, validate_game_rules, rules=rules)
+    finally:
+        reader.close()
+
+
+def read_player_data(url: str, worker_count: int = 1,
+    rules: Optional[List[quality_rules.QualityRule]] = None) -> PlayerData:
+    """
+    Download the player pages from `url` with `worker_count` threads and
+    read the players that pass the data quality `rules`.
+    """
+    with utils.make_http_session(pool_size=worker_count) as session:
+        return read_player_pages((response.content for _, response in
+            players.fetch_player_pages(url, session, worker_count)), rules)
+
+
+def analyze(games: GameData, player_data: PlayerData) -> Dict[str, List[Tuple[Any, ...]]]:
+    """
+    Compute the rows of the three reporting analyses for `games` and
+    `player_data`.
+    """
+    match_players(games, player_data)
+    return {'winning_initial_column': winning_initial_column(games),
+        'nationality_participation': nationality_participation(games, player_data),
+        'single_game_player': single_game_player(games, player_data)}
+
+
+def main(config: Dict[Any, Any]) -> Dict[str, Any]:
+    # Rules that are not valid fail here, as they fail the loads
+    game_rules = game_loader.make_data_quality_rules(config.get('game_quality_rules'))
+    player_rules = players.make_data_quality_rules(config.get('player_quality_rules'))
+
+    time1 = time.perf_counter()
+    games = read_game_data(config['game_data_csv_location'],
+        config.get('validate_game_rules', False), config.get('game_source_workers', 4),
+        game_rules)
+    time2 = time.perf_counter()
+    player_data = read_player_data(config['player_data_location'],
+        config.get('player_download_workers', 1), player_rules)
+    time3 = time.perf_counter()
+    analyses = analyze(games, player_data)
+    time4 = time.perf_counter()
+
+    return {'read_games_seconds': time2 - time1, 'read_players_seconds': time3 - time2,
+        'analyze_seconds': time4 - time3, 'analyses': analyses}
+
+
+if __name__ == '__main__':
+    print(json.dumps(main(utils.load_configuration('./configuration.yml')), indent=2,
+        default=str))
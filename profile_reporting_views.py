@@ -0,0 +1,37 @@
+#! /usr/bin/env python3
+#
+# This script profiles a query of every view in the `reporting`
+# schema with `EXPLAIN (ANALYZE, BUFFERS)`. The plans are appended
+# with their timing to the `query_plans_file` set in the
+# `configuration.yml` file, and each view's execution time is printed
+# with any sequential scans of tables, or sorts, larger than
+# `query_plan_size_threshold_bytes`.
+import psycopg2
+
+import logger
+import query_profiler
+import utils
+
+log = logger.Log()
+
+config = utils.load_configuration('./configuration.yml')
+query_profiler.configure_profiling(
+    config.get('query_plans_file') or query_profiler.default_plans_file,
+    config.get('query_plan_size_threshold_bytes', query_profiler.default_size_threshold_bytes))
+
+connection = None
+
+try:
+    connection = utils.make_db_connection_from_config(config)
+    for record in query_profiler.profile_reporting_views(connection):
+        print(f'{record["statement"]:60} {record["execution_ms"]:12.3f} ms')
+        for issue in record['issues']:
+            print(f'    {issue}')
+    connection.rollback()
+
+except (psycopg2.OperationalError, psycopg2.Error) as error:
+    log.write_error(f'There was a database error. {error.args}')
+
+finally:
+    if connection:
+        connection.close()
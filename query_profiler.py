@@ -0,0 +1,222 @@
+import datetime
+import json
+import psycopg2
+import psycopg2.extensions
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import logger
+
+default_plans_file = './query_plans.jsonl'
+default_size_threshold_bytes = 10 * 1024 * 1024
+
+# Profiling is on while `plans_file` is set
+plans_file: Optional[str] = None
+size_threshold_bytes = default_size_threshold_bytes
+plans_file_lock = threading.Lock()
+
+explainable_statement = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b',
+    re.IGNORECASE)
+transaction_statement = re.compile(r'^\s*(BEGIN|START|COMMIT|END|ROLLBACK|ABORT|SAVEPOINT|RELEASE)\b',
+    re.IGNORECASE)
+create_table_as_statement = re.compile(r'^\s*CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?'
+    r'(?:(?:TEMPORARY|TEMP|UNLOGGED)\s+)?TABLE\b.*?\bAS\s+(SELECT|WITH|VALUES)\b',
+    re.IGNORECASE | re.DOTALL)
+# Calls whose effects a rollback does not undo, so profiling would repeat them
+non_transactional_call = re.compile(r'\b(nextval|setval)\s*\(', re.IGNORECASE)
+# A dollar quote's opening tag, which can not follow a character of an identifier
+dollar_quote = re.compile(r'(?<![A-Za-z0-9_$])\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+
+
+def configure_profiling(profile_plans_file: Optional[str],
+    profile_size_threshold_bytes: int = default_size_threshold_bytes) -> None:
+    """
+    Turn on query profiling, writing plans to `profile_plans_file`, or turn
+    it off if `profile_plans_file` is None. Sequential scans of tables and
+    sorts bigger than `profile_size_threshold_bytes` are flagged.
+    """
+    global plans_file, size_threshold_bytes
+    plans_file = profile_plans_file
+    size_threshold_bytes = profile_size_threshold_bytes
+
+
+def cursor_factory() -> Optional[type]:
+    """
+    Return the cursor class for new database connections, which profiles
+    every statement while profiling is on, or None for the default.
+    """
+    return ProfilingCursor if plans_file else None
+
+
+class ProfilingCursor(psycopg2.extensions.cursor):
+    """
+    A cursor that captures the plan of each statement with
+    `EXPLAIN (ANALYZE, BUFFERS)` before running it. EXPLAIN ANALYZE runs the
+    statement, so the statements are profiled inside a savepoint that is
+    rolled back, and then run as usual. Transaction control statements,
+    server-side cursors, and connections in autocommit mode are not profiled.
+    """
+
+    def execute(self, query: Any, vars: Any = None) -> None:
+        if plans_file and self.name is None and not self.connection.autocommit:
+            sql = self.mogrify(query, vars).decode()
+            if not transaction_statement.match(strip_comments(sql)):
+                profile_query(self.connection, sql)
+        super().execute(query, vars)
+
+
+def split_statements(sql: str) -> List[str]:
+    """
+    Split `sql` into its statements at the semicolons that are not inside
+    quotes, dollar quotes, or comments.
+    """
+    statements = []
+    start = 0
+    position = 0
+    while position < len(sql):
+        character = sql[position]
+        tag = dollar_quote.match(sql, position) if character == '$' else None
+        if tag:
+            position = sql.find(tag.group(), tag.end())
+            if position == -1:
+                break
+            position += len(tag.group()) - 1
+        elif character in '\'"':
+            position = sql.find(character, position + 1)
+            # A doubled quote continues the quoted text
+            while position != -1 and sql[position + 1:position + 2] == character:
+                position = sql.find(character, position + 2)
+            if position == -1:
+                break
+        elif sql.startswith('--', position):
+            position = sql.find('\n', position)
+            if position == -1:
+                break
+        elif sql.startswith('/*', position):
+            position = sql.find('*/', position)
+            if position == -1:
+                break
+            position += 1
+        elif character == ';':
+            statements.append(sql[start:position])
+            start = position + 1
+        position += 1
+
+    statements.append(sql[start:])
+    return [statement.strip() for statement in statements if strip_comments(statement).strip()]
+
+
+def strip_comments(statement: str) -> str:
+    return re.sub(r'--[^\n]*', '', statement)
+
+
+def is_explainable(statement: str) -> bool:
+    statement = strip_comments(statement)
+    return bool(explainable_statement.match(statement)
+        or create_table_as_statement.match(statement)) \
+        and not non_transactional_call.search(statement)
+
+
+def plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def find_plan_issues(cursor: psycopg2.extensions.cursor, plan: Dict[str, Any]) -> List[str]:
+    """
+    Using `cursor`, find the sequential scans of tables larger than the
+    size threshold, and the sorts that spilled to disk or used more memory
+    than the threshold, in `plan`, an EXPLAIN plan in JSON format.
+    """
+    issues = []
+    for node in plan_nodes(plan):
+        if node['Node Type'] == 'Seq Scan':
+            cursor.execute("SELECT pg_total_relation_size(format('%%I.%%I', %s, %s)::regclass);",
+                (node['Schema'], node['Relation Name']))
+            size = cursor.fetchone()[0]
+            if size >= size_threshold_bytes:
+                issues.append(f'Seq Scan on {node["Schema"]}.{node["Relation Name"]} '
+                    f'({size} bytes)')
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            space_bytes = node.get('Sort Space Used', 0) * 1024
+            if node.get('Sort Space Type') == 'Disk' or space_bytes >= size_threshold_bytes:
+                issues.append(f'Sort by {", ".join(node.get("Sort Key", []))} using '
+                    f'{space_bytes} bytes of {node.get("Sort Space Type", "memory").lower()}')
+    return issues
+
+
+def explain_statement(cursor: psycopg2.extensions.cursor, statement: str) -> Dict[str, Any]:
+    """
+    Using `cursor`, run `statement` with EXPLAIN (ANALYZE, BUFFERS) and
+    return a record of its plan, planning and execution times, and issues.
+    """
+    cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) {statement}')
+    explained = cursor.fetchone()[0][0]
+    return {'timestamp': datetime.datetime.now().isoformat(), 'statement': statement,
+        'planning_ms': explained.get('Planning Time'),
+        'execution_ms': explained['Execution Time'],
+        'issues': find_plan_issues(cursor, explained['Plan']), 'plan': explained['Plan']}
+
+
+def profile_query(connection: psycopg2.extensions.connection, sql: str) -> List[Dict[str, Any]]:
+    """
+    Using `connection`, profile each statement in `sql` inside a savepoint
+    that is rolled back afterwards. Statements that EXPLAIN cannot profile,
+    or that have effects a rollback does not undo, are skipped rather than
+    run twice. Write the records of the profiled statements to the plans
+    file and return them. Statements that fail, such as those reading a
+    table a skipped statement creates, are logged as not profiled and left
+    for the real run to report.
+    """
+    cursor = connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+    records = []
+
+    cursor.execute('SAVEPOINT profile_query;')
+    try:
+        for statement in split_statements(sql):
+            if not is_explainable(statement):
+                continue
+            cursor.execute('SAVEPOINT profile_statement;')
+            try:
+                records.append(explain_statement(cursor, statement))
+            except psycopg2.Error as error:
+                cursor.execute('ROLLBACK TO SAVEPOINT profile_statement;')
+                logger.Log().write_warning(f'The statement could not be profiled. '
+                    f'{error.args} {statement}')
+            cursor.execute('RELEASE SAVEPOINT profile_statement;')
+    finally:
+        cursor.execute('ROLLBACK TO SAVEPOINT profile_query;')
+        cursor.execute('RELEASE SAVEPOINT profile_query;')
+        cursor.close()
+
+    write_plan_records(records)
+    return records
+
+
+def write_plan_records(records: List[Dict[str, Any]]) -> None:
+    if not records or not plans_file:
+        return
+
+    with plans_file_lock:
+        with open(plans_file, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+
+def profile_reporting_views(connection: psycopg2.extensions.connection) -> List[Dict[str, Any]]:
+    """
+    Using `connection`, profile a query of every view in the reporting
+    schema. Write the records to the plans file and return them.
+    """
+    cursor = connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+    cursor.execute("SELECT table_name FROM information_schema.views "
+        "WHERE table_schema = 'reporting' ORDER BY table_name;")
+    views = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    records = []
+    for view in views:
+        records.extend(profile_query(connection, f'SELECT * FROM reporting.{view};'))
+    return records
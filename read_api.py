@@ -0,0 +1,367 @@
+#! /usr/bin/env python3
+#
+# This script serves the three reporting analyses and per-player
+# lookups over HTTP from an in-memory cache, so dashboards do not
+# query the `reporting` views on every request. Cached results are
+# kept until the loaders publish a new load generation. Cache hits,
+# misses, and latency percentiles are served at `/metrics` in the
+# Prometheus text format.
+# Run from the project root to serve on the `read_api_port` set in
+# `configuration.yml`:
+# python ./read_api.py
+import collections
+import contextlib
+import decimal
+import http.server
+import json
+import psycopg2
+import psycopg2.pool
+import threading
+import time
+import urllib.parse
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from loaders import load_generation, partitions
+import logger
+import utils
+
+# single_game_player is read one page at a time
+analysis_queries = {
+    'winning_initial_column': 'SELECT initial_column, initial_column_game_count, '
+        'total_game_count, percent_of_total FROM reporting.winning_initial_column;',
+    'nationality_participation': 'SELECT nationality, game_count '
+        'FROM reporting.nationality_participation;',
+    'single_game_player': 'SELECT player_id, game_id, email_address, nationality, '
+        'player_outcome FROM reporting.single_game_player ORDER BY player_id, game_id '
+        'LIMIT %s OFFSET %s;',
+}
+
+single_game_player_count_query = 'SELECT COUNT(*) FROM reporting.single_game_player;'
+
+player_query = '''
+SELECT player_id, nationality, email_address, details
+FROM reporting.player_details
+WHERE player_id = %s;
+'''
+
+player_games_query = '''
+SELECT pg.game_id
+, CASE WHEN pg.player_id = gs.winner THEN 'won'
+WHEN pg.player_id = gs.loser THEN 'lost'
+ELSE 'drew' END AS player_outcome
+FROM reporting.player_game pg
+JOIN reporting.game_summary gs ON pg.game_id = gs.game_id
+WHERE pg.player_id = %s
+ORDER BY pg.game_id;
+'''
+
+default_page_size = 100
+max_page_size = 1000
+latency_samples = 1000
+
+
+def fetch_rows(cursor: psycopg2.extensions.cursor, sql: str,
+    parameters: Optional[Tuple[Any, ...]] = None) -> List[Dict[str, Any]]:
+    cursor.execute(sql, parameters)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def read_player(cursor: psycopg2.extensions.cursor, player_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Using `cursor`, return the details of the player `player_id` with the
+    games they played, or None if there is no such player.
+    """
+    rows = fetch_rows(cursor, player_query, (player_id,))
+    if not rows:
+        return None
+    player = rows[0]
+    player['games'] = fetch_rows(cursor, player_games_query, (player_id,))
+    return player
+
+
+def read_single_game_players(cursor: psycopg2.extensions.cursor, page: int,
+    page_size: int) -> Dict[str, Any]:
+    """
+    Using `cursor`, return page `page`, counting from 1, of `page_size` rows
+    of the single_game_player analysis, with the total number of rows.
+    """
+    cursor.execute(single_game_player_count_query)
+    total = cursor.fetchone()[0]
+    rows = fetch_rows(cursor, analysis_queries['single_game_player'],
+        (page_size, (page - 1) * page_size))
+    return {'total': total, 'rows': rows}
+
+
+def percentile(samples: List[float], quantile: float) -> float:
+    """
+    Return the `quantile` of `samples` by the nearest rank method.
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(quantile * len(ordered))) - 1))]
+
+
+class ResultCache:
+    """
+    Results of the reporting queries, computed with connections from
+    `connection_pool` and kept until the load generation changes. The
+    generation is read at most once every `poll_seconds`, so results can be
+    that much older than a publish. Up to `max_entries` results are kept,
+    evicting the least recently used. At most `max_connections`, the size
+    of the pool, are checked out at once, and requests wait for a free one.
+    """
+
+    def __init__(self, connection_pool: psycopg2.pool.AbstractConnectionPool,
+        poll_seconds: float = 1.0, max_entries: int = 10000, max_connections: int = 4):
+        self.connection_pool = connection_pool
+        self.connections = threading.BoundedSemaphore(max_connections)
+        self.poll_seconds = poll_seconds
+        self.max_entries = max_entries
+        # -1 until the load generation is first read
+        self.generation = -1
+        self.checked = float('-inf')
+        self.entries: 'collections.OrderedDict[Hashable, Any]' = collections.OrderedDict()
+        self.hits: Dict[str, int] = collections.Counter()
+        self.misses: Dict[str, int] = collections.Counter()
+        self.lock = threading.Lock()
+
+
+    def _adopt_generation(self, generation: int) -> None:
+        # Called holding the lock
+        if generation != self.generation:
+            self.entries.clear()
+            self.generation = generation
+        self.checked = time.monotonic()
+
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        # A full pool raises PoolError, so wait for a connection to be returned
+        with self.connections:
+            connection = self.connection_pool.getconn()
+            try:
+                yield connection
+            finally:
+                self.connection_pool.putconn(connection)
+
+
+    def _refresh_generation(self) -> None:
+        if time.monotonic() - self.checked < self.poll_seconds:
+            return
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            generation = load_generation.current_load_generation(cursor)
+            cursor.close()
+            connection.rollback()
+        with self.lock:
+            self._adopt_generation(generation)
+
+
+    def get(self, endpoint: str, key: Hashable,
+        compute: Callable[[psycopg2.extensions.cursor], Any]) -> Tuple[Any, int]:
+        """
+        Return the cached result of `endpoint` for `key`, or compute it with
+        `compute`, given a cursor, and cache it. The result is read in the
+        same snapshot as the load generation, so it is never cached under a
+        generation it does not belong to. Return the result and its load
+        generation.
+        """
+        self._refresh_generation()
+        with self.lock:
+            if (endpoint, key) in self.entries:
+                self.entries.move_to_end((endpoint, key))
+                self.hits[endpoint] += 1
+                return self.entries[(endpoint, key)], self.generation
+            self.misses[endpoint] += 1
+
+        with self.connection() as connection:
+            connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cursor = connection.cursor()
+            cursor.execute(partitions.partitionwise_planning_sql)
+            generation = load_generation.current_load_generation(cursor)
+            result = compute(cursor)
+            cursor.close()
+            connection.rollback()
+
+        with self.lock:
+            if generation > self.generation:
+                self._adopt_generation(generation)
+            if generation == self.generation:
+                self.entries[(endpoint, key)] = result
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return result, generation
+
+
+class ReadAPIServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server of the cached reporting data. Keeps the last
+    `latency_samples` request latencies of each endpoint for `/metrics`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], cache: ResultCache, log: logger.Log):
+        super().__init__(address, ReadAPIRequestHandler)
+        self.cache = cache
+        self.log = log
+        self.latencies: Dict[str, Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=latency_samples))
+        self.lock = threading.Lock()
+
+
+    def record_latency(self, endpoint: str, seconds: float) -> None:
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+
+
+    def metrics(self) -> str:
+        """
+        Return the cache and latency metrics in the Prometheus text format.
+        """
+        with self.cache.lock:
+            hits, misses = dict(self.cache.hits), dict(self.cache.misses)
+            generation = self.cache.generation
+        with self.lock:
+            latencies = {endpoint: list(samples) for endpoint, samples in self.latencies.items()}
+
+        lines = []
+        endpoints = sorted(set(hits) | set(misses))
+        for sample_name, values in (('cache_hits_total', hits), ('cache_misses_total', misses)):
+            metric = f'drop_token_read_api_{sample_name}'
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(f'{metric}{{endpoint="{logger.escape_label(endpoint)}"}} '
+                f'{values.get(endpoint, 0)}' for endpoint in endpoints)
+
+        lines.append('# TYPE drop_token_read_api_cache_hit_ratio gauge')
+        for endpoint in endpoints:
+            requests = hits.get(endpoint, 0) + misses.get(endpoint, 0)
+            lines.append(f'drop_token_read_api_cache_hit_ratio{{endpoint='
+                f'"{logger.escape_label(endpoint)}"}} {hits.get(endpoint, 0) / requests}')
+
+        lines.append('# TYPE drop_token_read_api_latency_seconds summary')
+        for endpoint, samples in sorted(latencies.items()):
+            label = logger.escape_label(endpoint)
+            for quantile in (0.5, 0.99):
+                lines.append(f'drop_token_read_api_latency_seconds{{endpoint="{label}",'
+                    f'quantile="{quantile}"}} {percentile(samples, quantile)}')
+
+        if generation >= 0:
+            lines.append('# TYPE drop_token_read_api_load_generation gauge')
+            lines.append(f'drop_token_read_api_load_generation {generation}')
+        return '\n'.join(lines) + '\n'
+
+
+class ReadAPIRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `/<analysis>` for each view in `analysis_queries`, with `page`
+    and `page_size` parameters for `single_game_player`,
+    `/players/<player_id>`, and `/metrics`.
+    """
+
+    server: ReadAPIServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+    def send_body(self, status: int, body: str, content_type: str) -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def send_json(self, status: int, value: Any) -> None:
+        self.send_body(status, json.dumps(value, default=json_default), 'application/json')
+
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path.rstrip('/')
+        if path == '/metrics':
+            self.send_body(200, self.server.metrics(), 'text/plain; version=0.0.4')
+            return
+
+        endpoint = 'players' if path.startswith('/players/') else path.lstrip('/')
+        time1 = time.perf_counter()
+        try:
+            status, value = self.route(endpoint, path, urllib.parse.parse_qs(url.query))
+        except (psycopg2.OperationalError, psycopg2.Error) as error:
+            self.server.log.write_error(f'There was a database error serving {self.path}. '
+                f'{error.args}')
+            status, value = 503, {'error': 'The reporting data is not available.'}
+        self.send_json(status, value)
+        if status == 200:
+            self.server.record_latency(endpoint, time.perf_counter() - time1)
+
+
+    def route(self, endpoint: str, path: str,
+        query: Dict[str, List[str]]) -> Tuple[int, Any]:
+        cache = self.server.cache
+
+        if endpoint == 'players':
+            player_id = urllib.parse.unquote(path[len('/players/'):])
+            player, generation = cache.get(endpoint, player_id,
+                lambda cursor: read_player(cursor, player_id))
+            if player is None:
+                return 404, {'error': f'There is no player {player_id}.'}
+            return 200, dict(player, generation=generation)
+
+        if endpoint not in analysis_queries:
+            return 404, {'error': f'There is no endpoint {path}.'}
+
+        if endpoint != 'single_game_player':
+            sql = analysis_queries[endpoint]
+            rows, generation = cache.get(endpoint, None, lambda cursor: fetch_rows(cursor, sql))
+            return 200, {'generation': generation, 'rows': rows}
+
+        try:
+            page = int(query.get('page', ['1'])[0])
+            page_size = int(query.get('page_size', [str(default_page_size)])[0])
+        except ValueError:
+            return 400, {'error': '`page` and `page_size` must be integers.'}
+        if page < 1 or not 1 <= page_size <= max_page_size:
+            return 400, {'error': f'`page` must be at least 1 and `page_size` '
+                f'between 1 and {max_page_size}.'}
+
+        result, generation = cache.get(endpoint, (page, page_size),
+            lambda cursor: read_single_game_players(cursor, page, page_size))
+        return 200, dict(result, generation=generation, page=page, page_size=page_size)
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def make_read_api_server(config: Dict[Any, Any], port: Optional[int] = None,
+    log: Optional[logger.Log] = None) -> ReadAPIServer:
+    """
+    Create a read API server of the database in `config`, listening on
+    `port`, or on the `read_api_port` in `config` if it is None.
+    """
+    connection_count = config.get('read_api_connections', 4)
+    connection_pool = utils.make_db_connection_pool_from_config(config, connection_count)
+    cache = ResultCache(connection_pool, config.get('read_api_generation_poll_seconds', 1.0),
+        config.get('read_api_cache_max_entries', 10000), connection_count)
+    if port is None:
+        port = config.get('read_api_port', 8080)
+    return ReadAPIServer((config.get('read_api_host', 'localhost'), port), cache,
+        log or logger.Log())
+
+
+if __name__ == '__main__':
+    log = logger.Log()
+    server = make_read_api_server(utils.load_configuration('./configuration.yml'), log=log)
+    log.write_info(f'Serving the reporting data on port {server.server_port}.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.cache.connection_pool.closeall()
@@ -0,0 +1,42 @@
+#! /usr/bin/env python3
+#
+# This script rolls back a shadow publish, swapping the prepared tables
+# it replaced back in. Pass the generation number to roll back, or no
+# argument to roll back the latest generation. The retained
+# generations are listed in the generation.retired_table table.
+import psycopg2
+import sys
+
+from loaders import load_generation, shadow_tables
+import logger
+import utils
+
+log = logger.Log()
+
+config = utils.load_configuration('./configuration.yml')
+
+connection = None
+
+try:
+    connection = utils.make_db_connection_from_config(config)
+    cursor = connection.cursor()
+    generation = int(sys.argv[1]) if len(sys.argv) > 1 else shadow_tables.latest_generation(cursor)
+    if generation is None:
+        print('There are no retained generations to roll back.')
+    else:
+        tables = shadow_tables.rollback_generation(cursor, generation)
+        if tables:
+            load_generation.advance_load_generation(cursor)
+            log.write_info(f'Rolled back generation {generation}, restoring {", ".join(tables)}.')
+            print(f'Rolled back generation {generation}, restoring {", ".join(tables)}.')
+        else:
+            print(f'Generation {generation} is not retained.')
+    cursor.close()
+    connection.commit()
+
+except (psycopg2.OperationalError, psycopg2.Error) as error:
+    log.write_error(f'There was a database error. {error.args}')
+
+finally:
+    if connection:
+        connection.close()
@@ -0,0 +1,271 @@
+import collections
+import hashlib
+import json
+import os
+import requests
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import utils
+
+default_cache_directory = './source_cache'
+default_max_bytes = 1024 * 1024 * 1024
+index_file_name = 'index.json'
+
+
+class CachedResponse:
+    """
+    The body of a source fetched through a `SourceCache`, and whether it
+    changed since it was last loaded.
+    """
+
+    def __init__(self, content: bytes, changed: bool):
+        self.content = content
+        self.changed = changed
+
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class SourceCache:
+    """
+    A local cache of downloaded sources, keyed by URL, in `directory`. The
+    ETag and Last-Modified headers of each response are kept so later
+    downloads are conditional requests, and a source that did not change is
+    read from the cache instead of downloaded again. A hash of each body is
+    compared with the hash of the body last loaded, so sources whose server
+    does not support conditional requests are still found unchanged. The
+    least recently used bodies are evicted once the cache holds more than
+    `max_bytes`. If `bypass` is True the cache is neither read nor written,
+    and every source is downloaded and treated as changed.
+
+    The URLs fetched are tracked by source, a group of URLs such as the
+    pages of the player data. Once the data of a source is loaded, call
+    `mark_loaded` so the next load can tell whether it changed.
+    """
+
+    def __init__(self, directory: str = default_cache_directory,
+        max_bytes: int = default_max_bytes, bypass: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.lock = threading.Lock()
+        # Entries are kept from least to most recently used
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.total_bytes = 0
+        self.pending: Dict[str, Dict[str, Tuple[str, bool]]] = {}
+
+        if bypass:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, index_file_name)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                entries = json.load(f)
+            # Bodies are written before the index, so drop entries without one
+            for url, entry in entries.items():
+                if os.path.exists(self.body_path(url)):
+                    self.entries[url] = entry
+                    self.total_bytes += entry['size']
+
+
+    def body_path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + '.body')
+
+
+    def read_body(self, url: str) -> Optional[bytes]:
+        try:
+            with open(self.body_path(url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        with self.lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+
+    def get(self, url: str, session: Optional[requests.Session] = None,
+        source: Optional[str] = None) -> CachedResponse:
+        """
+        Download `url` with a conditional request, using `session` if given,
+        or read it from the cache if it did not change on the server. Track
+        it as part of `source`, which defaults to `url`.
+        """
+        if self.bypass:
+            return CachedResponse(utils.make_get_request(url, True, session).content, True)
+
+        response = utils.make_get_request(url, True, session, self.conditional_headers(url))
+        content = self.read_body(url) if response.status_code == 304 else None
+        if content is None:
+            # The body was evicted after the conditional request was sent
+            if response.status_code == 304:
+                response = utils.make_get_request(url, True, session)
+            content = response.content
+
+        body_file = None
+        if response.status_code != 304:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                delete=False) as f:
+                f.write(content)
+                body_file = f.name
+
+        changed = self.update(url, response, hashlib.sha256(content).hexdigest(), len(content),
+            body_file, source or url)
+        return CachedResponse(content, changed)
+
+
+    def fetch_to_file(self, url: str, path: str, source: Optional[str] = None,
+        chunk_size: int = 1024 * 1024) -> bool:
+        """
+        Download `url` to the file at `path` with a conditional request,
+        streaming the body in chunks of `chunk_size` bytes, or copy it from
+        the cache if it did not change on the server. Track it as part of
+        `source`, which defaults to `url`. Return whether it changed since
+        it was last loaded.
+        """
+        headers = {} if self.bypass else self.conditional_headers(url)
+        response = utils.make_streaming_get_request(url, True, headers)
+        digest = hashlib.sha256()
+
+        try:
+            if response.status_code == 304:
+                try:
+                    shutil.copyfile(self.body_path(url), path)
+                except FileNotFoundError:
+                    # The body was evicted after the conditional request was sent
+                    response.close()
+                    response = utils.make_streaming_get_request(url, True)
+
+            if response.status_code == 304:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        digest.update(chunk)
+            else:
+                with open(path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        digest.update(chunk)
+                        f.write(chunk)
+        finally:
+            response.close()
+
+        if self.bypass:
+            return True
+
+        body_file = None
+        if response.status_code != 304:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                delete=False) as f:
+                body_file = f.name
+            shutil.copyfile(path, body_file)
+
+        return self.update(url, response, digest.hexdigest(), os.path.getsize(path), body_file,
+            source or url)
+
+
+    def update(self, url: str, response: requests.Response, sha256: str, size: int,
+        body_file: Optional[str], source: str) -> bool:
+        """
+        Record the response to a request for `url`, whose body has hash
+        `sha256` and `size` bytes. A new body, written to the temporary file
+        `body_file`, replaces the cached body. Evict the least recently used
+        bodies if the cache is over its size. Return whether the body changed
+        since it was last loaded.
+        """
+        with self.lock:
+            entry = self.entries.pop(url, {})
+            self.total_bytes -= entry.get('size', 0)
+            if body_file:
+                if size <= self.max_bytes:
+                    os.replace(body_file, self.body_path(url))
+                    entry.update({'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                        'sha256': sha256, 'size': size})
+                else:
+                    os.remove(body_file)
+                    entry = {}
+
+            changed = entry.get('loaded_sha256') != sha256
+            if entry:
+                self.entries[url] = entry
+                self.total_bytes += entry['size']
+            elif os.path.exists(self.body_path(url)):
+                os.remove(self.body_path(url))
+            self.pending.setdefault(source, {})[url] = (sha256, changed)
+
+            self.evict()
+        return changed
+
+
+    def evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self.entries:
+            url, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry['size']
+            if os.path.exists(self.body_path(url)):
+                os.remove(self.body_path(url))
+
+
+    def has_changes(self, source: str) -> bool:
+        """
+        Return whether any URL of `source` fetched since the source was last
+        marked loaded changed, or True if none was fetched.
+        """
+        with self.lock:
+            fetched = self.pending.get(source)
+            return not fetched or any(changed for _, changed in fetched.values())
+
+
+    def discard(self, source: str, urls: List[str]) -> None:
+        """
+        Stop tracking `urls` as part of `source`, such as pages requested
+        ahead past the end of the source.
+        """
+        with self.lock:
+            for url in urls:
+                self.pending.get(source, {}).pop(url, None)
+
+
+    def mark_loaded(self, source: str) -> None:
+        """
+        Record that the bodies of the URLs of `source` fetched since it was
+        last marked loaded have been loaded, and save the cache index.
+        """
+        if self.bypass:
+            return
+
+        with self.lock:
+            for url, (sha256, _) in self.pending.pop(source, {}).items():
+                entry = self.entries.get(url)
+                if entry and entry['sha256'] == sha256:
+                    entry['loaded_sha256'] = sha256
+            self.save()
+
+
+    def save(self) -> None:
+        index_path = os.path.join(self.directory, index_file_name)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def make_source_cache_from_config(config: Dict) -> Optional[SourceCache]:
+    """
+    Create the source cache configured in `config`, or return None if no
+    cache directory is set.
+    """
+    if not config.get('source_cache_directory'):
+        return None
+    return SourceCache(config['source_cache_directory'],
+        config.get('source_cache_max_bytes', default_max_bytes),
+        config.get('bypass_source_cache', False))
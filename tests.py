@@ -7,16 +7,163 @@
 # Test cases verify the data quality checks for each pipeline
 # and validate the data returned by some `reporting` views.
 # `tearDownClass` cleans out all tables after the tests run.
+# Tests that exercise downloads use a local HTTP server that
+# serves the `TestData` folder in place of the real sources.
+import concurrent.futures
+import filecmp
+import functools
+import gzip
+import http.server
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
 
+import numpy as np
+
+from benchmarks import synthetic_data
 from loaders import load_game_data as games, load_player_data as players
+from loaders import checkpoints, game_replay, game_sources, load_all_data, packed_games
+from loaders import partitions, quality_rules
+from loaders import shadow_tables, validate_game_data
 import logger
+import offline_analytics
+import query_profiler
+import read_api
+import source_cache
 import utils
 
 games_test_data = './TestData/test_game_data.csv'
 test_log_file = './test_log.txt'
 config = utils.load_configuration('./configuration.yml')
 
+# Stage spans are only exported by the tests that check them
+logger.configure_metrics(None, None)
+
+
+class QuietHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_test_http_server() -> http.server.ThreadingHTTPServer:
+    handler = functools.partial(QuietHTTPRequestHandler, directory='./TestData')
+    server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class PlayerPagesHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in for the player API. Serves `pages` as JSON arrays for
+    `?page=N` and `[]` past the last page, sleeping `latency` seconds
+    per request. The first `failures_per_page` requests for each page
+    fail with a 503, and the pages in `missing_pages` are not found.
+    """
+    pages: list = []
+    latency = 0.0
+    failures_per_page = 0
+    missing_pages: set = set()
+    request_counts: dict = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        page = int(query['page'][0])
+        time.sleep(self.latency)
+
+        with self.lock:
+            count = self.request_counts.get(page, 0) + 1
+            self.request_counts[page] = count
+
+        if page in self.missing_pages:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if count <= self.failures_per_page:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps(self.pages[page]).encode() if page < len(self.pages) else b'[]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_player_http_server(page_size: int, latency: float = 0.0,
+    failures_per_page: int = 0) -> http.server.ThreadingHTTPServer:
+    with open('./TestData/test_player_blob_data.json', 'r') as f:
+        players_data = json.load(f)
+
+    handler = type('Handler', (PlayerPagesHandler,), {
+        'pages': [players_data[i:i + page_size] for i in range(0, len(players_data), page_size)],
+        'latency': latency,
+        'failures_per_page': failures_per_page,
+        'missing_pages': set(),
+        'request_counts': {},
+        'lock': threading.Lock()})
+    server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_game_rows(game_id: str, columns: list, result: str) -> list:
+    """
+    Make the rows of a game where two players take turns dropping tokens
+    into `columns`, with `result` on the last move.
+    """
+    return [[game_id, ('101', '102')[i % 2], str(i + 1), str(column),
+        result if i == len(columns) - 1 else ''] for i, column in enumerate(columns)]
+
+
+def empty_all_tables() -> None:
+    connection = utils.make_db_connection_from_config(config)
+
+    try:
+        cursor = connection.cursor()
+        utils.empty_all_tables(cursor)
+        cursor.close()
+        connection.commit()
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def fetch_column(sql: str) -> list:
+    connection = utils.make_db_connection_from_config(config)
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        results = list(map(lambda r: r[0], cursor.fetchall()))
+        cursor.close()
+
+    finally:
+        if connection:
+            connection.close()
+
+    return results
+
 
 class Tests(unittest.TestCase):
 
@@ -35,6 +182,9 @@ class Tests(unittest.TestCase):
             games.load_staging_table(games_test_data, cursor)
             games.check_and_mark_data_quality(cursor, log)
             games.move_checked_data(cursor, True)
+            games.refresh_game_summary(cursor, False)
+            games.refresh_player_stats(cursor, False)
+            games.refresh_packed_games(cursor, False)
 
             # Load players test data
             with open('./TestData/test_player_blob_data.json', 'r') as f:
@@ -93,6 +243,65 @@ class Tests(unittest.TestCase):
                 connection.close()
 
 
+    def test_game_summary(self):
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+
+            # The summary derived from prepared.game_data by the original view
+            cursor.execute('''
+            SELECT game_id
+            , concluding_moves.move_number AS total_moves
+            , initial_moves.player_id AS initial_player
+            , concluding_moves.player_id AS concluding_player
+            , initial_moves.column AS initial_column
+            , concluding_moves.column AS concluding_column
+            , concluding_moves.result AS result
+            , CASE WHEN concluding_moves.result = 'win' THEN concluding_moves.player_id ELSE null END
+            , CASE WHEN concluding_moves.result = 'win' THEN 
+            (SELECT DISTINCT player_id FROM prepared.game_data WHERE game_id = concluding_moves.game_id 
+                AND player_id <> concluding_moves.player_id)
+            ELSE null END AS loser
+            FROM prepared.game_data initial_moves
+            JOIN prepared.game_data concluding_moves USING (game_id)
+            WHERE initial_moves.move_number = 1
+            AND concluding_moves.result <> ''
+            ORDER BY game_id;
+            ''')
+            expected = cursor.fetchall()
+
+            cursor.execute('SELECT * FROM reporting.game_summary ORDER BY game_id;')
+            self.assertEqual(expected, cursor.fetchall())
+            self.assertEqual(14, len(expected))
+
+            cursor.close()
+
+        finally:
+            if connection:
+                connection.close()
+
+
+    def test_packed_games(self):
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            packed = list(packed_games.read_packed_games(connection, batch_rows=5))
+            cursor = connection.cursor()
+            cursor.execute('SELECT game_id, player_id, move_number, "column", result '
+                'FROM prepared.game_data ORDER BY game_id, move_number;')
+            self.assertEqual(cursor.fetchall(), [row for game in packed for row in game.rows()])
+
+            cursor.execute('SELECT game_id, initial_column, winner FROM reporting.game_summary '
+                'ORDER BY game_id;')
+            self.assertEqual(cursor.fetchall(), [(game.game_id, game.first_column, game.winner)
+                for game in packed if game.result != game_replay.no_result])
+            cursor.close()
+
+        finally:
+            connection.close()
+
+
     def test_player_data_quality(self):
         connection = utils.make_db_connection_from_config(config)
 
@@ -196,6 +405,2033 @@ class Tests(unittest.TestCase):
                 connection.close()
 
 
+    def test_player_game_stats(self):
+        # The record of each player derived from the moves and game summaries
+        derived = fetch_column('''
+        SELECT ROW(pg.player_id, COUNT(*), COUNT(*) FILTER (WHERE pg.player_id = gs.winner),
+            COUNT(*) FILTER (WHERE pg.player_id = gs.loser),
+            COUNT(*) FILTER (WHERE gs.result = 'draw'), MIN(pg.game_id), MAX(pg.game_id))::text
+        FROM reporting.player_game pg
+        JOIN reporting.game_summary gs USING (game_id)
+        GROUP BY pg.player_id
+        ORDER BY pg.player_id;
+        ''')
+        self.assertEqual(derived, fetch_column('SELECT ROW(player_id, games_played, wins, '
+            'losses, draws, first_game_id, last_game_id)::text '
+            'FROM reporting.player_game_stats ORDER BY player_id;'))
+        self.assertEqual(['6', 'won'], fetch_column("SELECT UNNEST(ARRAY[single_game_id, "
+            "single_game_outcome]) FROM reporting.player_game_stats WHERE player_id = '103';"))
+        self.assertEqual([None, None], fetch_column("SELECT UNNEST(ARRAY[single_game_id, "
+            "single_game_outcome]) FROM reporting.player_game_stats WHERE player_id = '101';"))
+
+
+class GameStreamingTests(unittest.TestCase):
+
+    server: http.server.ThreadingHTTPServer
+    url: str
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+        cls.server = start_test_http_server()
+        cls.url = f'http://localhost:{cls.server.server_port}/test_game_data.csv'
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        empty_all_tables()
+
+
+    def load_streamed(self, local_csv_path: str, retain_csv_file: bool) -> None:
+        games.load_data(self.url, local_csv_path, retain_csv_file, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True, games.GameLoadOptions(stream_data=True))
+
+
+    def test_stream_game_data(self):
+        local_csv_path = './streamed_game_data.csv'
+        self.load_streamed(local_csv_path, False)
+
+        self.assertFalse(os.path.exists(local_csv_path))
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19], game_ids)
+
+
+    def test_stream_game_data_retains_csv_file(self):
+        local_csv_path = './streamed_game_data.csv'
+
+        try:
+            self.load_streamed(local_csv_path, True)
+            self.assertTrue(filecmp.cmp(games_test_data, local_csv_path, shallow=False))
+
+        finally:
+            if os.path.exists(local_csv_path):
+                os.remove(local_csv_path)
+
+        move_count = fetch_column('SELECT COUNT(*) FROM prepared.game_data;')
+        self.assertEqual([124], move_count)
+
+
+    def test_bulk_load_rebuilds_indexes(self):
+        index_sql = ("SELECT indexname FROM pg_indexes WHERE schemaname = 'prepared' "
+            "AND tablename IN ('game_data', 'game_summary') ORDER BY indexname;")
+        indexes = fetch_column(index_sql)
+
+        for worker_count in (1, 2):
+            self.assertTrue(games.load_data(self.url, './streamed_game_data.csv', False,
+                config['database_server'], config['database_server_port'], config['database'],
+                config['database_user'], config['database_password'], True,
+                games.GameLoadOptions(stream_data=True, worker_count=worker_count,
+                bulk_load=True, index_build_workers=2)))
+
+            self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+            self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+            self.assertEqual(indexes, fetch_column(index_sql))
+            self.assertLess(0, fetch_column("SELECT COUNT(*) FROM pg_stats "
+                "WHERE schemaname = 'prepared' AND tablename = 'game_fingerprint';")[0])
+
+
+    def test_stream_game_data_validated_in_stream(self):
+        games.load_data(self.url, './streamed_game_data.csv', False, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True,
+            games.GameLoadOptions(stream_data=True, validate_in_stream=True))
+
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19], game_ids)
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM error.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([1, 2, 3, 4, 18], game_ids)
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM stage.game_data;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+
+
+    def test_stream_game_data_in_shards(self):
+        games.load_data(self.url, './streamed_game_data.csv', False, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True,
+            games.GameLoadOptions(stream_data=True, worker_count=3))
+
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19], game_ids)
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM error.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([1, 2, 3, 4, 18], game_ids)
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM prepared.game_fingerprint;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+        self.assertEqual([], fetch_column("SELECT table_name FROM information_schema.tables "
+            "WHERE table_name LIKE 'game_data_shard%';"))
+
+
+    def test_split_game_data_keeps_games_together(self):
+        shard_paths = [f'./game_data_shard_{shard}.csv' for shard in range(3)]
+
+        try:
+            with open(games_test_data, 'rb') as f:
+                next(f)
+                row_counts = games.split_game_data(f, shard_paths, batch_lines=10)
+
+            shard_games = []
+            for shard_path in shard_paths:
+                with open(shard_path, 'r') as f:
+                    shard_games.append({line.split(',')[0] for line in f})
+
+        finally:
+            for shard_path in shard_paths:
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+
+        with open(games_test_data, 'r') as f:
+            self.assertEqual(len(f.read().splitlines()) - 1, sum(row_counts))
+        for shard, games_in_shard in enumerate(shard_games):
+            for other_games in shard_games[shard + 1:]:
+                self.assertEqual(set(), games_in_shard & other_games)
+
+
+def write_game_shards(directory: str) -> list:
+    """
+    Split the test game data into three shards in `directory`, keeping
+    each game in one shard: two compressed with gzip, one of them in two
+    gzip members, and one uncompressed without a final line ending.
+    Return the paths of the shards.
+    """
+    with open(games_test_data, 'rb') as f:
+        header = f.readline()
+        rows = f.read().splitlines()
+    shard_rows: list = [[], [], []]
+    for row in rows:
+        shard_rows[int(row.split(b',')[0]) % 3].append(row + b'\n')
+
+    paths = [os.path.join(directory, name) for name in
+        ('game_data_1.csv.gz', 'game_data_2.csv.gz', 'game_data_3.csv')]
+    with open(paths[0], 'wb') as f:
+        f.write(gzip.compress(header + b''.join(shard_rows[0])))
+    with open(paths[1], 'wb') as f:
+        f.write(gzip.compress(header + b''.join(shard_rows[1][:5])))
+        f.write(gzip.compress(b''.join(shard_rows[1][5:])))
+    with open(paths[2], 'wb') as f:
+        f.write(header + b''.join(shard_rows[2]).rstrip(b'\n'))
+    return paths
+
+
+class GameSourceTests(unittest.TestCase):
+
+    directory: tempfile.TemporaryDirectory
+    shard_paths: list
+    shard_urls: list
+    server: http.server.ThreadingHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.shard_paths = write_game_shards(cls.directory.name)
+        handler = functools.partial(QuietHTTPRequestHandler, directory=cls.directory.name)
+        cls.server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.shard_urls = [f'http://localhost:{cls.server.server_port}/'
+            f'{os.path.basename(path)}' for path in cls.shard_paths]
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.directory.cleanup()
+        empty_all_tables()
+
+
+    def load(self, data_url, cache=None, **options) -> bool:
+        return games.load_data(data_url, os.path.join(self.directory.name, 'game_data.csv'),
+            False, config['database_server'], config['database_server_port'],
+            config['database'], config['database_user'], config['database_password'], True,
+            games.GameLoadOptions(**options), cache=cache)
+
+
+    def assert_loaded(self) -> None:
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19], game_ids)
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+
+
+    def test_reader_decompresses_shards(self):
+        with open(games_test_data, 'rb') as f:
+            header = f.readline()
+            rows = f.read().splitlines()
+        log = logger.Log(test_log_file)
+        tee_path = os.path.join(self.directory.name, 'tee.csv')
+
+        for worker_count in (1, 3):
+            reader = game_sources.GameSourceReader(self.shard_paths + self.shard_urls, log,
+                worker_count, chunk_size=16, max_queued_chunks=2, tee_path=tee_path)
+            content = b''
+            chunk = reader.read(5)
+            while chunk:
+                content += chunk
+                chunk = reader.read(5)
+            reader.close()
+
+            self.assertEqual(sorted(rows * 2), sorted(content.splitlines()))
+            with open(tee_path, 'rb') as f:
+                self.assertEqual(header + content, f.read())
+            self.assertEqual(['gzip', 'gzip', 'none'] * 2,
+                [stats.compression for stats in reader.shard_stats])
+            self.assertEqual(len(rows) * 2, sum(stats.rows for stats in reader.shard_stats))
+            self.assertEqual([os.path.getsize(path) for path in self.shard_paths] * 2,
+                [stats.compressed_bytes for stats in reader.shard_stats])
+
+
+    def test_single_shard_is_copied_unchanged(self):
+        path = os.path.join(self.directory.name, 'copied_game_data.csv')
+        game_sources.copy_to_file([games_test_data], path, logger.Log(test_log_file))
+        self.assertTrue(filecmp.cmp(games_test_data, path, shallow=False))
+
+
+    def test_expand_locations(self):
+        self.assertEqual(self.shard_paths[:2] + self.shard_urls[:1],
+            game_sources.expand_locations([os.path.join(self.directory.name, '*.gz'),
+            self.shard_urls[0]]))
+        self.assertEqual([games_test_data], game_sources.expand_locations(games_test_data))
+        with self.assertRaises(ValueError):
+            game_sources.expand_locations(os.path.join(self.directory.name, '*.zst'))
+
+
+    def test_load_local_shards(self):
+        self.assertTrue(self.load(os.path.join(self.directory.name, 'game_data_*')))
+        self.assert_loaded()
+
+
+    def test_stream_shards(self):
+        for options in ({}, {'validate_in_stream': True}, {'worker_count': 2}):
+            with self.subTest(**options):
+                empty_all_tables()
+                self.assertTrue(self.load(self.shard_urls, stream_data=True, source_workers=2,
+                    **options))
+                self.assert_loaded()
+                self.assertEqual([1, 2, 3, 4, 18], fetch_column('SELECT DISTINCT(game_id)::int '
+                    'FROM error.game_data ORDER BY game_id::int;'))
+
+
+    def test_cached_shards(self):
+        cache = source_cache.SourceCache(os.path.join(self.directory.name, 'cache'))
+        self.assertTrue(self.load(self.shard_urls, cache=cache))
+        self.assert_loaded()
+
+        # The load is skipped when no shard changed
+        empty_all_tables()
+        self.assertTrue(self.load(self.shard_urls, cache=cache))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+
+
+    def test_missing_shard_fails_load(self):
+        empty_all_tables()
+        missing_url = self.shard_urls[0].replace('game_data_1', 'game_data_0')
+        self.assertFalse(self.load(self.shard_urls + [missing_url]))
+        self.assertFalse(self.load(self.shard_urls + [missing_url], stream_data=True))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+
+
+    @unittest.skipIf(game_sources.zstandard is None, 'zstandard is not installed')
+    def test_zstd_shard(self):
+        path = os.path.join(self.directory.name, 'game_data.csv.zst')
+        with open(games_test_data, 'rb') as f:
+            content = f.read()
+        with open(path, 'wb') as f:
+            f.write(game_sources.zstandard.ZstdCompressor().compress(content))
+
+        try:
+            copied_path = os.path.join(self.directory.name, 'copied_game_data.csv')
+            game_sources.copy_to_file([path], copied_path, logger.Log(test_log_file))
+            self.assertTrue(filecmp.cmp(games_test_data, copied_path, shallow=False))
+        finally:
+            os.remove(path)
+
+
+class RecordingHTTPRequestHandler(QuietHTTPRequestHandler):
+    """
+    Serves the `TestData` folder, recording the status of each response.
+    """
+    statuses: list = []
+
+    def send_response(self, code, message=None):
+        self.statuses.append(code)
+        super().send_response(code, message)
+
+
+class SourceCacheTests(unittest.TestCase):
+
+    game_server: http.server.ThreadingHTTPServer
+    player_server: http.server.ThreadingHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        handler = functools.partial(type('Handler', (RecordingHTTPRequestHandler,),
+            {'statuses': []}), directory='./TestData')
+        cls.game_server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+        threading.Thread(target=cls.game_server.serve_forever, daemon=True).start()
+        cls.player_server = start_player_http_server(page_size=2)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.game_server, cls.player_server):
+            server.shutdown()
+            server.server_close()
+        empty_all_tables()
+
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.game_url = f'http://localhost:{self.game_server.server_port}/test_game_data.csv'
+        self.player_url = f'http://localhost:{self.player_server.server_port}/users'
+        self.all_pages = self.player_server.RequestHandlerClass.pages
+        self.game_server.RequestHandlerClass.func.statuses.clear()
+
+
+    def tearDown(self):
+        self.player_server.RequestHandlerClass.pages = self.all_pages
+        self.directory.cleanup()
+
+
+    def fetch_player_pages(self, cache: source_cache.SourceCache) -> list:
+        with utils.make_http_session() as session:
+            return [response.content for _, response in
+                players.fetch_player_pages(self.player_url, session, 2, cache=cache)]
+
+
+    def test_conditional_requests(self):
+        path = os.path.join(self.directory.name, 'game_data.csv')
+        cache = source_cache.SourceCache(self.directory.name)
+
+        self.assertTrue(cache.fetch_to_file(self.game_url, path))
+        cache.mark_loaded(self.game_url)
+
+        # A new cache reads the index saved when the download was loaded
+        cache = source_cache.SourceCache(self.directory.name)
+        os.remove(path)
+        self.assertFalse(cache.fetch_to_file(self.game_url, path))
+        self.assertTrue(filecmp.cmp(games_test_data, path, shallow=False))
+        self.assertEqual([200, 304], self.game_server.RequestHandlerClass.func.statuses)
+
+
+    def test_changed_player_pages(self):
+        cache = source_cache.SourceCache(self.directory.name)
+        pages = self.fetch_player_pages(cache)
+        self.assertTrue(cache.has_changes(self.player_url))
+        cache.mark_loaded(self.player_url)
+
+        # The player API does not send validators, so the pages are compared by hash
+        self.assertEqual(pages, self.fetch_player_pages(cache))
+        self.assertFalse(cache.has_changes(self.player_url))
+        cache.mark_loaded(self.player_url)
+
+        # A source that shrinks changes the page that is now empty
+        self.player_server.RequestHandlerClass.pages = self.all_pages[:-1]
+        self.assertEqual(pages[:-1], self.fetch_player_pages(cache))
+        self.assertTrue(cache.has_changes(self.player_url))
+
+
+    def test_least_recently_used_eviction(self):
+        cache = source_cache.SourceCache(self.directory.name, max_bytes=4000)
+        with utils.make_http_session() as session:
+            for page in (0, 1, 0, 2):
+                cache.get(f'{self.player_url}?page={page}', session)
+
+        self.assertEqual([f'{self.player_url}?page={page}' for page in (0, 2)],
+            list(cache.entries))
+        self.assertEqual(sum(entry['size'] for entry in cache.entries.values()),
+            cache.total_bytes)
+        self.assertLessEqual(cache.total_bytes, 4000)
+        self.assertEqual(2, len(os.listdir(self.directory.name)))
+
+        # The saved index keeps the order the entries were used in
+        cache.mark_loaded(f'{self.player_url}?page=2')
+        reopened = source_cache.SourceCache(self.directory.name, max_bytes=4000)
+        self.assertEqual(list(cache.entries), list(reopened.entries))
+        self.assertEqual(cache.total_bytes, reopened.total_bytes)
+
+
+    def test_bypass(self):
+        path = os.path.join(self.directory.name, 'game_data.csv')
+        cache = source_cache.SourceCache(self.directory.name, bypass=True)
+
+        for _ in range(2):
+            self.assertTrue(cache.fetch_to_file(self.game_url, path))
+            cache.mark_loaded(self.game_url)
+        self.assertEqual([200, 200], self.game_server.RequestHandlerClass.func.statuses)
+        self.assertEqual(['game_data.csv'], os.listdir(self.directory.name))
+
+
+    def test_unchanged_sources_skip_load(self):
+        empty_all_tables()
+        cache_config = dict(config, source_cache_directory=self.directory.name,
+            game_data_csv_location=self.game_url, player_data_location=self.player_url)
+        local_csv_path = os.path.join(self.directory.name, 'game_data.csv')
+
+        published = load_all_data.load_data(cache_config, local_csv_path)
+        self.assertEqual({'game': True, 'player': True}, published)
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+
+        # Rows removed since the load stay removed when the sources are unchanged
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM prepared.game_data; DELETE FROM prepared.player_info;')
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+
+        self.player_server.RequestHandlerClass.pages = self.all_pages[:-1]
+        published = load_all_data.load_data(cache_config, local_csv_path)
+        self.assertEqual({'game': True, 'player': True}, published)
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([7], fetch_column('SELECT COUNT(*) FROM prepared.player_info;'))
+
+        published = load_all_data.load_data(dict(cache_config, bypass_source_cache=True),
+            local_csv_path)
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+
+
+class PlayerFetcherTests(unittest.TestCase):
+
+    def fetch_all(self, server: http.server.ThreadingHTTPServer, worker_count: int) -> list:
+        url = f'http://localhost:{server.server_port}/users'
+        with utils.make_http_session(pool_size=worker_count, backoff_factor=0) as session:
+            return [(page, response.json()) for page, response in
+                players.fetch_player_pages(url, session, worker_count)]
+
+
+    def test_fetch_player_pages_in_order(self):
+        server = start_player_http_server(page_size=1)
+
+        try:
+            sequential = self.fetch_all(server, 1)
+            concurrent = self.fetch_all(server, 4)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(list(range(9)), [page for page, _ in sequential])
+        self.assertEqual(sequential, concurrent)
+
+
+    def test_fetch_player_pages_concurrently_is_faster(self):
+        server = start_player_http_server(page_size=1, latency=0.1)
+
+        try:
+            time1 = time.monotonic()
+            self.fetch_all(server, 1)
+            time2 = time.monotonic()
+            self.fetch_all(server, 8)
+            time3 = time.monotonic()
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertLess(time3 - time2, time2 - time1)
+
+
+    def test_fetch_player_pages_retries(self):
+        server = start_player_http_server(page_size=3, failures_per_page=2)
+
+        try:
+            pages = self.fetch_all(server, 2)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual([0, 1, 2], [page for page, _ in pages])
+        self.assertEqual(3, server.RequestHandlerClass.request_counts[0])
+
+
+class PlayerDownloadTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        empty_all_tables()
+
+
+    def test_load_player_data_from_pages(self):
+        server = start_player_http_server(page_size=2, latency=0.01)
+
+        try:
+            players.load_data(f'http://localhost:{server.server_port}/users',
+                config['database_server'], config['database_server_port'],
+                config['database'], config['database_user'], config['database_password'],
+                True, players.PlayerLoadOptions(download_workers=4))
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        player_ids = fetch_column('SELECT player_id::int FROM prepared.player_info '
+            'ORDER BY player_id::int;')
+        self.assertEqual([101, 102, 103, 104, 105, 106, 107, 108], player_ids)
+        self.assertEqual([0], fetch_column('SELECT player_id::int FROM error.player_info;'))
+
+
+class PlayerDetailColumnsTests(unittest.TestCase):
+
+    server: http.server.ThreadingHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+        cls.server = start_player_http_server(page_size=3)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            cursor.execute('ALTER TABLE prepared.player_info DROP COLUMN IF EXISTS first_name; '
+                'ALTER TABLE prepared.player_info DROP COLUMN IF EXISTS birth_time; '
+                'DROP INDEX IF EXISTS prepared.ix_player_info_details;')
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+        empty_all_tables()
+
+
+    def load_players(self, detail_columns: dict, details_gin_index: bool) -> bool:
+        return players.load_data(f'http://localhost:{self.server.server_port}/users',
+            config['database_server'], config['database_server_port'], config['database'],
+            config['database_user'], config['database_password'], True,
+            players.PlayerLoadOptions(detail_columns=detail_columns,
+            details_gin_index=details_gin_index))
+
+
+    def test_invalid_detail_columns(self):
+        with self.assertRaises(ValueError):
+            players.make_detail_columns({'first_name': {'field': 'name.first', 'type': 'json'}})
+        with self.assertRaises(ValueError):
+            players.make_detail_columns({'first name': {'field': 'name.first'}})
+        with self.assertRaises(ValueError):
+            players.make_detail_columns({'first_name': {'field': "name'first"}})
+        self.assertFalse(self.load_players({'details': {'field': 'nat'}}, False))
+
+
+    def test_configured_detail_columns(self):
+        self.assertTrue(self.load_players({}, True))
+        self.assertTrue(self.load_players({'first_name': {'field': 'name.first'},
+            'birth_time': {'field': 'dob', 'type': 'timestamp'}}, True))
+
+        self.assertEqual(['wayne'], fetch_column("SELECT first_name FROM prepared.player_info "
+            "WHERE player_id = '108';"))
+        self.assertEqual(['1995-06-22 02:30:42'], fetch_column("SELECT birth_time::text "
+            "FROM prepared.player_info WHERE player_id = '108';"))
+        self.assertEqual(['IE'], fetch_column("SELECT nationality FROM reporting.player_details "
+            "WHERE player_id = '108';"))
+        indexes = fetch_column("SELECT indexname FROM pg_indexes WHERE schemaname = 'prepared' "
+            "AND tablename = 'player_info' ORDER BY indexname;")
+        self.assertEqual(['ix_player_info_birth_time', 'ix_player_info_details',
+            'ix_player_info_email_address', 'ix_player_info_first_name',
+            'ix_player_info_nationality', 'ix_player_info_player_id'], indexes)
+
+        self.assertTrue(self.load_players({}, False))
+        self.assertNotIn('ix_player_info_details', fetch_column("SELECT indexname FROM pg_indexes "
+            "WHERE schemaname = 'prepared' AND tablename = 'player_info';"))
+
+
+class PlayerBlobCopyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = utils.make_db_connection_from_config(config)
+        self.cursor = self.connection.cursor()
+
+
+    def tearDown(self):
+        self.cursor.close()
+        self.connection.rollback()
+        self.connection.close()
+
+
+    def test_insert_player_blobs_round_trips_raw_pages(self):
+        pages = [b'[{"id": 1, "data": {"name": "O\'Brien \\\\ \\"Tab\\"\\t"}}]',
+            b'[\n\t{"id": 2,\r\n "data": {}}\n]']
+        rejected_count = players.insert_player_blobs(self.cursor, pages)
+
+        self.cursor.execute('SELECT player_blob FROM stage.player_blobs;')
+        self.assertEqual(0, rejected_count)
+        self.assertEqual([json.loads(page) for page in pages],
+            [r[0] for r in self.cursor.fetchall()])
+
+
+    def test_insert_player_blobs_rejects_invalid_pages(self):
+        pages = [b'[{"id": 1}]', b'[{"id": 2}', b'[{"id": 3}]']
+        rejected_count = players.insert_player_blobs(self.cursor, pages)
+
+        self.cursor.execute("SELECT player_blob -> 0 ->> 'id' FROM stage.player_blobs;")
+        self.assertEqual(1, rejected_count)
+        self.assertEqual(['1', '3'], sorted(r[0] for r in self.cursor.fetchall()))
+
+
+class InStreamValidationTests(unittest.TestCase):
+
+    def setUp(self):
+        empty_all_tables()
+        self.connection = utils.make_db_connection_from_config(config)
+        self.cursor = self.connection.cursor()
+        self.log = logger.Log(test_log_file)
+
+
+    def tearDown(self):
+        self.cursor.close()
+        self.connection.rollback()
+        self.connection.close()
+        empty_all_tables()
+
+
+    def staged_fingerprints(self) -> list:
+        games.load_staging_table(games_test_data, self.cursor)
+        games.check_and_mark_data_quality(self.cursor, self.log)
+        games.stage_game_fingerprints(self.cursor)
+        self.cursor.execute('SELECT game_id, fingerprint FROM staged_game_fingerprint '
+            'ORDER BY game_id;')
+        fingerprints = self.cursor.fetchall()
+        self.cursor.execute('TRUNCATE TABLE stage.game_data;')
+        return fingerprints
+
+
+    def check_routed_data(self, expected_fingerprints: list) -> None:
+        self.cursor.execute('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19],
+            [r[0] for r in self.cursor.fetchall()])
+        self.cursor.execute('SELECT DISTINCT(game_id)::int FROM error.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([1, 2, 3, 4, 18], [r[0] for r in self.cursor.fetchall()])
+        self.cursor.execute('SELECT COUNT(*) FROM prepared.game_data;')
+        self.assertEqual((124,), self.cursor.fetchone())
+        self.cursor.execute('SELECT game_id, fingerprint FROM staged_game_fingerprint '
+            'ORDER BY game_id;')
+        self.assertEqual(expected_fingerprints, self.cursor.fetchall())
+
+
+    def test_load_validated_data(self):
+        expected_fingerprints = self.staged_fingerprints()
+
+        with open(games_test_data, 'rb') as f:
+            next(f)
+            games.load_validated_data(f, self.cursor, self.log)
+
+        self.check_routed_data(expected_fingerprints)
+
+
+    def test_load_validated_data_with_interleaved_games(self):
+        expected_fingerprints = self.staged_fingerprints()
+
+        with open(games_test_data, 'rb') as f:
+            next(f)
+            lines = f.read().splitlines()
+        random.Random(7).shuffle(lines)
+
+        self.cursor.execute('SELECT NOW()::timestamp::text;')
+        create_timestamp = self.cursor.fetchone()[0]
+        validate_game_data.route_validated_data(io.BytesIO(b'\n'.join(lines)), self.cursor,
+            create_timestamp.encode(), self.log, batch_rows=10, max_open_games=2)
+        split_game_count = games.reprocess_split_games(self.cursor, create_timestamp, self.log)
+
+        self.assertGreater(split_game_count, 0)
+        self.check_routed_data(expected_fingerprints)
+
+
+class GameRulesTests(unittest.TestCase):
+
+    games = [make_game_rows('1', [1, 2, 1, 2, 1, 2, 1], 'win'),
+        make_game_rows('2', [1, 1, 2, 2, 3, 3, 4], 'win'),
+        make_game_rows('3', [1, 2, 2, 3, 3, 4, 3, 4, 4, 1, 4], 'win'),
+        make_game_rows('4', [1, 3, 1, 4, 2, 2, 1, 3, 2, 3, 4, 1, 4, 4, 3, 2], 'draw'),
+        make_game_rows('5', [1, 2, 1, 2, 3], ''),
+        make_game_rows('6', [1, 1, 1, 1, 1], ''),
+        make_game_rows('7', [1, 2, 1, 2, 1, 2, 1, 2], 'win'),
+        make_game_rows('8', [1, 2, 1, 2, 1, 2, 3], 'win'),
+        make_game_rows('9', [1, 2, 1, 2, 1, 2, 1], ''),
+        make_game_rows('10', [1, 2, 3], 'draw'),
+        [['11', '101', '1', '1', ''], ['11', '102', '2', '2', ''], ['11', '102', '3', '3', '']],
+        [['12', '101', '1', '1', 'win'], ['12', '102', '2', '2', '']],
+        [['13', '101', '1', '1', ''], ['13', '102', '3', '2', '']],
+        make_game_rows('14', [0, 1], '')]
+
+    expected_reasons = ['', '', '', '', '', 'column_overflow', 'move_after_win',
+        'result_mismatch', 'result_mismatch', 'result_mismatch', 'players_not_alternating',
+        'result_not_on_last_move', 'move_sequence', '']
+
+    def setUp(self):
+        empty_all_tables()
+        self.connection = utils.make_db_connection_from_config(config)
+        self.cursor = self.connection.cursor()
+        self.log = logger.Log(test_log_file)
+        self.csv_data = '\n'.join(','.join(row) for rows in self.games for row in rows)
+
+
+    def tearDown(self):
+        self.cursor.close()
+        self.connection.rollback()
+        self.connection.close()
+        empty_all_tables()
+
+
+    def check_loaded_data(self) -> None:
+        legal_game_ids = [rows[0][0] for rows, reason in
+            zip(self.games, self.expected_reasons) if not reason]
+        self.cursor.execute('SELECT DISTINCT(game_id) FROM prepared.game_data;')
+        self.assertEqual(legal_game_ids,
+            sorted((r[0] for r in self.cursor.fetchall()), key=int))
+
+        self.cursor.execute('SELECT DISTINCT game_id, rejection_reason FROM error.game_data;')
+        self.assertEqual([(rows[0][0], reason) for rows, reason in
+            zip(self.games, self.expected_reasons) if reason],
+            sorted(self.cursor.fetchall(), key=lambda r: int(r[0])))
+
+
+    def test_check_games(self):
+        self.assertEqual(self.expected_reasons, game_replay.check_games(self.games))
+        self.assertEqual(['invalid_column'],
+            game_replay.check_games([make_game_rows('15', [1, 5], '')]))
+
+
+    def test_check_game_rules(self):
+        self.cursor.copy_expert(games.copy_game_data_sql, io.StringIO(self.csv_data))
+        games.check_and_mark_data_quality(self.cursor, self.log)
+        games.check_game_rules(self.cursor, self.log, batch_rows=7)
+        games.move_checked_data(self.cursor, False)
+        self.check_loaded_data()
+
+
+    def test_load_validated_data_with_game_rules(self):
+        games.load_validated_data(io.BytesIO(self.csv_data.encode()), self.cursor, self.log,
+            validate_game_rules=True)
+        self.check_loaded_data()
+
+
+class PackedGameTests(unittest.TestCase):
+
+    def setUp(self):
+        empty_all_tables()
+
+
+    def tearDown(self):
+        empty_all_tables()
+
+
+    def test_pack_and_decode_moves(self):
+        games_rows = [make_game_rows('1', [1, 2, 1, 2, 1, 2, 1], 'win'),
+            make_game_rows('2', [1, 3, 1, 4, 2, 2, 1, 3, 2, 3, 4, 1, 4, 4, 3, 2], 'draw'),
+            make_game_rows('3', [4], '')]
+        packed = [packed_games.PackedGame(rows[0][0], *packed_games.pack_moves(
+            [row[1] for row in rows], [int(row[3]) for row in rows]),
+            game_replay.result_codes[rows[-1][4]]) for rows in games_rows]
+
+        self.assertEqual(bytes([1, 0x82, 1, 0x82, 1, 0x82, 1]), packed[0].moves)
+        self.assertEqual(('102', 3, '101'), (packed[1].last_player, packed[1].columns[1],
+            packed[0].winner))
+        self.assertIsNone(packed[1].winner)
+        self.assertEqual([tuple(row[:2]) + (int(row[2]), int(row[3]), row[4])
+            for rows in games_rows for row in rows], [row for game in packed for row in game.rows()])
+        with self.assertRaises(ValueError):
+            packed_games.pack_moves(['101', '102', '103'], [1, 2, 3])
+
+        grid_columns, second_player, move_counts = packed_games.decode_moves(
+            [game.moves for game in packed])
+        self.assertEqual([7, 16, 1], list(move_counts))
+        self.assertEqual([1, 2, 1, 2, 1, 2, 1] + [0] * 9, list(grid_columns[0]))
+        self.assertEqual([True, True, False], list(second_player[:, 1]))
+        reasons = game_replay.replay_games(grid_columns, move_counts,
+            np.array([game.result for game in packed]))
+        self.assertEqual([game_replay.legal] * 3, list(reasons))
+
+
+    def test_refresh_packed_games(self):
+        games_rows = [make_game_rows('1', [1, 2, 1, 2, 1, 2, 1], 'win'),
+            [['2', '101', '1', '1', ''], ['2', '102', '3', '2', '']],
+            [['3', '101', '1', '1', 'win'], ['3', '102', '2', '2', '']],
+            [['4', '101', '1', '1', ''], ['4', '102', '2', '2', ''], ['4', '103', '3', '3', '']],
+            make_game_rows('5', [3, 200], '')]
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(games.copy_game_data_sql, io.StringIO('\n'.join(
+                ','.join(row) for rows in games_rows for row in rows)))
+            cursor.execute('INSERT INTO prepared.game_data (game_id, player_id, move_number, '
+                '"column", result) SELECT game_id, player_id, move_number::int, "column"::int, '
+                'result FROM stage.game_data;')
+
+            # Only the game whose moves can be packed without loss is packed
+            self.assertEqual(1, games.refresh_packed_games(cursor, False))
+            cursor.execute('SELECT game_id, first_player, second_player, moves, result '
+                'FROM reporting.packed_game;')
+            game = packed_games.PackedGame(*cursor.fetchone())
+            self.assertEqual(('1', '101', '102', game_replay.win_result),
+                (game.game_id, game.first_player, game.second_player, game.result))
+            self.assertEqual([1, 2, 1, 2, 1, 2, 1], game.columns)
+            cursor.close()
+            connection.rollback()
+
+        finally:
+            connection.close()
+
+
+class MetricRecordingLog(logger.Log):
+    """
+    A log that also keeps the metrics written to it.
+    """
+
+    def __init__(self, log_file: str):
+        super().__init__(log_file)
+        self.metrics: dict = {}
+
+
+    def write_metric(self, metric_name: str, value: float):
+        super().write_metric(metric_name, value)
+        self.metrics[metric_name] = value
+
+
+class DataQualityRulesTests(unittest.TestCase):
+
+    expected_reasons = [('1', 'move_number_not_integer'), ('2', 'column_not_integer'),
+        ('3', 'column_out_of_range'), ('4', 'invalid_result'), ('18', 'not_two_players')]
+
+    def setUp(self):
+        empty_all_tables()
+        self.connection = utils.make_db_connection_from_config(config)
+        self.cursor = self.connection.cursor()
+        self.log = MetricRecordingLog(test_log_file)
+
+
+    def tearDown(self):
+        self.cursor.close()
+        self.connection.rollback()
+        self.connection.close()
+        empty_all_tables()
+
+
+    def rejection_reasons(self) -> list:
+        self.cursor.execute('SELECT DISTINCT game_id, rejection_reason FROM error.game_data;')
+        return sorted(self.cursor.fetchall(), key=lambda r: int(r[0]))
+
+
+    def test_game_rejection_reasons(self):
+        games.load_staging_table(games_test_data, self.cursor)
+        games.check_and_mark_data_quality(self.cursor, self.log)
+        games.move_checked_data(self.cursor, False)
+
+        self.assertEqual(self.expected_reasons, self.rejection_reasons())
+        self.assertEqual(1, self.log.metrics['game_rejected_move_number_not_integer'])
+        self.assertEqual(4, self.log.metrics['game_rejected_not_two_players'])
+        self.assertEqual(0, self.log.metrics['game_rejected_game_id_missing'])
+
+
+    def test_in_stream_rejection_reasons(self):
+        with open(games_test_data, 'rb') as f:
+            next(f)
+            games.load_validated_data(f, self.cursor, self.log)
+
+        self.assertEqual(self.expected_reasons, self.rejection_reasons())
+        self.assertEqual(1, self.log.metrics['game_rejected_move_number_not_integer'])
+        self.assertEqual(4, self.log.metrics['game_rejected_not_two_players'])
+
+
+    def test_custom_rules(self):
+        rules = games.make_data_quality_rules([
+            {'code': 'unknown_player', 'column': 'player_id', 'enum': ['101', '102', '1000']},
+            {'code': 'too_many_moves', 'column': 'move_number', 'range': {'max': 9}}])
+        csv_data = '1,101,1,1,\n1,102,2,2,\n2,101,1,1,\n2,103,2,2,\n3,101,10,1,win\n'
+
+        self.cursor.copy_expert(games.copy_game_data_sql, io.StringIO(csv_data))
+        games.check_and_mark_data_quality(self.cursor, self.log, rules=rules)
+        games.move_checked_data(self.cursor, False)
+        staged_reasons = self.rejection_reasons()
+        self.cursor.execute('TRUNCATE TABLE error.game_data, prepared.game_data;')
+
+        games.load_validated_data(io.BytesIO(csv_data.encode()), self.cursor, self.log,
+            rules=rules)
+        self.assertEqual([('2', 'unknown_player'), ('3', 'too_many_moves')], staged_reasons)
+        self.assertEqual(staged_reasons, self.rejection_reasons())
+        self.cursor.execute('SELECT COUNT(*) FROM prepared.game_data;')
+        self.assertEqual((2,), self.cursor.fetchone())
+
+
+    def test_player_rules(self):
+        with open('./TestData/test_player_blob_data.json', 'r') as f:
+            players.insert_player_blob(self.cursor, f.read())
+        players.debatch_blob(self.cursor)
+        rules = players.make_data_quality_rules([
+            {'code': 'missing_data', 'column': 'details', 'has_key': 'data'},
+            {'code': 'missing_email', 'column': 'details', 'field': 'data.email',
+                'regex': '@'}])
+        players.check_and_mark_data_quality(self.cursor, self.log, rules)
+        players.move_checked_data(self.cursor, False)
+
+        self.cursor.execute('SELECT player_id, rejection_reason FROM error.player_info;')
+        self.assertEqual([('0', 'missing_data')], self.cursor.fetchall())
+        self.assertEqual(1, self.log.metrics['player_rejected_missing_data'])
+        self.assertEqual(0, self.log.metrics['player_rejected_missing_email'])
+
+
+    def test_invalid_rules(self):
+        invalid_rules = [[{'code': 'bad', 'column': 'no_such_column', 'not_null': True}],
+            [{'code': 'bad', 'column': 'result', 'regex': '('}],
+            [{'code': 'bad', 'column': 'column', 'regex': '^\\d$'}],
+            [{'code': 'bad', 'column': 'result', 'regex': '(?i)win'}],
+            [{'code': 'bad', 'column': 'result', 'regex': 'w(?=in)'}],
+            [{'code': 'bad', 'column': 'result', 'regex': 'w.*?n'}],
+            [{'code': 'bad', 'column': 'result', 'not_null': True, 'enum': ['win']}],
+            [{'code': 'bad', 'column': 'column', 'range': {'max': 'four'}}],
+            [{'code': 'bad', 'column': 'result', 'has_key': 'data'}],
+            [{'code': 'Bad code', 'column': 'result', 'not_null': True}]]
+        for rules in invalid_rules:
+            with self.assertRaises(ValueError):
+                games.make_data_quality_rules(rules)
+        # Python and PostgreSQL agree on the values a portable pattern matches
+        rule = games.make_data_quality_rules([{'code': 'digit', 'column': 'column',
+            'regex': '^[0-4]$'}])[0]
+        for value in ['4', '4\n', '44', '\n4']:
+            self.cursor.execute(f"SELECT {rule.condition_sql(self.cursor)} "
+                "FROM (SELECT %s AS \"column\") AS rows;", (value,))
+            self.assertEqual(self.cursor.fetchone()[0], rule.passes([value]), value)
+        with self.assertRaises(ValueError):
+            players.make_data_quality_rules([{'code': 'two_players', 'column': 'player_id',
+                'distinct_count': {'max': 2}}])
+
+        self.assertFalse(games.load_data('http://localhost:1/game_data.csv',
+            './rules_game_data.csv', False, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True,
+            games.GameLoadOptions(data_quality_rules=invalid_rules[0])))
+        self.assertFalse(players.load_data('http://localhost:1/users',
+            config['database_server'], config['database_server_port'], config['database'],
+            config['database_user'], config['database_password'], True,
+            players.PlayerLoadOptions(data_quality_rules=invalid_rules[0])))
+
+
+class AllDataLoadTests(unittest.TestCase):
+
+    game_server: http.server.ThreadingHTTPServer
+    player_server: http.server.ThreadingHTTPServer
+    config: dict
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+        cls.game_server = start_test_http_server()
+        cls.player_server = start_player_http_server(page_size=2)
+        cls.config = dict(config, stream_game_data=True,
+            game_data_csv_location=f'http://localhost:{cls.game_server.server_port}/'
+                'test_game_data.csv',
+            player_data_location=f'http://localhost:{cls.player_server.server_port}/users')
+
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.game_server, cls.player_server):
+            server.shutdown()
+            server.server_close()
+        empty_all_tables()
+
+
+    def setUp(self):
+        empty_all_tables()
+
+
+    def test_load_all_data(self):
+        published = load_all_data.load_data(self.config, './all_game_data.csv')
+
+        self.assertEqual({'game': True, 'player': True}, published)
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([8], fetch_column('SELECT COUNT(*) FROM prepared.player_info;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+
+
+    def test_load_all_data_isolates_pipeline_errors(self):
+        failing_config = dict(self.config, game_data_csv_location=
+            f'http://localhost:{self.game_server.server_port}/missing_game_data.csv')
+        published = load_all_data.load_data(failing_config, './all_game_data.csv')
+
+        self.assertEqual({'game': False, 'player': True}, published)
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([8], fetch_column('SELECT COUNT(*) FROM prepared.player_info;'))
+
+
+class ShadowPublishTests(unittest.TestCase):
+
+    game_server: http.server.ThreadingHTTPServer
+    player_server: http.server.ThreadingHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        cls.game_server = start_test_http_server()
+        cls.player_server = start_player_http_server(page_size=2)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.game_server, cls.player_server):
+            server.shutdown()
+            server.server_close()
+        empty_all_tables()
+
+
+    def setUp(self):
+        empty_all_tables()
+        self.all_pages = self.player_server.RequestHandlerClass.pages
+
+
+    def tearDown(self):
+        self.player_server.RequestHandlerClass.pages = self.all_pages
+
+
+    def load_games(self, retained_generations: int = 2) -> bool:
+        return games.load_data(
+            f'http://localhost:{self.game_server.server_port}/test_game_data.csv',
+            './shadow_game_data.csv', False, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True,
+            games.GameLoadOptions(stream_data=True, shadow_publish=True,
+            retained_generations=retained_generations))
+
+
+    def load_players(self, connection=None) -> bool:
+        return players.load_data(f'http://localhost:{self.player_server.server_port}/users',
+            config['database_server'], config['database_server_port'], config['database'],
+            config['database_user'], config['database_password'], True,
+            players.PlayerLoadOptions(shadow_publish=True), connection=connection)
+
+
+    def test_shadow_publish_game_data(self):
+        self.assertTrue(self.load_games())
+        self.assertTrue(self.load_games())
+
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM prepared.game_fingerprint;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(DISTINCT game_id) '
+            'FROM reporting.player_game;'))
+        self.assertEqual(fetch_column('SELECT COUNT(DISTINCT player_id) FROM prepared.game_data;'),
+            fetch_column('SELECT COUNT(*) FROM reporting.player_game_stats;'))
+        self.assertEqual(['game_summary_pkey', 'ix_game_summary_initial_column',
+            'ix_game_summary_loser', 'ix_game_summary_result', 'ix_game_summary_winner'],
+            fetch_column("SELECT indexname FROM pg_indexes WHERE schemaname = 'prepared' "
+            "AND tablename = 'game_summary' ORDER BY indexname;"))
+        self.assertEqual([], fetch_column("SELECT table_name FROM information_schema.tables "
+            "WHERE table_schema = 'shadow';"))
+        self.assertEqual(['prepared.game_data', 'prepared.game_fingerprint',
+            'prepared.game_summary', 'prepared.packed_game', 'prepared.player_game_stats'] * 2,
+            fetch_column('SELECT table_name FROM generation.retired_table '
+            'ORDER BY generation, table_name;'))
+
+        # Only the most recent generation of each table is kept
+        self.assertTrue(self.load_games(retained_generations=1))
+        self.assertEqual([5], fetch_column('SELECT COUNT(*) FROM generation.retired_table;'))
+        self.assertEqual([5], fetch_column("SELECT COUNT(*) FROM information_schema.tables "
+            "WHERE table_schema = 'generation' "
+            "AND table_name NOT IN ('retired_table', 'load_generation');"))
+
+
+    def test_shadow_publish_does_not_block_readers(self):
+        self.assertTrue(self.load_players())
+        self.player_server.RequestHandlerClass.pages = self.all_pages[:1]
+
+        connection = utils.make_db_connection_from_config(config)
+        reader = utils.make_db_connection_from_config(config)
+        reader.autocommit = True
+
+        try:
+            self.assertTrue(self.load_players(connection))
+
+            # The load is not published yet and holds no lock readers wait on
+            cursor = reader.cursor()
+            cursor.execute("SET lock_timeout = '1s';")
+            cursor.execute('SELECT COUNT(*) FROM reporting.player_details;')
+            self.assertEqual(8, cursor.fetchone()[0])
+
+            cursor = connection.cursor()
+            generation = shadow_tables.swap_shadow_tables(cursor, 2)
+            connection.commit()
+
+        finally:
+            connection.close()
+            reader.close()
+
+        self.assertIsNotNone(generation)
+        self.assertEqual([1], fetch_column('SELECT COUNT(*) FROM reporting.player_details;'))
+
+
+    def test_rollback_generation(self):
+        self.assertTrue(self.load_players())
+        self.player_server.RequestHandlerClass.pages = self.all_pages[:1]
+        self.assertTrue(self.load_players())
+        self.assertEqual([1], fetch_column('SELECT COUNT(*) FROM reporting.player_details;'))
+
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            restored = shadow_tables.rollback_generation(cursor,
+                shadow_tables.latest_generation(cursor))
+            cursor.close()
+            connection.commit()
+
+        finally:
+            connection.close()
+
+        self.assertEqual(['prepared.player_info'], restored)
+        self.assertEqual([8], fetch_column('SELECT COUNT(*) FROM reporting.player_details;'))
+        self.assertEqual(['ix_player_info_email_address', 'ix_player_info_nationality',
+            'ix_player_info_player_id'],
+            fetch_column("SELECT indexname FROM pg_indexes WHERE schemaname = 'prepared' "
+            "AND tablename = 'player_info' ORDER BY indexname;"))
+        self.assertEqual([], fetch_column("SELECT table_name FROM information_schema.tables "
+            "WHERE table_schema = 'shadow';"))
+
+
+class PartitionedGameTests(unittest.TestCase):
+
+    game_server: http.server.ThreadingHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        cls.game_server = start_test_http_server()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.game_server.shutdown()
+        cls.game_server.server_close()
+
+
+    def setUp(self):
+        empty_all_tables()
+
+
+    def tearDown(self):
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            games.partition_game_tables(cursor, 0)
+            cursor.close()
+            connection.commit()
+
+        finally:
+            connection.close()
+        empty_all_tables()
+
+
+    def load_games(self, partition_count: int, **options) -> bool:
+        return games.load_data(
+            f'http://localhost:{self.game_server.server_port}/test_game_data.csv',
+            './partitioned_game_data.csv', False, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True,
+            games.GameLoadOptions(stream_data=True, partition_count=partition_count, **options))
+
+
+    def game_tables(self) -> list:
+        # Rejected rows are added to error.game_data by every load
+        return [fetch_column(f'SELECT DISTINCT ROW({columns})::text FROM {table} t ORDER BY 1;')
+            for columns, table in (('game_id, player_id, move_number, "column", result',
+            'prepared.game_data'), ('t.*', 'reporting.game_summary'),
+            ('t.*', 'reporting.packed_game'), ('t.*', 'reporting.player_game_stats'),
+            ('game_id, player_id, move_number, "column", result, rejection_reason',
+            'error.game_data'))]
+
+
+    def partition_counts(self) -> list:
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            counts = [len(partitions.table_partitions(cursor, table))
+                for table in games.partitioned_tables]
+            cursor.close()
+            connection.rollback()
+
+        finally:
+            connection.close()
+        return counts
+
+
+    def test_partitioned_load(self):
+        self.assertTrue(self.load_games(0))
+        expected_tables = self.game_tables()
+
+        self.assertTrue(self.load_games(4))
+        self.assertEqual([4] * len(games.partitioned_tables), self.partition_counts())
+        self.assertEqual(expected_tables, self.game_tables())
+        # The load plans partition-wise in its own transaction, not for the database
+        self.assertEqual(['off'], fetch_column('SHOW enable_partitionwise_join;'))
+        self.assertLess(0, fetch_column("SELECT COUNT(*) FROM prepared.game_summary_p1;")[0])
+
+        # Loads into the partitions, incremental loads included, match unpartitioned loads
+        self.assertTrue(self.load_games(4))
+        self.assertTrue(self.load_games(4, incremental=True))
+        self.assertEqual(expected_tables, self.game_tables())
+
+        self.assertTrue(self.load_games(0))
+        self.assertEqual([0] * len(games.partitioned_tables), self.partition_counts())
+        self.assertEqual(expected_tables, self.game_tables())
+
+
+    def test_partitioned_shadow_publish_and_bulk_load(self):
+        self.assertTrue(self.load_games(0))
+        expected_tables = self.game_tables()
+
+        for _ in range(2):
+            self.assertTrue(self.load_games(2, shadow_publish=True))
+        self.assertEqual([2] * len(games.partitioned_tables), self.partition_counts())
+        self.assertEqual(expected_tables, self.game_tables())
+        self.assertEqual([], fetch_column("SELECT table_name FROM information_schema.tables "
+            "WHERE table_schema = 'shadow';"))
+        self.assertEqual(['ix_game_data_game_id', 'ix_game_data_player_id'], fetch_column(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'prepared' "
+            "AND tablename = 'game_data' AND indexname LIKE 'ix_game_data_%_id' "
+            "ORDER BY indexname;"))
+        self.assertEqual([4], fetch_column("SELECT COUNT(*) FROM pg_indexes "
+            "WHERE schemaname = 'prepared' AND tablename = 'game_data_p0';"))
+
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            generation = shadow_tables.latest_generation(cursor)
+            cursor.execute('SELECT retired_table_name FROM generation.retired_table '
+                "WHERE generation = %s AND table_name = 'prepared.game_data';", (generation,))
+            self.assertEqual(2, len(partitions.table_partitions(cursor, cursor.fetchone()[0])))
+            shadow_tables.rollback_generation(cursor, generation)
+            cursor.close()
+            connection.commit()
+
+        finally:
+            connection.close()
+        self.assertEqual(expected_tables, self.game_tables())
+        self.assertEqual([4], fetch_column("SELECT COUNT(*) FROM pg_indexes "
+            "WHERE schemaname = 'prepared' AND tablename = 'game_data_p0';"))
+
+        self.assertTrue(self.load_games(2, bulk_load=True))
+        self.assertEqual(expected_tables, self.game_tables())
+        self.assertEqual([4], fetch_column("SELECT COUNT(*) FROM pg_indexes "
+            "WHERE schemaname = 'prepared' AND tablename = 'game_data_p1';"))
+
+
+class ChunkedLoadTests(unittest.TestCase):
+
+    game_server: http.server.ThreadingHTTPServer
+    player_server: http.server.ThreadingHTTPServer
+
+    @classmethod
+    def setUpClass(cls):
+        cls.game_server = start_test_http_server()
+        cls.player_server = start_player_http_server(page_size=2)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.game_server, cls.player_server):
+            server.shutdown()
+            server.server_close()
+        empty_all_tables()
+
+
+    def setUp(self):
+        empty_all_tables()
+
+
+    def tearDown(self):
+        self.player_server.RequestHandlerClass.missing_pages = set()
+
+
+    def load_games(self, url: str, local_csv_path: str) -> bool:
+        return games.load_data(url, local_csv_path, False, config['database_server'],
+            config['database_server_port'], config['database'], config['database_user'],
+            config['database_password'], True,
+            games.GameLoadOptions(chunk_rows=10))
+
+
+    def load_players(self) -> bool:
+        return players.load_data(f'http://localhost:{self.player_server.server_port}/users',
+            config['database_server'], config['database_server_port'], config['database'],
+            config['database_user'], config['database_password'], True,
+            players.PlayerLoadOptions(download_workers=2, chunk_pages=2))
+
+
+    def test_chunked_game_load(self):
+        url = f'http://localhost:{self.game_server.server_port}/test_game_data.csv'
+        self.assertTrue(self.load_games(url, './chunked_game_data.csv'))
+
+        self.assertFalse(os.path.exists('./chunked_game_data.csv'))
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([14], fetch_column('SELECT COUNT(*) FROM reporting.game_summary;'))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM stage.game_data;'))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM stage.load_checkpoint;'))
+
+
+    def test_resume_chunked_game_load(self):
+        # The source is gone, so the load only succeeds if it resumes from the kept file
+        url = f'http://localhost:{self.game_server.server_port}/missing_game_data.csv'
+        local_csv_path = './chunked_game_data.csv'
+        with open(games_test_data, 'rb') as f:
+            lines = f.readlines()
+        with open(local_csv_path, 'wb') as f:
+            f.writelines(lines)
+
+        # Stage the first 50 rows as a load interrupted after five chunks would have
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(games.copy_game_data_sql, io.BytesIO(b''.join(lines[1:51])))
+            checkpoints.save_checkpoint(cursor, f'game {url}', sum(map(len, lines[:51])),
+                checkpoints.file_version(local_csv_path))
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+
+        self.assertTrue(self.load_games(url, local_csv_path))
+        self.assertFalse(os.path.exists(local_csv_path))
+        self.assertEqual([124], fetch_column('SELECT COUNT(*) FROM prepared.game_data;'))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM stage.load_checkpoint;'))
+
+
+    def test_resume_chunked_player_load(self):
+        handler = self.player_server.RequestHandlerClass
+        handler.missing_pages = {3}
+        self.assertFalse(self.load_players())
+
+        # The first chunk was committed before the missing page stopped the load
+        self.assertEqual([2], fetch_column("SELECT position FROM stage.load_checkpoint;"))
+        self.assertEqual([2], fetch_column('SELECT COUNT(*) FROM stage.player_blobs;'))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM prepared.player_info;'))
+
+        handler.missing_pages = set()
+        handler.request_counts.clear()
+        self.assertTrue(self.load_players())
+
+        # Only the first page is fetched again, to check the data did not change
+        self.assertEqual({0: 1}, {page: count for page, count in handler.request_counts.items()
+            if page < 2})
+        self.assertEqual([8], fetch_column('SELECT COUNT(*) FROM prepared.player_info;'))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM stage.load_checkpoint;'))
+
+
+    def test_changed_player_data_restarts_chunked_load(self):
+        handler = self.player_server.RequestHandlerClass
+        handler.missing_pages = {3}
+        self.assertFalse(self.load_players())
+        self.assertEqual([2], fetch_column('SELECT COUNT(*) FROM stage.player_blobs;'))
+
+        # The data changes before the retry, which must not keep the staged pages
+        served_pages = handler.pages
+        handler.pages = [[dict(player, id=player['id'] + 1000) for player in page]
+            for page in served_pages]
+        handler.missing_pages = set()
+        handler.request_counts.clear()
+        try:
+            self.assertTrue(self.load_players())
+        finally:
+            handler.pages = served_pages
+
+        self.assertEqual(2, handler.request_counts[0])
+        self.assertEqual([8], fetch_column('SELECT COUNT(*) FROM prepared.player_info;'))
+        self.assertEqual([0], fetch_column('SELECT COUNT(*) FROM prepared.player_info '
+            'WHERE player_id::int < 1000;'))
+
+
+class MetricsTests(unittest.TestCase):
+
+    metrics_file = './test_metrics.jsonl'
+    prometheus_file = './test_metrics.prom'
+
+    def setUp(self):
+        empty_all_tables()
+        logger.configure_metrics(self.metrics_file, self.prometheus_file)
+
+
+    def tearDown(self):
+        logger.configure_metrics(None, None)
+        for path in (self.metrics_file, self.prometheus_file):
+            if os.path.exists(path):
+                os.remove(path)
+        empty_all_tables()
+
+
+    def read_spans(self) -> list:
+        with open(self.metrics_file, 'r') as f:
+            return [json.loads(line) for line in f]
+
+
+    def test_span(self):
+        log = logger.Log(test_log_file)
+        with log.span('test_stage', shard='1') as span:
+            span.rows = 50
+
+        with self.assertRaises(ValueError):
+            with log.span('test_failing_stage'):
+                raise ValueError('Stage failed')
+
+        log.export_metrics()
+        spans = self.read_spans()
+        self.assertEqual(['test_stage', 'test_failing_stage'], [s['span'] for s in spans])
+        self.assertEqual({'shard': '1'}, spans[0]['labels'])
+        self.assertEqual(50, spans[0]['rows'])
+        self.assertFalse(spans[0]['failed'])
+        self.assertTrue(spans[1]['failed'])
+
+        with open(self.prometheus_file, 'r') as f:
+            prometheus_lines = f.read().splitlines()
+        self.assertIn('drop_token_stage_rows{stage="test_stage",shard="1"} 50', prometheus_lines)
+        self.assertIn('drop_token_stage_failed{stage="test_failing_stage"} 1', prometheus_lines)
+
+
+    def test_load_data_records_stage_spans(self):
+        with open(games_test_data, 'r') as f:
+            row_count = len(f.read().splitlines()) - 1
+
+        server = start_test_http_server()
+
+        try:
+            games.load_data(f'http://localhost:{server.server_port}/test_game_data.csv',
+                './streamed_game_data.csv', False, config['database_server'],
+                config['database_server_port'], config['database'], config['database_user'],
+                config['database_password'], True,
+                games.GameLoadOptions(stream_data=True))
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        spans = {s['span']: s for s in self.read_spans()}
+        self.assertEqual(row_count, spans['game_copy_stage']['rows'])
+        self.assertEqual(124, spans['game_check_data_quality']['rows'])
+        self.assertEqual(row_count, spans['game_move_checked_data']['rows'])
+        self.assertEqual(14, spans['game_refresh_summary']['rows'])
+        self.assertIn('game_commit', spans)
+
+
+class QueryProfilerTests(unittest.TestCase):
+
+    plans_file = './test_query_plans.jsonl'
+
+    def setUp(self):
+        empty_all_tables()
+        query_profiler.configure_profiling(self.plans_file, 0)
+
+
+    def tearDown(self):
+        query_profiler.configure_profiling(None)
+        if os.path.exists(self.plans_file):
+            os.remove(self.plans_file)
+        empty_all_tables()
+
+
+    def read_plans(self) -> list:
+        with open(self.plans_file, 'r') as f:
+            return [json.loads(line) for line in f]
+
+
+    def test_split_statements(self):
+        sql = "DROP TABLE IF EXISTS a; CREATE TABLE a AS SELECT string_agg(b, ';') " \
+            "FROM (VALUES ('it''s;')) AS t(b); -- A comment; \nSELECT 1;"
+        self.assertEqual(['DROP TABLE IF EXISTS a',
+            "CREATE TABLE a AS SELECT string_agg(b, ';') FROM (VALUES ('it''s;')) AS t(b)",
+            '-- A comment; \nSELECT 1'], query_profiler.split_statements(sql))
+        self.assertEqual(['DO $$ BEGIN PERFORM 1; END $$', "SELECT $tag$it's;$$;$tag$", 'SELECT 2'],
+            query_profiler.split_statements("DO $$ BEGIN PERFORM 1; END $$; "
+            "SELECT $tag$it's;$$;$tag$; SELECT 2"))
+        self.assertTrue(query_profiler.is_explainable(
+            'CREATE TEMPORARY TABLE a ON COMMIT DROP AS\nSELECT 1'))
+        self.assertFalse(query_profiler.is_explainable('CREATE TEMPORARY VIEW a AS SELECT 1'))
+
+
+    def test_profiling_does_not_repeat_statements(self):
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute('CREATE TEMPORARY SEQUENCE profiled_seq; '
+                'CREATE TEMPORARY TABLE profiled (a int); INSERT INTO profiled VALUES (1);')
+            cursor.execute("SELECT nextval('profiled_seq');")
+            self.assertEqual((1,), cursor.fetchone())
+            cursor.execute('SELECT COUNT(*) FROM profiled;')
+            self.assertEqual((1,), cursor.fetchone())
+            cursor.close()
+            connection.rollback()
+
+        finally:
+            connection.close()
+
+        # The insert into the table whose creation was skipped is logged, not profiled
+        self.assertNotIn('INSERT INTO profiled VALUES (1)',
+            [plan['statement'] for plan in self.read_plans()])
+        with open(logger.default_log_file, 'r') as f:
+            self.assertIn('could not be profiled', f.read().splitlines()[-1])
+
+
+    def test_profile_pipeline_statements(self):
+        log = logger.Log(test_log_file)
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            games.load_staging_table(games_test_data, cursor)
+            games.check_and_mark_data_quality(cursor, log)
+            games.stage_game_fingerprints(cursor)
+            games.move_checked_data(cursor, False)
+            cursor.close()
+            connection.commit()
+
+        finally:
+            connection.close()
+
+        # Profiling runs statements in a savepoint, so the load is unchanged
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19], game_ids)
+        self.assertEqual([44], fetch_column('SELECT COUNT(*) FROM error.game_data;'))
+
+        plans = self.read_plans()
+        statements = [plan['statement'] for plan in plans]
+        self.assertTrue(any('UPDATE stage.game_data' in s for s in statements))
+        self.assertTrue(any(s.startswith('CREATE TEMPORARY TABLE staged_game_fingerprint')
+            for s in statements))
+        self.assertTrue(any(s.startswith('INSERT INTO prepared.game_data') for s in statements))
+        self.assertTrue(all('execution_ms' in plan and 'plan' in plan for plan in plans))
+        self.assertIn('Seq Scan on stage.game_data', ' '.join(sum([plan['issues']
+            for plan in plans], [])))
+
+
+    def test_profile_reporting_views(self):
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            records = query_profiler.profile_reporting_views(connection)
+
+        finally:
+            connection.close()
+
+        self.assertIn('SELECT * FROM reporting.game_summary',
+            [record['statement'] for record in records])
+        self.assertEqual(len(records), len(self.read_plans()))
+
+
+class OfflineAnalyticsTests(unittest.TestCase):
+
+    synthetic_game_data = './offline_game_data.csv'
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.synthetic_game_data):
+            os.remove(cls.synthetic_game_data)
+        empty_all_tables()
+
+
+    def load(self, games_csv_path: str, player_pages: list, validate_game_rules: bool,
+        game_rules=None, player_rules=None) -> None:
+        log = logger.Log(test_log_file)
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            utils.empty_all_tables(cursor)
+            games.load_staging_table(games_csv_path, cursor)
+            games.check_and_mark_data_quality(cursor, log, rules=game_rules)
+            if validate_game_rules:
+                games.check_game_rules(cursor, log)
+            games.move_checked_data(cursor, False)
+            games.refresh_game_summary(cursor, False)
+            games.refresh_player_stats(cursor, False)
+
+            players.insert_player_blobs(cursor, player_pages)
+            players.debatch_blob(cursor)
+            players.check_and_mark_data_quality(cursor, log, rules=player_rules)
+            players.move_checked_data(cursor, False)
+            cursor.close()
+            connection.commit()
+
+        finally:
+            connection.close()
+
+
+    def assert_matches_views(self, games_csv_path: str, player_pages: list,
+        validate_game_rules: bool = False, game_rules=None, player_rules=None) -> None:
+        self.load(games_csv_path, player_pages, validate_game_rules, game_rules, player_rules)
+        analyses = offline_analytics.analyze(
+            offline_analytics.read_game_data(games_csv_path, validate_game_rules,
+            rules=game_rules), offline_analytics.read_player_pages(player_pages, player_rules))
+
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT * FROM reporting.winning_initial_column '
+                'ORDER BY initial_column_game_count DESC, initial_column;')
+            self.assertEqual(cursor.fetchall(), analyses['winning_initial_column'])
+            cursor.execute('SELECT * FROM reporting.nationality_participation;')
+            self.assertEqual(cursor.fetchall(), analyses['nationality_participation'])
+            cursor.execute('SELECT * FROM reporting.single_game_player '
+                'ORDER BY player_id, game_id;')
+            self.assertEqual(cursor.fetchall(), analyses['single_game_player'])
+            cursor.close()
+
+        finally:
+            connection.close()
+
+
+    def test_test_data_matches_views(self):
+        with open('./TestData/test_player_blob_data.json', 'rb') as f:
+            player_pages = [f.read()]
+
+        self.assert_matches_views(games_test_data, player_pages)
+        self.assert_matches_views(games_test_data, player_pages, validate_game_rules=True)
+
+
+    def test_synthetic_data_matches_views(self):
+        synthetic_data.write_game_csv(self.synthetic_game_data, 5000, player_count=150,
+            invalid_rate=0.01, seed=3)
+        player_pages = [json.dumps(synthetic_data.player_page(page, 40, 160, 0.1, seed=3))
+            .encode() for page in range(4)]
+
+        analyses = offline_analytics.analyze(
+            offline_analytics.read_game_data(self.synthetic_game_data),
+            offline_analytics.read_player_pages(player_pages))
+        self.assertTrue(all(analyses.values()))
+        self.assert_matches_views(self.synthetic_game_data, player_pages)
+
+
+    def test_custom_rules_match_views(self):
+        with open('./TestData/test_player_blob_data.json', 'rb') as f:
+            player_pages = [f.read()]
+        game_rules = games.make_data_quality_rules(quality_rules.default_game_rules[:3] + [
+            {'code': 'column_out_of_range', 'column': 'column', 'range': {'min': 1, 'max': 3}},
+            {'code': 'invalid_result', 'column': 'result', 'enum': ['', 'win', 'draw']},
+            {'code': 'not_two_players', 'column': 'player_id',
+                'distinct_count': {'min': 2, 'max': 2}},
+        ])
+        player_rules = players.make_data_quality_rules([
+            {'code': 'missing_data', 'column': 'details', 'has_key': 'data'},
+            {'code': 'missing_nationality', 'column': 'details', 'field': 'data.nat',
+                'not_null': True},
+            {'code': 'player_id_out_of_range', 'column': 'player_id', 'regex': '^10[1-5]$'},
+        ])
+
+        self.assert_matches_views(games_test_data, player_pages, game_rules=game_rules,
+            player_rules=player_rules)
+        with self.assertRaises(ValueError):
+            offline_analytics.read_player_pages(player_pages, players.make_data_quality_rules(
+                [{'code': 'details_text', 'column': 'details', 'regex': 'data'}]))
+
+
+class SyntheticDataTests(unittest.TestCase):
+
+    synthetic_game_data = './synthetic_game_data.csv'
+
+    def tearDown(self):
+        if os.path.exists(self.synthetic_game_data):
+            os.remove(self.synthetic_game_data)
+
+
+    def test_write_game_csv(self):
+        counts = synthetic_data.write_game_csv(self.synthetic_game_data, 5000,
+            player_count=50, invalid_rate=0.02, batch_games=100)
+
+        with open(self.synthetic_game_data, 'rb') as f:
+            next(f)
+            rows = [line.split(b',') for line in f.read().splitlines()]
+        game_rows = [list(game) for _, game in itertools.groupby(rows, key=lambda row: row[0])]
+        invalid_games = [game for game in game_rows if not validate_game_data.is_valid_game(game)]
+        valid_games = [game for game in game_rows if validate_game_data.is_valid_game(game)]
+
+        self.assertEqual(counts['rows'], len(rows))
+        self.assertLess(counts['rows'] - 5000, game_replay.max_moves)
+        self.assertEqual(counts['games'], len(game_rows))
+        self.assertEqual(counts['invalid_games'], len(invalid_games))
+        self.assertEqual(counts['rejected_rows'], sum(len(game) for game in invalid_games))
+        self.assertEqual([''] * len(valid_games), game_replay.check_games(valid_games))
+
+
+    def test_player_page(self):
+        page = synthetic_data.player_page(1, 10, 25, invalid_rate=0.5)
+
+        self.assertEqual(list(range(10, 20)), [player['id'] for player in page])
+        self.assertEqual(page, synthetic_data.player_page(1, 10, 25, invalid_rate=0.5))
+        self.assertEqual(5, len(synthetic_data.player_page(2, 10, 25)))
+        self.assertEqual([], synthetic_data.player_page(3, 10, 25))
+
+
+class IncrementalGameLoadTests(unittest.TestCase):
+
+    modified_game_data = './modified_game_data.csv'
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+
+        with open(games_test_data, 'r') as f:
+            lines = f.read().splitlines(keepends=False)
+
+        # Change game 5, remove game 6, and add game 20
+        lines = [line.replace('5,101,9,3,win', '5,101,9,4,win') for line in lines
+            if not line.startswith('6,')]
+        lines += [line.replace('19,', '20,', 1) for line in lines if line.startswith('19,')]
+
+        with open(cls.modified_game_data, 'w') as f:
+            f.write('\n'.join(lines))
+
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.modified_game_data)
+        empty_all_tables()
+
+
+    def load_incremental(self, csv_path: str) -> dict:
+        log = logger.Log(test_log_file)
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            games.load_staging_table(csv_path, cursor)
+            games.check_and_mark_data_quality(cursor, log)
+            games.stage_game_fingerprints(cursor)
+            changes = games.move_changed_data(cursor, False, log)
+            games.refresh_game_summary(cursor, True)
+            games.refresh_player_stats(cursor, True)
+            games.refresh_packed_games(cursor, True)
+            cursor.close()
+            connection.commit()
+
+        finally:
+            if connection:
+                connection.close()
+
+        return changes
+
+
+    def test_incremental_game_load(self):
+        changes = self.load_incremental(games_test_data)
+        self.assertEqual({'added': 14, 'changed': 0, 'removed': 0, 'unchanged': 0}, changes)
+
+        changes = self.load_incremental(games_test_data)
+        self.assertEqual({'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 14}, changes)
+
+        changes = self.load_incremental(self.modified_game_data)
+        self.assertEqual({'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 12}, changes)
+
+        game_ids = fetch_column('SELECT DISTINCT(game_id)::int FROM prepared.game_data '
+            'ORDER BY game_id::int;')
+        self.assertEqual([5, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 19, 20], game_ids)
+        self.assertEqual([4], fetch_column("SELECT \"column\" FROM prepared.game_data "
+            "WHERE game_id = '5' AND move_number = 9;"))
+        self.assertEqual([9], fetch_column("SELECT COUNT(*) FROM prepared.game_data "
+            "WHERE game_id = '5';"))
+        self.assertEqual(game_ids, fetch_column('SELECT game_id::int FROM '
+            'prepared.game_fingerprint ORDER BY game_id::int;'))
+        self.assertEqual([4], fetch_column("SELECT concluding_column FROM "
+            "reporting.game_summary WHERE game_id = '5';"))
+        self.assertEqual([], fetch_column("SELECT game_id FROM reporting.game_summary "
+            "WHERE game_id = '6';"))
+        self.assertEqual(['20'], fetch_column("SELECT game_id FROM reporting.game_summary "
+            "WHERE game_id = '20';"))
+
+        # The stats rebuilt for the players of the changed games match a full rebuild
+        stats_sql = 'SELECT ps::text FROM prepared.player_game_stats ps ORDER BY player_id;'
+        packed_sql = 'SELECT pg::text FROM reporting.packed_game pg ORDER BY game_id;'
+        incremental_stats = fetch_column(stats_sql)
+        incremental_packed = fetch_column(packed_sql)
+        connection = utils.make_db_connection_from_config(config)
+        try:
+            cursor = connection.cursor()
+            games.refresh_player_stats(cursor, False)
+            cursor.execute(stats_sql)
+            self.assertEqual([r[0] for r in cursor.fetchall()], incremental_stats)
+            games.refresh_packed_games(cursor, False)
+            cursor.execute(packed_sql)
+            self.assertEqual([r[0] for r in cursor.fetchall()], incremental_packed)
+            cursor.close()
+            connection.rollback()
+
+        finally:
+            connection.close()
+
+
+class IncrementalPlayerLoadTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        empty_all_tables()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        empty_all_tables()
+
+
+    def load_incremental(self, players_data: list) -> dict:
+        log = logger.Log(test_log_file)
+        connection = utils.make_db_connection_from_config(config)
+
+        try:
+            cursor = connection.cursor()
+            players.insert_player_blob(cursor, json.dumps(players_data))
+            players.debatch_blob(cursor)
+            players.check_and_mark_data_quality(cursor, log)
+            changes = players.upsert_checked_data(cursor, False, True, log)
+            cursor.close()
+            connection.commit()
+
+        finally:
+            if connection:
+                connection.close()
+
+        return changes
+
+
+    def test_incremental_player_load(self):
+        with open('./TestData/test_player_blob_data.json', 'r') as f:
+            players_data = json.load(f)
+
+        changes = self.load_incremental(players_data)
+        self.assertEqual({'added': 8, 'changed': 0, 'removed': 0, 'unchanged': 0}, changes)
+
+        changes = self.load_incremental(players_data)
+        self.assertEqual({'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 8}, changes)
+
+        # Change player 101, remove player 102, and add player 109
+        modified_data = [p for p in players_data if p['id'] != 102]
+        for player in modified_data:
+            if player['id'] == 101:
+                player['data']['email'] = 'changed@example.com'
+        modified_data.append(dict(modified_data[-1], id=109))
+
+        changes = self.load_incremental(modified_data)
+        self.assertEqual({'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 6}, changes)
+
+        player_ids = fetch_column('SELECT player_id::int FROM prepared.player_info '
+            'ORDER BY player_id::int;')
+        self.assertEqual([101, 103, 104, 105, 106, 107, 108, 109], player_ids)
+        self.assertEqual(['changed@example.com'], fetch_column("SELECT email_address "
+            "FROM reporting.player_details WHERE player_id = '101';"))
+
+
+class ReadAPITests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Tests.setUpClass()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        empty_all_tables()
+
+
+    def setUp(self):
+        self.server = read_api.make_read_api_server(
+            dict(config, read_api_generation_poll_seconds=0), 0, logger.Log(test_log_file))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.cache.connection_pool.closeall()
+
+
+    def get(self, path: str) -> dict:
+        with urllib.request.urlopen(f'http://localhost:{self.server.server_port}{path}') as response:
+            return json.load(response)
+
+
+    def get_status(self, path: str) -> int:
+        try:
+            with urllib.request.urlopen(f'http://localhost:{self.server.server_port}{path}'):
+                return 200
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+    def test_analyses_are_cached(self):
+        first = self.get('/winning_initial_column')
+        second = self.get('/winning_initial_column')
+        self.assertEqual(first, second)
+        self.assertEqual(fetch_column('SELECT initial_column FROM reporting.winning_initial_column;'),
+            [row['initial_column'] for row in first['rows']])
+        self.assertIsInstance(first['rows'][0]['percent_of_total'], float)
+
+        nationalities = self.get('/nationality_participation')['rows']
+        self.assertEqual(fetch_column('SELECT nationality FROM reporting.nationality_participation;'),
+            [row['nationality'] for row in nationalities])
+
+        self.assertEqual({'winning_initial_column': 1}, dict(self.server.cache.hits))
+        self.assertEqual({'winning_initial_column': 1, 'nationality_participation': 1},
+            dict(self.server.cache.misses))
+
+
+    def test_single_game_player_pages(self):
+        player_ids = fetch_column('SELECT player_id FROM reporting.single_game_player '
+            'ORDER BY player_id, game_id;')
+        rows = []
+        for page in itertools.count(1):
+            result = self.get(f'/single_game_player?page={page}&page_size=2')
+            self.assertEqual(len(player_ids), result['total'])
+            if not result['rows']:
+                break
+            rows.extend(result['rows'])
+
+        self.assertEqual(player_ids, [row['player_id'] for row in rows])
+        self.assertEqual(page, self.server.cache.misses['single_game_player'])
+        self.assertEqual(rows[:2], self.get('/single_game_player?page=1&page_size=2')['rows'])
+        self.assertEqual(1, self.server.cache.hits['single_game_player'])
+        self.assertEqual(400, self.get_status('/single_game_player?page=0'))
+        self.assertEqual(400, self.get_status('/single_game_player?page_size=x'))
+
+
+    def test_player_lookup(self):
+        player_id = fetch_column('SELECT player_id FROM reporting.player_game ORDER BY player_id;')[0]
+        player = self.get(f'/players/{player_id}')
+        self.assertEqual(player_id, player['player_id'])
+        self.assertEqual(fetch_column('SELECT game_id FROM reporting.player_game '
+            f"WHERE player_id = '{player_id}' ORDER BY game_id;"),
+            [game['game_id'] for game in player['games']])
+        self.assertEqual(404, self.get_status('/players/no_such_player'))
+        self.assertEqual(404, self.get_status('/no_such_endpoint'))
+
+
+    def test_concurrent_misses_wait_for_connections(self):
+        player_ids = fetch_column('SELECT DISTINCT player_id FROM reporting.player_game;')
+        paths = [f'/players/{player_id}' for player_id in player_ids] \
+            + [f'/players/missing_{number}' for number in range(30)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            statuses = list(executor.map(self.get_status, paths))
+
+        self.assertEqual([200] * len(player_ids) + [404] * 30, statuses)
+        self.assertEqual(len(paths), self.server.cache.misses['players'])
+
+
+    def test_publish_invalidates_cache(self):
+        generation = self.get('/nationality_participation')['generation']
+        self.get('/nationality_participation')
+        self.assertEqual(1, self.server.cache.hits['nationality_participation'])
+
+        server = start_test_http_server()
+        try:
+            self.assertTrue(games.load_data(
+                f'http://localhost:{server.server_port}/test_game_data.csv',
+                './read_api_game_data.csv', False, config['database_server'],
+                config['database_server_port'], config['database'], config['database_user'],
+                config['database_password'], True,
+                games.GameLoadOptions(stream_data=True)))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        result = self.get('/nationality_participation')
+        self.assertEqual(generation + 1, result['generation'])
+        self.assertEqual(2, self.server.cache.misses['nationality_participation'])
+        self.assertEqual(1, self.server.cache.hits['nationality_participation'])
+
+
+    def test_metrics(self):
+        self.get('/winning_initial_column')
+        self.get('/winning_initial_column')
+        with urllib.request.urlopen(f'http://localhost:{self.server.server_port}/metrics') as response:
+            lines = response.read().decode('utf-8').splitlines()
+
+        self.assertIn('drop_token_read_api_cache_hits_total{endpoint="winning_initial_column"} 1', lines)
+        self.assertIn('drop_token_read_api_cache_misses_total{endpoint="winning_initial_column"} 1',
+            lines)
+        self.assertIn('drop_token_read_api_cache_hit_ratio{endpoint="winning_initial_column"} 0.5',
+            lines)
+        for quantile in ('0.5', '0.99'):
+            self.assertTrue(any(line.startswith('drop_token_read_api_latency_seconds'
+                f'{{endpoint="winning_initial_column",quantile="{quantile}"}}') for line in lines))
+        self.assertIn('drop_token_read_api_load_generation '
+            f'{self.server.cache.generation}', lines)
+
+
 if __name__ == '__main__':
     unittest.main()
 
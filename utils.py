@@ -1,12 +1,17 @@
 import psycopg2
+import psycopg2.pool
 import requests
-from typing import Any, Dict
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Optional, Protocol
+from urllib3.util.retry import Retry
 from yaml import load, FullLoader
 
+import query_profiler
+
 def make_db_connection(host: str, port: int, database: str, user: str, password: str) \
     -> psycopg2.extensions.connection:
     return psycopg2.connect(f'host={host} port={port} dbname={database} \
-        user={user} password={password}')
+        user={user} password={password}', cursor_factory=query_profiler.cursor_factory())
 
 
 def make_db_connection_from_config(config: Dict[Any, Any]) -> psycopg2.extensions.connection:
@@ -15,22 +20,99 @@ def make_db_connection_from_config(config: Dict[Any, Any]) -> psycopg2.extension
         config['database_password'])
 
 
+def make_db_connection_pool(host: str, port: int, database: str, user: str, password: str,
+    max_connections: int) -> psycopg2.pool.ThreadedConnectionPool:
+    """
+    Create a pool of up to `max_connections` database connections that
+    threads can share. Connections are opened when first requested.
+    """
+    return psycopg2.pool.ThreadedConnectionPool(0, max_connections,
+        f'host={host} port={port} dbname={database} user={user} password={password}',
+        cursor_factory=query_profiler.cursor_factory())
+
+
+def make_db_connection_pool_from_config(config: Dict[Any, Any],
+    max_connections: int) -> psycopg2.pool.ThreadedConnectionPool:
+    return make_db_connection_pool(config['database_server'],
+        config['database_server_port'], config['database'], config['database_user'],
+        config['database_password'], max_connections)
+
+
 def load_configuration(config_file: str) -> Dict[Any, Any]:
     with open(config_file, 'r') as stream:
         config = load(stream, Loader=FullLoader)
     return config
 
 
-def make_get_request(url: str, raise_for_status: bool = True) -> requests.Response:
-    response = requests.get(url, allow_redirects=True)
+def make_http_session(pool_size: int = 10, retries: int = 3,
+    backoff_factor: float = 0.5) -> requests.Session:
+    """
+    Create a `requests.Session` that keeps up to `pool_size` connections
+    per host open for reuse. Failed connections and 429/5xx responses are
+    retried up to `retries` times, sleeping `backoff_factor` * 2^n seconds
+    between attempts.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def make_get_request(url: str, raise_for_status: bool = True,
+    session: Optional[requests.Session] = None,
+    headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    if session:
+        response = session.get(url, allow_redirects=True, headers=headers)
+    else:
+        response = requests.get(url, allow_redirects=True, headers=headers)
     if raise_for_status:
         response.raise_for_status()
     return response
 
 
+class Readable(Protocol):
+    """
+    A binary file-like object that can be read from, like an open file
+    or a `game_sources.GameSourceReader`.
+    """
+
+    def read(self, __size: int = -1) -> bytes: ...
+
+
+def make_streaming_get_request(url: str, raise_for_status: bool = True,
+    headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    response = requests.get(url, allow_redirects=True, stream=True, headers=headers)
+    if raise_for_status:
+        response.raise_for_status()
+    return response
+
+
+def escape_copy_text(value: bytes) -> bytes:
+    """
+    Escape `value` to be sent as a single field of a COPY in text format.
+    """
+    return value.replace(b'\\', b'\\\\').replace(b'\n', b'\\n') \
+        .replace(b'\r', b'\\r').replace(b'\t', b'\\t')
+
+
 def empty_all_tables(cursor: psycopg2.extensions.cursor) -> None:
-    tables = ['stage.game_data', 'error.game_data', 'prepared.game_data', 'stage.player_blobs',
-    'stage.player_info', 'error.player_info', 'prepared.player_info']
+    tables = ['stage.game_data', 'error.game_data', 'prepared.game_data',
+    'prepared.game_summary', 'prepared.game_fingerprint', 'prepared.player_game_stats',
+    'prepared.packed_game', 'prepared.game_key', 'prepared.player_key',
+    'stage.player_blobs', 'stage.player_info', 'error.player_info', 'prepared.player_info',
+    'stage.load_checkpoint']
 
     for table in tables:
         cursor.execute(f'TRUNCATE TABLE {table};')
+
+    # Drop the prepared tables retained by shadow publishes
+    cursor.execute('DELETE FROM generation.retired_table RETURNING retired_table_name;')
+    for (retired_table,) in cursor.fetchall():
+        cursor.execute(f'DROP TABLE IF EXISTS {retired_table};')
+
+    # Readers that cache the reporting data must see the tables emptied
+    cursor.execute('UPDATE generation.load_generation SET generation = generation + 1;')